@@ -1,1251 +1,5983 @@
-import streamlit as st
-import cv2
-from ultralytics import YOLO
-import time
-import numpy as np
-from datetime import datetime, timedelta
-from collections import defaultdict, deque
-import os
-import torch
-import tempfile
-import logging
-import pandas as pd
-import json
-import plotly.express as px
-import plotly.graph_objects as go
-from pathlib import Path
-import threading
-import queue
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-logger = logging.getLogger(__name__)
-
-# Configure Streamlit page
-st.set_page_config(
-    page_title="SurgiSafe Pro - Advanced Surgical Instrument Tracking",
-    page_icon="🏥",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# Enhanced Custom CSS for styling
-st.markdown("""
-<style>
-    .main-header {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 2rem;
-        border-radius: 15px;
-        margin-bottom: 2rem;
-        box-shadow: 0 8px 32px rgba(0,0,0,0.1);
-    }
-    .main-header h1 {
-        color: white;
-        text-align: center;
-        margin: 0;
-        font-size: 2.5rem;
-        text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-    }
-    .main-header p {
-        color: white;
-        text-align: center;
-        margin: 0;
-        font-size: 1.2rem;
-        opacity: 0.9;
-    }
-    .video-container {
-        display: flex;
-        justify-content: center;
-        align-items: center;
-        min-height: 500px;
-        margin-bottom: 20px;
-        border: 3px solid #e0e0e0;
-        border-radius: 15px;
-        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-        box-shadow: inset 0 4px 8px rgba(0,0,0,0.1);
-    }
-    .stat-card {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 10px;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-        margin: 0.5rem 0;
-        border-left: 4px solid #667eea;
-    }
-    .alert-critical {
-        background-color: #fee;
-        border-left: 4px solid #f56565;
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-radius: 5px;
-    }
-    .alert-danger {
-        background-color: #fef5e7;
-        border-left: 4px solid #ed8936;
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-radius: 5px;
-    }
-    .alert-warning {
-        background-color: #fffbf0;
-        border-left: 4px solid #ecc94b;
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-radius: 5px;
-    }
-    .instrument-card {
-        background: white;
-        padding: 1rem;
-        border-radius: 8px;
-        margin: 0.5rem 0;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    }
-    .status-indicator {
-        display: inline-block;
-        width: 12px;
-        height: 12px;
-        border-radius: 50%;
-        margin-right: 8px;
-    }
-    .status-active { background-color: #48bb78; }
-    .status-warning { background-color: #ecc94b; }
-    .status-danger { background-color: #ed8936; }
-    .status-critical { background-color: #f56565; }
-    .status-lost { background-color: #a0aec0; }
-    .confirmation-button {
-        background-color: #48bb78;
-        color: white;
-        padding: 5px 10px;
-        border-radius: 5px;
-        text-align: center;
-        cursor: pointer;
-    }
-    .confirmation-button:hover {
-        background-color: #38a169;
-    }
-</style>
-""", unsafe_allow_html=True)
-
-class SurgiSafeStateManager:
-    def __init__(self):
-        self.detected_instruments = {}
-        self.alerts_queue = deque(maxlen=100)  # Increased capacity
-        self.model_info = {}
-        self.tracking_stats = defaultdict(int)
-        self.processed_frames = 0
-        self.fps_counter = deque(maxlen=30)
-        self.system_status = 'idle'
-        self.last_frame = None
-        self.bbox_history = defaultdict(lambda: deque(maxlen=5))
-        self.pending_confirmations = {}  # For storing instruments awaiting confirmation
-        
-        # Enhanced tracking
-        self.session_start_time = datetime.now()
-        self.performance_metrics = defaultdict(list)
-        self.detection_history = deque(maxlen=1000)  # Store detection history
-        self.alert_history = []
-        self.export_data = []
-
-class InstrumentInfo:
-    def __init__(self, instrument_id, name, bbox, confidence, track_id):
-        self.id = instrument_id
-        self.name = name
-        self.bbox = bbox
-        self.confidence = confidence
-        self.track_id = track_id
-        self.first_detected = datetime.now()
-        self.last_seen = datetime.now()
-        self.detection_count = 1
-        self.status = 'active'
-        self.risk_level = 'normal'
-        self.confidence_history = deque([confidence], maxlen=20)
-        self.position_history = deque([bbox], maxlen=50)
-        self.max_duration = 0
-    
-    def update_position(self, bbox, confidence):
-        self.bbox = bbox
-        self.confidence = confidence
-        self.last_seen = datetime.now()
-        self.detection_count += 1
-        self.confidence_history.append(confidence)
-        self.position_history.append(bbox)
-    
-    def get_duration_minutes(self):
-        duration_minutes = (datetime.now() - self.first_detected).total_seconds() / 60
-        self.max_duration = max(self.max_duration, duration_minutes)
-        return duration_minutes
-    
-    def get_average_confidence(self):
-        return np.mean(list(self.confidence_history)) if self.confidence_history else 0
-    
-    def get_movement_distance(self):
-        if len(self.position_history) < 2:
-            return 0
-        distances = []
-        for i in range(1, len(self.position_history)):
-            prev_center = self._get_bbox_center(self.position_history[i-1])
-            curr_center = self._get_bbox_center(self.position_history[i])
-            distance = np.sqrt((curr_center[0] - prev_center[0])**2 + (curr_center[1] - prev_center[1])**2)
-            distances.append(distance)
-        return np.sum(distances) if distances else 0
-    
-    def _get_bbox_center(self, bbox):
-        return ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
-    
-    def update_risk_level(self):
-        duration = self.get_duration_minutes()
-        if duration > 30:
-            self.risk_level = 'critical'
-        elif duration > 20:
-            self.risk_level = 'danger'
-        elif duration > 10:
-            self.risk_level = 'warning'
-        else:
-            self.risk_level = 'normal'
-    
-    def to_dict(self):
-        """Convert instrument info to dictionary for export"""
-        return {
-            'id': self.id,
-            'name': self.name,
-            'track_id': self.track_id,
-            'first_detected': self.first_detected.isoformat(),
-            'last_seen': self.last_seen.isoformat(),
-            'duration_minutes': self.get_duration_minutes(),
-            'max_duration': self.max_duration,
-            'detection_count': self.detection_count,
-            'status': self.status,
-            'risk_level': self.risk_level,
-            'average_confidence': self.get_average_confidence(),
-            'movement_distance': self.get_movement_distance(),
-            'final_bbox': self.bbox
-        }
-
-class AlertManager:
-    def __init__(self):
-        self.alert_thresholds = {
-            'warning': 10, 
-            'danger': 20, 
-            'critical': 30,
-            'extended': 45  # New threshold for extended procedures
-        }
-        self.sent_alerts = set()
-        self.alert_sounds = {
-            'warning': '🔔',
-            'danger': '⚠️',
-            'critical': '🚨',
-            'extended': '💀'
-        }
-    
-    def check_and_generate_alerts(self, instruments):
-        current_time = datetime.now()
-        new_alerts = []
-        
-        for instrument in instruments.values():
-            duration = instrument.get_duration_minutes()
-            instrument_key = f"{instrument.id}_{instrument.track_id}"
-            
-            # Check for extended duration alert
-            if duration > self.alert_thresholds['extended'] and f"extended_{instrument_key}" not in self.sent_alerts:
-                new_alerts.append({
-                    'timestamp': current_time, 
-                    'level': 'extended', 
-                    'message': f"EXTENDED: {instrument.name} (ID:{instrument.track_id}) > 45min - Review required",
-                    'instrument_id': instrument_key,
-                    'duration': duration
-                })
-                self.sent_alerts.add(f"extended_{instrument_key}")
-            
-            elif duration > self.alert_thresholds['critical'] and f"critical_{instrument_key}" not in self.sent_alerts:
-                new_alerts.append({
-                    'timestamp': current_time, 
-                    'level': 'critical', 
-                    'message': f"CRITICAL: {instrument.name} (ID:{instrument.track_id}) > 30min",
-                    'instrument_id': instrument_key,
-                    'duration': duration
-                })
-                self.sent_alerts.add(f"critical_{instrument_key}")
-            
-            elif duration > self.alert_thresholds['danger'] and f"danger_{instrument_key}" not in self.sent_alerts:
-                new_alerts.append({
-                    'timestamp': current_time, 
-                    'level': 'danger', 
-                    'message': f"DANGER: {instrument.name} (ID:{instrument.track_id}) > 20min",
-                    'instrument_id': instrument_key,
-                    'duration': duration
-                })
-                self.sent_alerts.add(f"danger_{instrument_key}")
-            
-            elif duration > self.alert_thresholds['warning'] and f"warning_{instrument_key}" not in self.sent_alerts:
-                new_alerts.append({
-                    'timestamp': current_time, 
-                    'level': 'warning', 
-                    'message': f"WARNING: {instrument.name} (ID:{instrument.track_id}) > 10min",
-                    'instrument_id': instrument_key,
-                    'duration': duration
-                })
-                self.sent_alerts.add(f"warning_{instrument_key}")
-        
-        return new_alerts
-    
-    def clear_alerts_for_instrument(self, instrument_key):
-        """Clear all alerts for a specific instrument when it's removed"""
-        alerts_to_remove = [alert for alert in self.sent_alerts if instrument_key in alert]
-        for alert in alerts_to_remove:
-            self.sent_alerts.discard(alert)
-
-class YOLOModelManager:
-    def __init__(self):
-        self.model = None
-        self.class_names = {
-            0: "Right_Prograsp_Forceps_labels",
-            1: "Other_labels",
-            2: "Maryland_Bipolar_Forceps_labels",
-            3: "Left_Prograsp_Forceps_labels",
-            4: "Right_Large_Needle_Driver_labels",
-            5: "Left_Large_Needle_Driver_labels",
-            6: "Prograsp_Forceps_labels"
-        }
-        self.class_id_map = {
-            "Right_Prograsp_Forceps_labels": 1,
-            "Other_labels": 2,
-            "Maryland_Bipolar_Forceps_labels": 3,
-            "Left_Prograsp_Forceps_labels": 4,
-            "Right_Large_Needle_Driver_labels": 5,
-            "Left_Large_Needle_Driver_labels": 6,
-            "Prograsp_Forceps_labels": 7
-        }
-        self.model_info = {}
-        self.model_performance = defaultdict(list)
-    
-    def load_model(self, model_path):
-        try:
-            if not os.path.exists(model_path):
-                raise FileNotFoundError(f"Model not found: {model_path}")
-            
-            start_time = time.time()
-            self.model = YOLO(model_path)
-            load_time = time.time() - start_time
-            
-            self.model_info = {
-                'path': model_path,
-                'classes': self.class_names,
-                'num_classes': len(self.class_names),
-                'device': 'cuda' if torch.cuda.is_available() else 'cpu',
-                'load_time': load_time,
-                'model_size': os.path.getsize(model_path) / (1024 * 1024)  # MB
-            }
-            
-            logger.info(f"Model loaded successfully: {self.model_info}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error loading model: {str(e)}")
-            st.error(f"Error loading model: {str(e)}")
-            return False
-    
-    def predict_and_track(self, frame, conf_threshold=0.3, iou_threshold=0.4):
-        if self.model is None:
-            logger.error("No model loaded")
-            return []
-        
-        try:
-            start_time = time.time()
-            
-            # Use YOLOv8 tracking method
-            results = self.model.track(frame, conf=conf_threshold, iou=iou_threshold, persist=True, verbose=False)
-            tracks = []
-            
-            if len(results) > 0 and results[0].boxes is not None:
-                boxes = results[0].boxes
-                if boxes.id is not None:  # Check if tracking IDs are available
-                    track_ids = boxes.id
-                    for box, track_id in zip(boxes, track_ids):
-                        x1, y1, x2, y2 = map(int, box.xyxy[0].cpu().numpy())
-                        confidence = float(box.conf[0].cpu().numpy())
-                        class_id = int(box.cls[0].cpu().numpy())
-                        
-                        if class_id in self.class_names:
-                            class_name = self.class_names[class_id]
-                            fixed_track_id = self.class_id_map[class_name]
-                            tracks.append({
-                                'track_id': fixed_track_id,
-                                'bbox': [x1, y1, x2, y2],
-                                'class_name': class_name,
-                                'confidence': confidence
-                            })
-            
-            # Record performance metrics
-            inference_time = time.time() - start_time
-            self.model_performance['inference_times'].append(inference_time)
-            self.model_performance['detections_per_frame'].append(len(tracks))
-            
-            # Keep only last 100 measurements
-            if len(self.model_performance['inference_times']) > 100:
-                self.model_performance['inference_times'].pop(0)
-                self.model_performance['detections_per_frame'].pop(0)
-            
-            return tracks
-            
-        except Exception as e:
-            logger.error(f"YOLOv8 Tracking Error: {str(e)}")
-            return []
-
-class SurgiSafeCore:
-    def __init__(self):
-        self.model_manager = YOLOModelManager()
-        self.alert_manager = AlertManager()
-    
-    def process_frame(self, frame, conf_threshold=0.3, iou_threshold=0.4):
-        try:
-            start_time = time.time()
-            
-            # Get tracks from model
-            tracks = self.model_manager.predict_and_track(frame, conf_threshold, iou_threshold)
-            
-            # Update instrument tracking
-            self._update_detected_instruments(tracks)
-            self._update_risk_levels()
-            
-            # Generate alerts
-            new_alerts = self.alert_manager.check_and_generate_alerts(
-                st.session_state.state_manager.detected_instruments
-            )
-            
-            # Add alerts to queue and history
-            for alert in new_alerts:
-                st.session_state.state_manager.alerts_queue.append(alert)
-                st.session_state.state_manager.alert_history.append(alert)
-            
-            # Update statistics
-            self._update_stats(tracks)
-            
-            # Calculate FPS
-            processing_time = time.time() - start_time
-            if processing_time > 0:
-                st.session_state.state_manager.fps_counter.append(1.0 / processing_time)
-            
-            # Store detection data for export
-            detection_data = {
-                'timestamp': datetime.now().isoformat(),
-                'frame_number': st.session_state.state_manager.processed_frames,
-                'detections': len(tracks),
-                'processing_time': processing_time,
-                'tracks': tracks
-            }
-            st.session_state.state_manager.detection_history.append(detection_data)
-            
-            # Annotate frame
-            annotated_frame = self._annotate_frame(frame, tracks)
-            
-            return annotated_frame
-            
-        except Exception as e:
-            logger.error(f"Frame processing error: {str(e)}")
-            return frame
-    
-    def _update_detected_instruments(self, tracks):
-        current_time = datetime.now()
-        active_ids = set()
-        
-        for track in tracks:
-            instrument_id = f"{track['class_name']}_{track['track_id']}"
-            active_ids.add(instrument_id)
-            
-            if instrument_id in st.session_state.state_manager.detected_instruments:
-                # Update existing instrument
-                instrument = st.session_state.state_manager.detected_instruments[instrument_id]
-                bbox_history = st.session_state.state_manager.bbox_history[instrument_id]
-                bbox_history.append(track['bbox'])
-                
-                # Calculate averaged bbox for smoother tracking
-                avg_bbox = [
-                    int(sum(b[i] for b in bbox_history) / len(bbox_history))
-                    for i in range(4)
-                ]
-                instrument.update_position(avg_bbox, track['confidence'])
-            else:
-                # Create new instrument
-                instrument = InstrumentInfo(
-                    instrument_id=instrument_id,
-                    name=track['class_name'],
-                    bbox=track['bbox'],
-                    confidence=track['confidence'],
-                    track_id=track['track_id']
-                )
-                st.session_state.state_manager.detected_instruments[instrument_id] = instrument
-                st.session_state.state_manager.bbox_history[instrument_id].append(track['bbox'])
-        
-        # Mark instruments as lost if not seen for too long, with confirmation for critical cases
-        for instrument_id, instrument in list(st.session_state.state_manager.detected_instruments.items()):
-            if instrument_id not in active_ids:
-                time_since_last_seen = (current_time - instrument.last_seen).total_seconds()
-                if time_since_last_seen > 5:  # 5 seconds threshold
-                    if instrument.risk_level == 'critical' and instrument_id not in st.session_state.state_manager.pending_confirmations:
-                        st.session_state.state_manager.pending_confirmations[instrument_id] = instrument
-                        instrument.status = 'pending'
-                    elif instrument_id not in st.session_state.state_manager.pending_confirmations:
-                        instrument.status = 'lost'
-                        self.alert_manager.clear_alerts_for_instrument(instrument_id)
-    
-    def _update_risk_levels(self):
-        for instrument in st.session_state.state_manager.detected_instruments.values():
-            if instrument.status == 'active':
-                instrument.update_risk_level()
-    
-    def _update_stats(self, tracks):
-        st.session_state.state_manager.tracking_stats['total_detections'] += len(tracks)
-        st.session_state.state_manager.tracking_stats['active_tracks'] = len(tracks)
-        st.session_state.state_manager.processed_frames += 1
-        
-        # Update performance metrics
-        current_time = datetime.now()
-        st.session_state.state_manager.performance_metrics['timestamps'].append(current_time)
-        st.session_state.state_manager.performance_metrics['detections'].append(len(tracks))
-        
-        # Keep only last 1000 measurements
-        if len(st.session_state.state_manager.performance_metrics['timestamps']) > 1000:
-            st.session_state.state_manager.performance_metrics['timestamps'].pop(0)
-            st.session_state.state_manager.performance_metrics['detections'].pop(0)
-    
-    def _annotate_frame(self, frame, tracks):
-        annotated_frame = frame.copy()
-        colors = {
-            'normal': (0, 255, 0),      # Green
-            'warning': (0, 255, 255),   # Yellow
-            'danger': (0, 165, 255),    # Orange
-            'critical': (0, 0, 255),    # Red
-            'extended': (128, 0, 128),  # Purple
-            'lost': (128, 128, 128),    # Gray
-            'pending': (255, 165, 0)    # Orange for pending confirmation
-        }
-        
-        for track in tracks:
-            instrument_id = f"{track['class_name']}_{track['track_id']}"
-            if instrument_id in st.session_state.state_manager.detected_instruments:
-                instrument = st.session_state.state_manager.detected_instruments[instrument_id]
-                color = colors.get(instrument.risk_level if instrument.status != 'pending' else 'pending', (255, 255, 255))
-                
-                x1, y1, x2, y2 = instrument.bbox
-                
-                # Draw bounding box with thickness based on risk level
-                thickness = 3 if instrument.risk_level in ['critical', 'extended'] else 2
-                cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), color, thickness)
-                
-                # Prepare labels
-                duration = instrument.get_duration_minutes()
-                confidence = instrument.get_average_confidence()
-                
-                # Main label
-                label = f"{instrument.name.replace('_labels', '')} (ID:{instrument.track_id})"
-                status_text = f"{duration:.1f}min | {confidence:.2f} ({instrument.risk_level.upper() if instrument.status != 'pending' else 'PENDING'})"
-                
-                # Draw labels with background
-                label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
-                status_size = cv2.getTextSize(status_text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)[0]
-                
-                # Draw background rectangles
-                cv2.rectangle(annotated_frame, (x1, y1 - 35), (x1 + max(label_size[0], status_size[0]) + 10, y1), color, -1)
-                
-                # Draw text
-                cv2.putText(annotated_frame, label, (x1 + 5, y1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                cv2.putText(annotated_frame, status_text, (x1 + 5, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-        
-        # Add system information overlay
-        self._add_system_overlay(annotated_frame)
-        
-        return annotated_frame
-    
-    def _add_system_overlay(self, frame):
-        """Add system information overlay to the frame"""
-        # System stats
-        timestamp = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        fps = np.mean(list(st.session_state.state_manager.fps_counter)) if st.session_state.state_manager.fps_counter else 0
-        active_instruments = len([i for i in st.session_state.state_manager.detected_instruments.values() if i.status == 'active'])
-        
-        # Session duration
-        session_duration = datetime.now() - st.session_state.state_manager.session_start_time
-        session_minutes = int(session_duration.total_seconds() / 60)
-        
-        # Overlay background
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (10, 10), (400, 120), (0, 0, 0), -1)
-        cv2.addWeighted(overlay, 0.7, frame, 0.3, 0, frame)
-        
-        # System information
-        info_lines = [
-            f"Time: {timestamp}",
-            f"FPS: {fps:.1f} | Frame: {st.session_state.state_manager.processed_frames}",
-            f"Active Instruments: {active_instruments}",
-            f"Session Duration: {session_minutes}min"
-        ]
-        
-        for i, line in enumerate(info_lines):
-            cv2.putText(frame, line, (15, 30 + i * 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (102, 126, 234), 1)
-
-# Initialize session state
-def initialize_session_state():
-    try:
-        if 'state_manager' not in st.session_state:
-            st.session_state.state_manager = SurgiSafeStateManager()
-        if 'surgisafe_core' not in st.session_state:
-            st.session_state.surgisafe_core = SurgiSafeCore()
-        if 'is_running' not in st.session_state:
-            st.session_state.is_running = False
-        if 'video_source' not in st.session_state:
-            st.session_state.video_source = None
-        if 'cap' not in st.session_state:
-            st.session_state.cap = None
-        if 'conf_threshold' not in st.session_state:
-            st.session_state.conf_threshold = 0.05
-        if 'iou_threshold' not in st.session_state:
-            st.session_state.iou_threshold = 0.2
-        if 'target_width' not in st.session_state:
-            st.session_state.target_width = 640
-        if 'auto_export' not in st.session_state:
-            st.session_state.auto_export = False
-        if 'alert_sound' not in st.session_state:
-            st.session_state.alert_sound = True
-        if 'show_confidence' not in st.session_state:
-            st.session_state.show_confidence = True
-            
-    except Exception as e:
-        logger.error(f"Error initializing session state: {str(e)}")
-        st.error(f"Error initializing session state: {str(e)}")
-
-def create_performance_dashboard():
-    """Create enhanced performance dashboard"""
-    st.subheader("📊 Performance Dashboard")
-    
-    # Create tabs for different views
-    tab1, tab2, tab3, tab4 = st.tabs(["📈 Real-time Stats", "🔍 Instrument Analysis", "⚠️ Alert History", "📋 Export Data"])
-    
-    with tab1:
-        # Real-time metrics
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            active_instruments = len([i for i in st.session_state.state_manager.detected_instruments.values() if i.status == 'active'])
-            st.markdown(f"""
-            <div class="stat-card">
-                <h3>🔧 Active Instruments</h3>
-                <h2 style="color: #667eea;">{active_instruments}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col2:
-            fps = np.mean(list(st.session_state.state_manager.fps_counter)) if st.session_state.state_manager.fps_counter else 0
-            st.markdown(f"""
-            <div class="stat-card">
-                <h3>⚡ FPS</h3>
-                <h2 style="color: #667eea;">{fps:.1f}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col3:
-            total_alerts = len(st.session_state.state_manager.alert_history)
-            st.markdown(f"""
-            <div class="stat-card">
-                <h3>🚨 Total Alerts</h3>
-                <h2 style="color: #667eea;">{total_alerts}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col4:
-            session_duration = datetime.now() - st.session_state.state_manager.session_start_time
-            session_minutes = int(session_duration.total_seconds() / 60)
-            st.markdown(f"""
-            <div class="stat-card">
-                <h3>⏱️ Session Duration</h3>
-                <h2 style="color: #667eea;">{session_minutes}min</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Performance chart
-        if st.session_state.state_manager.performance_metrics['timestamps']:
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=st.session_state.state_manager.performance_metrics['timestamps'],
-                y=st.session_state.state_manager.performance_metrics['detections'],
-                mode='lines+markers',
-                name='Detections per Frame',
-                line=dict(color='#667eea')
-            ))
-            fig.update_layout(
-                title="Detection Performance Over Time",
-                xaxis_title="Time",
-                yaxis_title="Number of Detections",
-                height=400
-            )
-            st.plotly_chart(fig, use_container_width=True)
-    
-    with tab2:
-        # Instrument analysis
-        if st.session_state.state_manager.detected_instruments:
-            instruments_data = []
-            for instrument in st.session_state.state_manager.detected_instruments.values():
-                instruments_data.append({
-                    'Name': instrument.name.replace('_labels', ''),
-                    'Track ID': instrument.track_id,
-                    'Duration (min)': f"{instrument.get_duration_minutes():.1f}",
-                    'Status': instrument.status,
-                    'Risk Level': instrument.risk_level,
-                    'Confidence': f"{instrument.get_average_confidence():.2f}",
-                    'Detections': instrument.detection_count,
-                    'Movement': f"{instrument.get_movement_distance():.0f}px"
-                })
-            
-            df = pd.DataFrame(instruments_data)
-            st.dataframe(df, use_container_width=True)
-            
-            # Risk level distribution
-            risk_counts = df['Risk Level'].value_counts()
-            fig_pie = px.pie(
-                values=risk_counts.values, 
-                names=risk_counts.index,
-                title="Risk Level Distribution",
-                color_discrete_map={
-                    'normal': '#48bb78',
-                    'warning': '#ecc94b',
-                    'danger': '#ed8936',
-                    'critical': '#f56565'
-                }
-            )
-            st.plotly_chart(fig_pie, use_container_width=True)
-        else:
-            st.info("No instruments detected yet.")
-    
-    with tab3:
-        # Alert history
-        if st.session_state.state_manager.alert_history:
-            st.subheader("Recent Alerts")
-            
-            # Show recent alerts with confirmation for critical lost instruments
-            recent_alerts = list(st.session_state.state_manager.alerts_queue)[-10:]
-            for alert in reversed(recent_alerts):
-                alert_class = f"alert-{alert['level']}"
-                timestamp_str = alert['timestamp'].strftime("%H:%M:%S")
-                if alert['level'] == 'critical' and alert['instrument_id'] in st.session_state.state_manager.pending_confirmations:
-                    instrument = st.session_state.state_manager.pending_confirmations[alert['instrument_id']]
-                    if st.button(f"✅ Confirm Loss for {instrument.name} (ID:{instrument.track_id})", key=f"confirm_{alert['instrument_id']}"):
-                        instrument.status = 'lost'
-                        del st.session_state.state_manager.pending_confirmations[alert['instrument_id']]
-                        self.alert_manager.clear_alerts_for_instrument(alert['instrument_id'])
-                        st.success(f"Confirmed loss for {instrument.name} (ID:{instrument.track_id})")
-                st.markdown(f"""
-                <div class="{alert_class}">
-                    <strong>{timestamp_str}</strong> - {alert['message']}
-                </div>
-                """, unsafe_allow_html=True)
-            
-            # Alert statistics
-            if len(st.session_state.state_manager.alert_history) > 0:
-                alert_df = pd.DataFrame(st.session_state.state_manager.alert_history)
-                alert_counts = alert_df['level'].value_counts()
-                
-                fig_bar = px.bar(
-                    x=alert_counts.index,
-                    y=alert_counts.values,
-                    title="Alert Type Distribution",
-                    color=alert_counts.index,
-                    color_discrete_map={
-                        'warning': '#ecc94b',
-                        'danger': '#ed8936',
-                        'critical': '#f56565',
-                        'extended': '#805ad5'
-                    }
-                )
-                st.plotly_chart(fig_bar, use_container_width=True)
-        else:
-            st.info("No alerts generated yet.")
-    
-    with tab4:
-        # Export data
-        st.subheader("📤 Export Data")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            if st.button("📊 Export Instrument Data"):
-                if st.session_state.state_manager.detected_instruments:
-                    export_data = []
-                    for instrument in st.session_state.state_manager.detected_instruments.values():
-                        export_data.append(instrument.to_dict())
-                    
-                    df_export = pd.DataFrame(export_data)
-                    csv = df_export.to_csv(index=False)
-                    
-                    st.download_button(
-                        label="⬇️ Download Instrument Data (CSV)",
-                        data=csv,
-                        file_name=f"instrument_data_{int(datetime.now().timestamp())}.csv",
-                        mime="text/csv"
-                    )
-                else:
-                    st.warning("No instrument data to export.")
-        
-        with col2:
-            if st.button("📋 Export Alert History"):
-                if st.session_state.state_manager.alert_history:
-                    alert_export = []
-                    for alert in st.session_state.state_manager.alert_history:
-                        alert_export.append({
-                            'timestamp': alert['timestamp'].isoformat(),
-                            'level': alert['level'],
-                            'message': alert['message'],
-                            'instrument_id': alert.get('instrument_id', ''),
-                            'duration': alert.get('duration', 0)
-                        })
-                    
-                    df_alerts = pd.DataFrame(alert_export)
-                    csv_alerts = df_alerts.to_csv(index=False)
-                    
-                    st.download_button(
-                        label="⬇️ Download Alert History (CSV)",
-                        data=csv_alerts,
-                        file_name=f"alert_history_{int(datetime.now().timestamp())}.csv",
-                        mime="text/csv"
-                    )
-                else:
-                    st.warning("No alert history to export.")
-        
-        # Detection history export
-        if st.button("📈 Export Detection History"):
-            if st.session_state.state_manager.detection_history:
-                detection_export = []
-                for detection in st.session_state.state_manager.detection_history:
-                    detection_export.append({
-                        'timestamp': detection['timestamp'],
-                        'frame_number': detection['frame_number'],
-                        'detections_count': detection['detections'],
-                        'processing_time': detection['processing_time']
-                    })
-                
-                df_detections = pd.DataFrame(detection_export)
-                csv_detections = df_detections.to_csv(index=False)
-                
-                st.download_button(
-                    label="⬇️ Download Detection History (CSV)",
-                    data=csv_detections,
-                    file_name=f"detection_history_{int(datetime.now().timestamp())}.csv",
-                    mime="text/csv"
-                )
-            else:
-                st.warning("No detection history to export.")
-
-def display_active_instruments():
-    """Display active instruments in an enhanced format"""
-    st.subheader("🔧 Active Instruments")
-    
-    active_instruments = [i for i in st.session_state.state_manager.detected_instruments.values() if i.status == 'active']
-    
-    if not active_instruments:
-        st.info("No active instruments detected.")
-        return
-    
-    for instrument in active_instruments:
-        duration = instrument.get_duration_minutes()
-        confidence = instrument.get_average_confidence()
-        
-        # Status indicator
-        status_class = f"status-{instrument.risk_level}"
-        
-        col1, col2 = st.columns([3, 1])
-        
-        with col1:
-            st.markdown(f"""
-            <div class="instrument-card">
-                <h4>
-                    <span class="status-indicator {status_class}"></span>
-                    {instrument.name.replace('_labels', '')} (Track ID: {instrument.track_id})
-                </h4>
-                <p><strong>Duration:</strong> {duration:.1f} minutes</p>
-                <p><strong>Confidence:</strong> {confidence:.2f}</p>
-                <p><strong>Risk Level:</strong> {instrument.risk_level.upper()}</p>
-                <p><strong>Detections:</strong> {instrument.detection_count}</p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col2:
-            # Mini chart for confidence over time
-            if len(instrument.confidence_history) > 1:
-                fig_mini = go.Figure()
-                fig_mini.add_trace(go.Scatter(
-                    y=list(instrument.confidence_history),
-                    mode='lines',
-                    name='Confidence',
-                    line=dict(color='#667eea', width=2)
-                ))
-                fig_mini.update_layout(
-                    height=100,
-                    margin=dict(l=0, r=0, t=0, b=0),
-                    showlegend=False,
-                    xaxis=dict(showgrid=False, showticklabels=False),
-                    yaxis=dict(showgrid=False, range=[0, 1])
-                )
-                st.plotly_chart(fig_mini, use_container_width=True)
-
-def generate_comprehensive_report():
-    """Generate a comprehensive report with all tracking data"""
-    report_data = {
-        'session_info': {
-            'start_time': st.session_state.state_manager.session_start_time.isoformat(),
-            'end_time': datetime.now().isoformat(),
-            'duration_minutes': (datetime.now() - st.session_state.state_manager.session_start_time).total_seconds() / 60,
-            'total_frames': st.session_state.state_manager.processed_frames,
-            'model_info': st.session_state.state_manager.model_info
-        },
-        'instruments': [instrument.to_dict() for instrument in st.session_state.state_manager.detected_instruments.values()],
-        'alerts': [
-            {
-                'timestamp': alert['timestamp'].isoformat(),
-                'level': alert['level'],
-                'message': alert['message'],
-                'instrument_id': alert.get('instrument_id', ''),
-                'duration': alert.get('duration', 0)
-            }
-            for alert in st.session_state.state_manager.alert_history
-        ],
-        'statistics': dict(st.session_state.state_manager.tracking_stats)
-    }
-    
-    return json.dumps(report_data, indent=2)
-
-def process_video(video_placeholder):
-    """Enhanced video processing with better error handling and performance monitoring"""
-    try:
-        if st.session_state.cap is None:
-            st.session_state.cap = cv2.VideoCapture(st.session_state.video_source)
-            if not st.session_state.cap.isOpened():
-                logger.error(f"Failed to open video source: {st.session_state.video_source}")
-                st.error(f"Failed to open video source: {st.session_state.video_source}")
-                st.session_state.is_running = False
-                return
-            
-            logger.info(f"Video loaded: {st.session_state.video_source}")
-        
-        # Get video properties
-        total_frames = int(st.session_state.cap.get(cv2.CAP_PROP_FRAME_COUNT)) if st.session_state.video_source != 0 else -1
-        fps = st.session_state.cap.get(cv2.CAP_PROP_FPS) if st.session_state.video_source != 0 else 30
-        
-        logger.info(f"Video properties - Total frames: {total_frames}, FPS: {fps}")
-        
-        # Processing loop
-        frame_skip = 1  # Process every frame by default
-        frame_count = 0
-        
-        while st.session_state.is_running:
-            ret, frame = st.session_state.cap.read()
-            if not ret:
-                logger.info(f"End of video or read error at frame {frame_count}")
-                st.session_state.is_running = False
-                break
-            
-            frame_count += 1
-            
-            # Skip frames if needed for performance
-            if frame_count % frame_skip != 0:
-                continue
-            
-            # Resize frame with aspect ratio preservation
-            original_height, original_width = frame.shape[:2]
-            target_width = st.session_state.get('target_width', 640)
-            target_height = int(original_height * (target_width / original_width))
-            frame = cv2.resize(frame, (target_width, target_height))
-            
-            # Process frame
-            annotated_frame = st.session_state.surgisafe_core.process_frame(
-                frame, st.session_state.conf_threshold, st.session_state.iou_threshold
-            )
-            
-            # Convert to RGB for display
-            annotated_frame_rgb = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
-            st.session_state.state_manager.last_frame = annotated_frame_rgb
-            
-            # Update display
-            video_placeholder.image(annotated_frame_rgb, channels="RGB", use_container_width=True)
-            
-            # Adaptive frame rate control
-            current_fps = np.mean(list(st.session_state.state_manager.fps_counter)) if st.session_state.state_manager.fps_counter else 0
-            if current_fps < 10:  # If FPS is too low, start skipping frames
-                frame_skip = min(frame_skip + 1, 3)
-            elif current_fps > 20:  # If FPS is good, reduce frame skipping
-                frame_skip = max(frame_skip - 1, 1)
-            
-            # Small delay to prevent overwhelming the system
-            time.sleep(0.03)  # ~30 FPS max
-    
-    except Exception as e:
-        logger.error(f"Video processing error: {str(e)}")
-        st.error(f"Video processing error: {str(e)}")
-        st.session_state.is_running = False
-    
-    finally:
-        if st.session_state.cap:
-            st.session_state.cap.release()
-            st.session_state.cap = None
-
-def main():
-    initialize_session_state()
-    
-    # Enhanced Header
-    st.markdown("""
-    <div class="main-header">
-        <h1>🏥 SurgiSafe Pro</h1>
-        <p>Advanced Intelligent Surgical Instrument Tracking & Safety System</p>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    # Main layout
-    main_col1, main_col2 = st.columns([3, 1])
-    
-    with main_col1:
-        # Video Display Section
-        st.subheader("📺 Live Analysis")
-        video_container = st.container()
-        with video_container:
-            st.markdown('<div class="video-container">', unsafe_allow_html=True)
-            video_placeholder = st.empty()
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Progress bar for video processing
-        progress_placeholder = st.empty()
-        
-        # Video processing
-        if st.session_state.is_running and st.session_state.video_source is not None:
-            process_video(video_placeholder)
-            
-            # Update progress for video files
-            if st.session_state.video_source != 0 and st.session_state.cap:
-                total_frames = int(st.session_state.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                if total_frames > 0:
-                    progress = min(st.session_state.state_manager.processed_frames / total_frames, 1.0)
-                    progress_placeholder.progress(
-                        progress, 
-                        f"Progress: {st.session_state.state_manager.processed_frames}/{total_frames} frames ({progress*100:.1f}%)"
-                    )
-        else:
-            video_placeholder.info("🎬 Ready to analyze. Load a model, select video source, and start analysis.")
-    
-    with main_col2:
-        # Real-time Statistics Panel
-        st.subheader("📊 Live Statistics")
-        
-        # System Status
-        status_color = {
-            'idle': '🟡',
-            'running': '🟢',
-            'stopped': '🔴',
-            'error': '🔴'
-        }
-        status = st.session_state.state_manager.system_status
-        st.markdown(f"**Status:** {status_color.get(status, '⚪')} {status.upper()}")
-        
-        # Key Metrics
-        active_instruments = len([i for i in st.session_state.state_manager.detected_instruments.values() if i.status == 'active'])
-        fps = np.mean(list(st.session_state.state_manager.fps_counter)) if st.session_state.state_manager.fps_counter else 0
-        total_alerts = len(st.session_state.state_manager.alert_history)
-        
-        st.metric("Active Instruments", active_instruments)
-        st.metric("FPS", f"{fps:.1f}")
-        st.metric("Total Alerts", total_alerts)
-        
-        # Recent Alerts
-        st.subheader("🚨 Recent Alerts")
-        recent_alerts = list(st.session_state.state_manager.alerts_queue)[-5:]
-        if recent_alerts:
-            for alert in reversed(recent_alerts):
-                alert_emoji = {'warning': '⚠️', 'danger': '🔶', 'critical': '🚨', 'extended': '💀'}
-                st.write(f"{alert_emoji.get(alert['level'], '📢')} {alert['message']}")
-        else:
-            st.info("No alerts yet")
-        
-        # Active Instruments Summary
-        display_active_instruments()
-    
-    # Enhanced Sidebar Configuration
-    with st.sidebar:
-        st.header("⚙️ System Configuration")
-        
-        # Model Configuration Section
-        st.subheader("🤖 AI Model")
-        model_path = st.text_input(
-            "Model Path", 
-            value="C:/Users/Hp/runs/train/exp_endovis_i5/weights/best.pt",
-            help="Path to your trained YOLO model file (.pt)"
-        )
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button("🔄 Load Model", type="primary"):
-                with st.spinner("Loading AI model..."):
-                    result = st.session_state.surgisafe_core.model_manager.load_model(model_path)
-                    if result:
-                        st.session_state.state_manager.model_info = st.session_state.surgisafe_core.model_manager.model_info
-                        st.success(f"✅ Model loaded successfully!")
-                        st.info(f"Classes: {st.session_state.state_manager.model_info['num_classes']}")
-                        st.info(f"Device: {st.session_state.state_manager.model_info['device']}")
-                    else:
-                        st.error("❌ Failed to load model")
-        
-        with col2:
-            if st.session_state.state_manager.model_info:
-                st.success("✅ Ready")
-            else:
-                st.error("❌ No Model")
-        
-        st.divider()
-        
-        # Video Source Configuration
-        st.subheader("📹 Video Input")
-        
-        # File upload option
-        uploaded_file = st.file_uploader(
-            "Upload Video File", 
-            type=['mp4', 'avi', 'mov', 'mkv'],
-            help="Supported formats: MP4, AVI, MOV, MKV"
-        )
-        
-        if uploaded_file:
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-                    tmp_file.write(uploaded_file.read())
-                    st.session_state.video_source = tmp_file.name
-                
-                # Validate video file
-                cap = cv2.VideoCapture(st.session_state.video_source)
-                if not cap.isOpened():
-                    raise Exception("Invalid video file")
-                
-                total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                duration = total_frames / fps if fps > 0 else 0
-                
-                cap.release()
-                
-                st.success("✅ Video loaded successfully")
-                st.info(f"Duration: {duration:.1f}s | Frames: {total_frames} | FPS: {fps:.1f}")
-                
-            except Exception as e:
-                st.error(f"❌ Error processing video: {str(e)}")
-        
-        st.divider()
-        
-        # Detection Parameters
-        st.subheader("🎯 Detection Settings")
-        
-        st.session_state.conf_threshold = st.slider(
-            "Confidence Threshold", 
-            0.01, 1.0, 0.05, 0.01,
-            help="Minimum confidence for detections"
-        )
-        
-        st.session_state.iou_threshold = st.slider(
-            "IoU Threshold", 
-            0.1, 1.0, 0.2, 0.05,
-            help="Intersection over Union threshold for NMS"
-        )
-        
-        st.divider()
-        
-        # Video Processing Settings
-        st.subheader("📏 Processing Settings")
-        
-        st.session_state.target_width = st.slider(
-            "Video Width", 
-            320, 1280, 640, 32,
-            help="Target width for processing (affects performance)"
-        )
-        
-        # Advanced settings
-        with st.expander("🔧 Advanced Settings"):
-            st.session_state.alert_sound = st.checkbox("Enable Alert Sounds", value=True)
-            st.session_state.show_confidence = st.checkbox("Show Confidence Values", value=True)
-            st.session_state.auto_export = st.checkbox("Auto-export data on session end", value=False)
-            
-            # Alert thresholds customization
-            st.write("**Alert Thresholds (minutes):**")
-            warning_threshold = st.number_input("Warning", min_value=1, max_value=60, value=10)
-            danger_threshold = st.number_input("Danger", min_value=1, max_value=60, value=20)
-            critical_threshold = st.number_input("Critical", min_value=1, max_value=60, value=30)
-            
-            # Update thresholds in alert manager
-            if hasattr(st.session_state.surgisafe_core, 'alert_manager'):
-                st.session_state.surgisafe_core.alert_manager.alert_thresholds.update({
-                    'warning': warning_threshold,
-                    'danger': danger_threshold,
-                    'critical': critical_threshold
-                })
-    
-    # Enhanced Control Panel
-    st.subheader("🎮 Control Panel")
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        if st.button("▶️ Start Analysis", disabled=st.session_state.is_running, type="primary"):
-            if not st.session_state.state_manager.model_info:
-                st.error("❌ Please load a model first")
-            elif st.session_state.video_source is None:
-                st.error("❌ Please select a video source")
-            else:
-                st.session_state.is_running = True
-                st.session_state.state_manager.system_status = 'running'
-                st.success("✅ Analysis started successfully!")
-                st.rerun()
-    
-    with col2:
-        if st.button("⏹️ Stop Analysis", disabled=not st.session_state.is_running):
-            st.session_state.is_running = False
-            st.session_state.state_manager.system_status = 'stopped'
-            if st.session_state.cap:
-                st.session_state.cap.release()
-                st.session_state.cap = None
-            st.success("✅ Analysis stopped")
-            st.rerun()
-    
-    with col3:
-        if st.button("🔄 Reset Session"):
-            # Reset all session data
-            for key in list(st.session_state.keys()):
-                if key != 'surgisafe_core' or key != 'state_manager':
-                    del st.session_state[key]
-            st.session_state.state_manager = SurgiSafeStateManager()
-            st.success("✅ Session reset")
-            st.rerun()
-    
-    with col4:
-        if st.button("📊 Generate Report"):
-            if st.session_state.state_manager.detected_instruments or st.session_state.state_manager.alert_history:
-                report_data = generate_comprehensive_report()
-                st.download_button(
-                    label="⬇️ Download Full Report (JSON)",
-                    data=report_data,
-                    file_name=f"surgisafe_full_report_{int(datetime.now().timestamp())}.json",
-                    mime="application/json"
-                )
-            else:
-                st.warning("No data available for report generation")
-    
-    # Enhanced Dashboard
-    if st.session_state.state_manager.processed_frames > 0:
-        st.divider()
-        create_performance_dashboard()
-
-def simple_chatbot():
-    st.sidebar.subheader("💬 Support Chatbot")
-    user_input = st.sidebar.text_input("Posez-moi une question sur SurgiSafe Pro :")
-    
-    if user_input:
-        responses = {
-            "comment fonctionne-t-il ?": "SurgiSafe Pro détecte et suit les instruments chirurgicaux en temps réel avec YOLOv8, génère des alertes basées sur la durée, et offre des statistiques via une interface intuitive.",
-            "quels instruments sont détectés ?": "Il détecte des instruments comme Right_Prograsp_Forceps, Maryland_Bipolar_Forceps, et d'autres listés dans le modèle.",
-            "comment exporter les données ?": "Vous pouvez exporter les données des instruments, alertes, et historique via les boutons dans l'onglet 'Export Data'.",
-            "aide": "Tapez une question spécifique ou consultez la barre latérale pour les réglages !"
-        }
-        response = responses.get(user_input.lower(), "Désolé, je n'ai pas compris. Essayez 'aide' pour plus d'options.")
-        st.sidebar.write(f"🤖 Réponse : {response}")
-
-if __name__ == "__main__":
-    main()
-    simple_chatbot()
+import streamlit as st
+import cv2
+from ultralytics import YOLO
+import time
+import numpy as np
+from datetime import datetime, timedelta
+from collections import defaultdict, deque
+import os
+import torch
+import tempfile
+import io
+import logging
+import pandas as pd
+import json
+import plotly.express as px
+import plotly.graph_objects as go
+from pathlib import Path
+import threading
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+import shutil
+import uuid
+import hashlib
+import zipfile
+import weakref
+import subprocess
+import socket
+import random
+import asyncio
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # Optional: a greedy matcher is used instead
+    linear_sum_assignment = None
+
+try:
+    import websockets
+except ImportError:  # Optional: live state broadcasting is unavailable without it
+    websockets = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Configure Streamlit page
+st.set_page_config(
+    page_title="SurgiSafe Pro - Advanced Surgical Instrument Tracking",
+    page_icon="🏥",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+# Enhanced Custom CSS for styling
+st.markdown("""
+<style>
+    .main-header {
+        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+        padding: 2rem;
+        border-radius: 15px;
+        margin-bottom: 2rem;
+        box-shadow: 0 8px 32px rgba(0,0,0,0.1);
+    }
+    .main-header h1 {
+        color: white;
+        text-align: center;
+        margin: 0;
+        font-size: 2.5rem;
+        text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
+    }
+    .main-header p {
+        color: white;
+        text-align: center;
+        margin: 0;
+        font-size: 1.2rem;
+        opacity: 0.9;
+    }
+    .video-container {
+        display: flex;
+        justify-content: center;
+        align-items: center;
+        min-height: 500px;
+        margin-bottom: 20px;
+        border: 3px solid #e0e0e0;
+        border-radius: 15px;
+        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
+        box-shadow: inset 0 4px 8px rgba(0,0,0,0.1);
+    }
+    .stat-card {
+        background: white;
+        padding: 1.5rem;
+        border-radius: 10px;
+        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
+        margin: 0.5rem 0;
+        border-left: 4px solid #667eea;
+    }
+    .alert-critical {
+        background-color: #fee;
+        border-left: 4px solid #f56565;
+        padding: 1rem;
+        margin: 0.5rem 0;
+        border-radius: 5px;
+    }
+    .alert-danger {
+        background-color: #fef5e7;
+        border-left: 4px solid #ed8936;
+        padding: 1rem;
+        margin: 0.5rem 0;
+        border-radius: 5px;
+    }
+    .alert-warning {
+        background-color: #fffbf0;
+        border-left: 4px solid #ecc94b;
+        padding: 1rem;
+        margin: 0.5rem 0;
+        border-radius: 5px;
+    }
+    .instrument-card {
+        background: white;
+        padding: 1rem;
+        border-radius: 8px;
+        margin: 0.5rem 0;
+        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    }
+    .status-indicator {
+        display: inline-block;
+        width: 12px;
+        height: 12px;
+        border-radius: 50%;
+        margin-right: 8px;
+    }
+    .status-active { background-color: #48bb78; }
+    .status-warning { background-color: #ecc94b; }
+    .status-danger { background-color: #ed8936; }
+    .status-critical { background-color: #f56565; }
+    .status-lost { background-color: #a0aec0; }
+    .confirmation-button {
+        background-color: #48bb78;
+        color: white;
+        padding: 5px 10px;
+        border-radius: 5px;
+        text-align: center;
+        cursor: pointer;
+    }
+    .confirmation-button:hover {
+        background-color: #38a169;
+    }
+</style>
+""", unsafe_allow_html=True)
+
+SESSION_DATA_DIR = Path.home() / ".surgisafe" / "sessions"
+
+def _json_default(value):
+    """JSON fallback for NumPy scalars and datetimes found in session records"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def alert_to_export(alert):
+    """Flat export record for an in-memory or spilled alert"""
+    timestamp = alert['timestamp']
+    return {
+        'timestamp': timestamp if isinstance(timestamp, str) else timestamp.isoformat(),
+        'level': alert['level'],
+        'message': alert['message'],
+        'instrument_id': alert.get('instrument_id', ''),
+        'duration': alert.get('duration', 0),
+        'clip': alert.get('clip', ''),
+        'thumbnail': alert.get('thumbnail', '')
+    }
+
+class RetentionPolicy:
+    """How long session records stay in memory before being compacted to disk"""
+    def __init__(self, inactive_instrument_seconds=600, max_inactive_instruments=100,
+                 max_alert_history=500, max_export_rows=1000, compaction_interval_frames=100):
+        self.inactive_instrument_seconds = inactive_instrument_seconds
+        self.max_inactive_instruments = max_inactive_instruments
+        self.max_alert_history = max_alert_history
+        self.max_export_rows = max_export_rows
+        self.compaction_interval_frames = compaction_interval_frames
+
+class SessionSpillStore:
+    """Append-only JSON Lines files holding the records compacted out of memory"""
+    def __init__(self, session_dir):
+        self.session_dir = Path(session_dir)
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+        self.counts = defaultdict(int)
+    
+    def append(self, kind, records):
+        if not records:
+            return
+        with open(self.session_dir / f"{kind}.jsonl", 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, default=_json_default) + "\n")
+        self.counts[kind] += len(records)
+    
+    def iter_records(self, kind):
+        path = self.session_dir / f"{kind}.jsonl"
+        if not path.exists():
+            return
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+class SessionCheckpointer:
+    """Crash-safe session persistence: a per-frame delta journal plus periodic atomic snapshots, written on a background thread"""
+    def __init__(self, session_id, root=None, snapshot_interval_frames=500, queue_size=1000):
+        self.session_id = session_id
+        self.session_dir = Path(root or SESSION_DATA_DIR) / session_id
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+        self.snapshot_interval_frames = snapshot_interval_frames
+        self.video = {}
+        self.sequence = 0
+        self.needs_snapshot = True
+        self.known_instruments = {}
+        self.sent_alerts = set()
+        self.pending = set()
+        self.export_rows = 0  # Export rows journaled so far, spilled ones included
+        self.write_times = deque(maxlen=100)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+    
+    @staticmethod
+    def _instrument_signature(instrument):
+        return instrument.detection_count, instrument.status, instrument.risk_level
+    
+    def capture(self, state_manager, core, position):
+        """Full session state as plain data"""
+        instruments = state_manager.detected_instruments
+        return {
+            'session_id': self.session_id,
+            'sequence': self.sequence,
+            'saved_at': datetime.now().isoformat(),
+            'session_start_time': state_manager.session_start_time.isoformat(),
+            'video': self.video,
+            'position': position,
+            'processed_frames': state_manager.processed_frames,
+            'instruments': {key: instrument.to_state() for key, instrument in instruments.items()},
+            'pending': list(state_manager.pending_confirmations),
+            'sent_alerts': list(core.alert_manager.sent_alerts),
+            'alert_level_counts': dict(state_manager.alert_level_counts),
+            'alerts': list(state_manager.alerts_queue),
+            # Unspilled history and export rows; the spill counters let load() drop rows spilled after this snapshot
+            'alert_history': list(state_manager.alert_history),
+            'alerts_spilled': state_manager.alerts_spilled,
+            'export_data': list(state_manager.export_data),
+            'export_spilled': state_manager.export_spilled,
+            'tracker': core.model_manager.tracker.get_state()
+        }
+    
+    def record_frame(self, state_manager, core, new_alerts, position):
+        """Queue what changed in this frame; serialization and disk writes happen on the writer thread"""
+        start_time = time.perf_counter()
+        self.sequence += 1
+        instruments = state_manager.detected_instruments
+        
+        if self.needs_snapshot or self.sequence % self.snapshot_interval_frames == 0:
+            record = ('snapshot', self.capture(state_manager, core, position))
+            self.known_instruments = {key: self._instrument_signature(i) for key, i in instruments.items()}
+            self.sent_alerts = set(core.alert_manager.sent_alerts)
+            self.pending = set(state_manager.pending_confirmations)
+            self.export_rows = state_manager.export_spilled + len(state_manager.export_data)
+            self.needs_snapshot = False
+        else:
+            changed = {}
+            for key, instrument in instruments.items():
+                signature = self._instrument_signature(instrument)
+                if self.known_instruments.get(key) != signature:
+                    self.known_instruments[key] = signature
+                    changed[key] = instrument.to_state()
+            removed = [key for key in self.known_instruments if key not in instruments] if len(self.known_instruments) != len(instruments) else []
+            for key in removed:
+                del self.known_instruments[key]
+            sent_alerts = core.alert_manager.sent_alerts
+            pending = state_manager.pending_confirmations.keys()
+            delta = {
+                'sequence': self.sequence,
+                'position': position,
+                'processed_frames': state_manager.processed_frames,
+                'instruments': changed,
+                'removed': removed,
+                'alerts': new_alerts,
+                'sent_added': list(sent_alerts - self.sent_alerts),
+                'sent_removed': list(self.sent_alerts - sent_alerts),
+                'alerts_spilled': state_manager.alerts_spilled,
+                'export_spilled': state_manager.export_spilled,
+                'tracker': core.model_manager.tracker.get_state()
+            }
+            export_rows = state_manager.export_spilled + len(state_manager.export_data)
+            if export_rows > self.export_rows:
+                delta['export_added'] = state_manager.export_data[len(state_manager.export_data) - (export_rows - self.export_rows):]
+                self.export_rows = export_rows
+            if new_alerts:
+                delta['alert_level_counts'] = dict(state_manager.alert_level_counts)
+            if pending != self.pending:
+                delta['pending'] = list(pending)
+                self.pending = set(pending)
+            self.sent_alerts = set(sent_alerts)
+            record = ('delta', delta)
+        
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # The journal has a gap now: the next frame writes a full snapshot instead
+            self.needs_snapshot = True
+        self.write_times.append(time.perf_counter() - start_time)
+    
+    def flush(self, state_manager, core, position):
+        """Write a final snapshot and wait until everything queued is on disk"""
+        self.needs_snapshot = True
+        self.sequence += 1
+        self.queue.put(('snapshot', self.capture(state_manager, core, position)))
+        self.queue.join()
+    
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+    
+    def _write_atomic(self, path, payload):
+        temp_path = path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, default=_json_default)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    
+    def _writer_loop(self):
+        journal = open(self.session_dir / "journal.jsonl", 'a', encoding='utf-8')
+        try:
+            while True:
+                record = self.queue.get()
+                try:
+                    if record is None:
+                        return
+                    kind, payload = record
+                    if kind == 'snapshot':
+                        self._write_atomic(self.session_dir / "snapshot.json", payload)
+                        self._write_atomic(self.session_dir / "meta.json", {
+                            key: payload[key] for key in ('session_id', 'saved_at', 'session_start_time', 'video', 'position', 'processed_frames')
+                        })
+                        # Everything journaled so far is in the snapshot
+                        journal.close()
+                        journal = open(self.session_dir / "journal.jsonl", 'w', encoding='utf-8')
+                    else:
+                        journal.write(json.dumps(payload, default=_json_default) + "\n")
+                        journal.flush()
+                except Exception as e:
+                    logger.error(f"Checkpoint write error: {str(e)}")
+                finally:
+                    self.queue.task_done()
+        finally:
+            journal.close()
+    
+    @staticmethod
+    def list_sessions(root=None, limit=10):
+        """Most recently checkpointed sessions, newest first"""
+        root = Path(root or SESSION_DATA_DIR)
+        sessions = []
+        for meta_path in root.glob("*/meta.json"):
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                journal_path = meta_path.with_name("journal.jsonl")
+                meta['updated_at'] = max(meta_path.stat().st_mtime, journal_path.stat().st_mtime if journal_path.exists() else 0)
+                sessions.append(meta)
+            except (OSError, ValueError) as e:
+                logger.error(f"Unreadable checkpoint {meta_path}: {str(e)}")
+        sessions.sort(key=lambda meta: meta['updated_at'], reverse=True)
+        return sessions[:limit]
+    
+    @staticmethod
+    def load(session_id, root=None):
+        """Latest snapshot with the journal replayed on top of it"""
+        session_dir = Path(root or SESSION_DATA_DIR) / session_id
+        with open(session_dir / "snapshot.json", encoding='utf-8') as f:
+            state = json.load(f)
+        alert_history = state.setdefault('alert_history', list(state['alerts']))
+        export_data = state.setdefault('export_data', [])
+        alerts_spilled = state.setdefault('alerts_spilled', 0)
+        export_spilled = state.setdefault('export_spilled', 0)
+        journal_path = session_dir / "journal.jsonl"
+        if not journal_path.exists():
+            return state
+        
+        alerts = deque(state['alerts'], maxlen=100)
+        sent_alerts = set(state['sent_alerts'])
+        with open(journal_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    delta = json.loads(line)
+                except ValueError:
+                    break  # Torn final line from a crash mid-write
+                if delta['sequence'] <= state['sequence']:
+                    continue
+                state['instruments'].update(delta['instruments'])
+                for key in delta['removed']:
+                    state['instruments'].pop(key, None)
+                alerts.extend(delta['alerts'])
+                alert_history.extend(delta['alerts'])
+                export_data.extend(delta.get('export_added', []))
+                sent_alerts.update(delta['sent_added'])
+                sent_alerts.difference_update(delta['sent_removed'])
+                for key in ('sequence', 'position', 'processed_frames', 'tracker', 'pending', 'alert_level_counts',
+                            'alerts_spilled', 'export_spilled'):
+                    if key in delta:
+                        state[key] = delta[key]
+        # Rows compacted to the spill store after the snapshot are already on disk there
+        del alert_history[:state['alerts_spilled'] - alerts_spilled]
+        del export_data[:state['export_spilled'] - export_spilled]
+        state['alerts'] = list(alerts)
+        state['sent_alerts'] = list(sent_alerts)
+        return state
+
+class OccupancyGrid:
+    """Fixed-resolution occupancy and dwell-time grids for the session and each instrument, updated every frame"""
+    def __init__(self, shape=(36, 64), max_frame_gap=1.0):
+        self.shape = tuple(shape)
+        self.max_frame_gap = max_frame_gap
+        rows, cols = self.shape
+        self.session_occupancy = np.zeros(self.shape, dtype=np.float32)  # Frames each cell was under an instrument box
+        self.session_dwell = np.zeros(self.shape, dtype=np.float32)  # Seconds instrument centers spent in each cell
+        self.instruments = {}  # instrument id -> (occupancy, dwell) grids
+        self.frame_size = None
+        self.last_time = None
+        self.difference = np.zeros((rows + 1, cols + 1), dtype=np.float32)
+    
+    def update(self, instrument_ids, boxes, frame_size, now):
+        """Accumulate one frame of boxes in frame coordinates; the time since the previous frame is their dwell"""
+        dt = 0.0 if self.last_time is None else min(max((now - self.last_time).total_seconds(), 0.0), self.max_frame_gap)
+        self.last_time = now
+        self.frame_size = frame_size
+        if not instrument_ids:
+            return
+        rows, cols = self.shape
+        scale = np.array([cols / frame_size[0], rows / frame_size[1]] * 2, dtype=np.float32)
+        cells = np.asarray(boxes, dtype=np.float32).reshape(-1, 4) * scale
+        x0 = np.clip(cells[:, 0].astype(np.int32), 0, cols - 1)
+        y0 = np.clip(cells[:, 1].astype(np.int32), 0, rows - 1)
+        x1 = np.clip(np.ceil(cells[:, 2]).astype(np.int32), x0 + 1, cols)
+        y1 = np.clip(np.ceil(cells[:, 3]).astype(np.int32), y0 + 1, rows)
+        cx = np.clip(((cells[:, 0] + cells[:, 2]) / 2).astype(np.int32), 0, cols - 1)
+        cy = np.clip(((cells[:, 1] + cells[:, 3]) / 2).astype(np.int32), 0, rows - 1)
+        
+        # All boxes at once: rectangle corners into a difference array, then one 2D prefix sum
+        difference = self.difference
+        difference.fill(0)
+        np.add.at(difference, (y0, x0), 1)
+        np.add.at(difference, (y0, x1), -1)
+        np.add.at(difference, (y1, x0), -1)
+        np.add.at(difference, (y1, x1), 1)
+        self.session_occupancy += difference.cumsum(axis=0).cumsum(axis=1)[:rows, :cols]
+        np.add.at(self.session_dwell, (cy, cx), dt)
+        
+        for i, instrument_id in enumerate(instrument_ids):
+            grids = self.instruments.get(instrument_id)
+            if grids is None:
+                grids = self.instruments[instrument_id] = (np.zeros(self.shape, dtype=np.float32), np.zeros(self.shape, dtype=np.float32))
+            grids[0][y0[i]:y1[i], x0[i]:x1[i]] += 1
+            grids[1][cy[i], cx[i]] += dt
+    
+    def spill(self, instrument_ids, spill_store):
+        """Move the grids of spilled instruments to the session's spill directory"""
+        grid_dir = spill_store.session_dir / "grids"
+        grid_dir.mkdir(exist_ok=True)
+        for instrument_id in instrument_ids:
+            grids = self.instruments.pop(instrument_id, None)
+            if grids is not None:
+                np.savez_compressed(grid_dir / f"{instrument_id}.npz", occupancy=grids[0], dwell=grids[1])
+    
+    def instrument_grids(self, spill_store=None):
+        """(instrument id, occupancy, dwell) for every instrument of the session, spilled ones first"""
+        grid_dir = spill_store.session_dir / "grids" if spill_store else None
+        if grid_dir is not None and grid_dir.exists():
+            for path in sorted(grid_dir.glob("*.npz")):
+                with np.load(path) as data:
+                    yield path.stem, data['occupancy'], data['dwell']
+        for instrument_id, (occupancy, dwell) in self.instruments.items():
+            yield instrument_id, occupancy, dwell
+    
+    def hotspots(self, grid, count=5):
+        """Largest cells of a grid as (x, y) centers normalized to the frame, with their values"""
+        rows, cols = self.shape
+        top = np.argsort(grid, axis=None)[::-1][:count]
+        return [
+            {'x': round(float(index % cols + 0.5) / cols, 3), 'y': round(float(index // cols + 0.5) / rows, 3), 'value': float(grid.flat[index])}
+            for index in top if grid.flat[index] > 0
+        ]
+    
+    def to_npz_bytes(self, spill_store=None):
+        """All grids in one compressed .npz, per-instrument arrays named '<id>/occupancy' and '<id>/dwell'"""
+        arrays = {'session/occupancy': self.session_occupancy, 'session/dwell': self.session_dwell}
+        for instrument_id, occupancy, dwell in self.instrument_grids(spill_store):
+            arrays[f"{instrument_id}/occupancy"] = occupancy
+            arrays[f"{instrument_id}/dwell"] = dwell
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        return buffer.getvalue()
+
+class InstrumentStore(dict):
+    """Detected instruments by id, with status and risk-level indexes kept in step on every transition"""
+    
+    def __init__(self, instruments=None):
+        super().__init__()
+        self.by_status = defaultdict(dict)
+        self.by_risk = defaultdict(dict)
+        for key, instrument in (instruments or {}).items():
+            self[key] = instrument
+    
+    def __setitem__(self, key, instrument):
+        if key in self:
+            self._unindex(key, self[key])
+        super().__setitem__(key, instrument)
+        instrument.store = self
+        self.by_status[instrument.status][key] = instrument
+        self.by_risk[instrument.risk_level][key] = instrument
+    
+    def __delitem__(self, key):
+        instrument = self[key]
+        self._unindex(key, instrument)
+        instrument.store = None
+        super().__delitem__(key)
+    
+    def _unindex(self, key, instrument):
+        self.by_status[instrument.status].pop(key, None)
+        self.by_risk[instrument.risk_level].pop(key, None)
+    
+    def moved(self, index, instrument, old, new):
+        """Called by InstrumentInfo when its status or risk level changes"""
+        index.get(old, {}).pop(instrument.id, None)
+        index[new][instrument.id] = instrument
+    
+    def with_status(self, status):
+        return list(self.by_status[status].values())
+    
+    def count(self, status):
+        return len(self.by_status[status])
+    
+    def count_risk(self, risk_level):
+        return len(self.by_risk[risk_level])
+
+class SurgiSafeStateManager:
+    def __init__(self):
+        self.session_id = uuid.uuid4().hex
+        self.detected_instruments = InstrumentStore()
+        self.alerts_queue = deque(maxlen=100)  # Increased capacity
+        self.model_info = {}
+        self.tracking_stats = defaultdict(int)
+        self.processed_frames = 0
+        self.fps_counter = deque(maxlen=30)
+        self.latency_samples = deque(maxlen=100)  # Glass-to-annotation latency of live frames (ms)
+        self.frames_superseded = 0
+        self.system_status = 'idle'
+        self.last_frame = None
+        self.bbox_history = defaultdict(lambda: deque(maxlen=5))
+        self.pending_confirmations = {}  # For storing instruments awaiting confirmation
+        
+        # Enhanced tracking
+        self.session_start_time = datetime.now()
+        self.performance_metrics = defaultdict(list)
+        self.detection_history = deque(maxlen=1000)  # Store detection history
+        self.alert_history = []
+        self.export_data = []
+        self.alerts_spilled = 0  # Rows of alert_history and export_data compacted to the spill store
+        self.export_spilled = 0
+        self.track_records = []  # Track log records not yet written to the spill store
+        
+        # Bounded memory for long sessions: old records are compacted into the spill store
+        self.retention = RetentionPolicy()
+        self.spill_store = None
+        self.alert_level_counts = defaultdict(int)
+        self.occupancy = OccupancyGrid()
+        self.loss_evidence = {}  # instrument id -> clip and thumbnail paths from when it went pending
+    
+    def get_spill_store(self):
+        if self.spill_store is None:
+            self.spill_store = SessionSpillStore(SESSION_DATA_DIR / self.session_id)
+        return self.spill_store
+    
+    def total_alerts(self):
+        return sum(self.alert_level_counts.values())
+    
+    def compact(self, now, alert_manager):
+        """Spill inactive instruments and old alert/export rows to disk so memory stays flat"""
+        policy = self.retention
+        
+        # Lost instruments are summarized once they have been gone long enough, or when too many accumulate
+        lost = sorted(
+            self.detected_instruments.with_status('lost'),
+            key=lambda instrument: instrument.last_seen
+        )
+        overflow = len(lost) - policy.max_inactive_instruments
+        to_spill = [
+            instrument for i, instrument in enumerate(lost)
+            if i < overflow or (now - instrument.last_seen).total_seconds() > policy.inactive_instrument_seconds
+        ]
+        if to_spill:
+            self.get_spill_store().append('instruments', [instrument.to_dict() for instrument in to_spill])
+            self.occupancy.spill([instrument.id for instrument in to_spill], self.get_spill_store())
+            for instrument in to_spill:
+                del self.detected_instruments[instrument.id]
+                self.bbox_history.pop(instrument.id, None)
+                alert_manager.clear_alerts_for_instrument(instrument.id)
+        
+        if len(self.alert_history) > policy.max_alert_history:
+            spilled = len(self.alert_history) - policy.max_alert_history
+            self.get_spill_store().append('alerts', self.alert_history[:spilled])
+            del self.alert_history[:spilled]
+            self.alerts_spilled += spilled
+        
+        if len(self.export_data) > policy.max_export_rows:
+            spilled = len(self.export_data) - policy.max_export_rows
+            self.get_spill_store().append('export', self.export_data[:spilled])
+            del self.export_data[:spilled]
+            self.export_spilled += spilled
+        
+        # The track log is written out whole, so long sessions export every frame
+        self.get_spill_store().append('tracks', self.track_records)
+        self.track_records = []
+    
+    @classmethod
+    def from_checkpoint(cls, state, clock=datetime.now, risk_thresholds=None):
+        """Rebuild a session from SessionCheckpointer.load()"""
+        manager = cls()
+        manager.session_id = state['session_id']
+        manager.session_start_time = datetime.fromisoformat(state['session_start_time'])
+        manager.processed_frames = state['processed_frames']
+        manager.detected_instruments = InstrumentStore({
+            key: InstrumentInfo.from_state(instrument_state, clock, risk_thresholds) for key, instrument_state in state['instruments'].items()
+        })
+        for key, instrument in manager.detected_instruments.items():
+            manager.bbox_history[key].extend(instrument.position_history)
+        manager.pending_confirmations = {
+            key: manager.detected_instruments[key] for key in state['pending'] if key in manager.detected_instruments
+        }
+        manager.alert_level_counts.update(state['alert_level_counts'])
+        # The journal replay shares alert dicts between the queue and the history
+        for alert in state['alert_history'] + state['alerts']:
+            if isinstance(alert['timestamp'], str):
+                alert['timestamp'] = datetime.fromisoformat(alert['timestamp'])
+        manager.alert_history = state['alert_history']
+        manager.alerts_queue.extend(state['alerts'])
+        manager.export_data = state['export_data']
+        manager.alerts_spilled = state['alerts_spilled']
+        manager.export_spilled = state['export_spilled']
+        # Spilled records, track log included, live in the session directory
+        manager.get_spill_store()
+        return manager
+    
+    def all_instrument_records(self):
+        """Export records for every instrument of the session, spilled ones included"""
+        records = list(self.spill_store.iter_records('instruments')) if self.spill_store else []
+        return records + [instrument.to_dict() for instrument in self.detected_instruments.values()]
+    
+    def all_alerts(self):
+        """Every alert of the session in chronological order, spilled ones included"""
+        spilled = list(self.spill_store.iter_records('alerts')) if self.spill_store else []
+        return spilled + self.alert_history
+    
+    def all_track_records(self):
+        """Track log records of every processed frame, spilled ones included"""
+        spilled = list(self.spill_store.iter_records('tracks')) if self.spill_store else []
+        return spilled + self.track_records
+
+class SimulatedClock:
+    """Clock driven by media time instead of the wall clock"""
+    def __init__(self, start=None):
+        self.start = start or datetime.now()
+        self.offset_seconds = 0.0
+    
+    def set_offset(self, seconds):
+        self.offset_seconds = seconds
+    
+    def __call__(self):
+        return self.start + timedelta(seconds=self.offset_seconds)
+
+class InstrumentInfo:
+    # Minutes in use after which the risk level is raised
+    RISK_THRESHOLDS = {'critical': 30, 'danger': 20, 'warning': 10}
+    
+    def __init__(self, instrument_id, name, bbox, confidence, track_id, clock=datetime.now, risk_thresholds=None):
+        self.id = instrument_id
+        self.name = name
+        self.bbox = bbox
+        self.confidence = confidence
+        self.track_id = track_id
+        self.clock = clock
+        self.risk_thresholds = risk_thresholds or self.RISK_THRESHOLDS
+        self.first_detected = clock()
+        self.last_seen = self.first_detected
+        self.detection_count = 1
+        self.store = None  # InstrumentStore indexing this instrument, set when it is added
+        self._status = 'active'
+        self._risk_level = 'normal'
+        self.confidence_history = deque([confidence], maxlen=20)
+        self.position_history = deque([bbox], maxlen=50)
+        self.max_duration = 0
+    
+    @property
+    def status(self):
+        return self._status
+    
+    @status.setter
+    def status(self, status):
+        if status != self._status and self.store is not None:
+            self.store.moved(self.store.by_status, self, self._status, status)
+        self._status = status
+    
+    @property
+    def risk_level(self):
+        return self._risk_level
+    
+    @risk_level.setter
+    def risk_level(self, risk_level):
+        if risk_level != self._risk_level and self.store is not None:
+            self.store.moved(self.store.by_risk, self, self._risk_level, risk_level)
+        self._risk_level = risk_level
+    
+    def update_position(self, bbox, confidence):
+        self.bbox = bbox
+        self.confidence = confidence
+        self.last_seen = self.clock()
+        self.detection_count += 1
+        self.confidence_history.append(confidence)
+        self.position_history.append(bbox)
+    
+    def get_duration_minutes(self):
+        duration_minutes = (self.clock() - self.first_detected).total_seconds() / 60
+        self.max_duration = max(self.max_duration, duration_minutes)
+        return duration_minutes
+    
+    def get_average_confidence(self):
+        return np.mean(list(self.confidence_history)) if self.confidence_history else 0
+    
+    def get_movement_distance(self):
+        if len(self.position_history) < 2:
+            return 0
+        distances = []
+        for i in range(1, len(self.position_history)):
+            prev_center = self._get_bbox_center(self.position_history[i-1])
+            curr_center = self._get_bbox_center(self.position_history[i])
+            distance = np.sqrt((curr_center[0] - prev_center[0])**2 + (curr_center[1] - prev_center[1])**2)
+            distances.append(distance)
+        return np.sum(distances) if distances else 0
+    
+    def _get_bbox_center(self, bbox):
+        return ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+    
+    def update_risk_level(self):
+        duration = self.get_duration_minutes()
+        if duration > self.risk_thresholds['critical']:
+            self.risk_level = 'critical'
+        elif duration > self.risk_thresholds['danger']:
+            self.risk_level = 'danger'
+        elif duration > self.risk_thresholds['warning']:
+            self.risk_level = 'warning'
+        else:
+            self.risk_level = 'normal'
+    
+    def to_state(self):
+        """Complete instrument state for checkpointing"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'bbox': [float(v) for v in self.bbox],
+            'confidence': float(self.confidence),
+            'track_id': int(self.track_id),
+            'first_detected': self.first_detected.isoformat(),
+            'last_seen': self.last_seen.isoformat(),
+            'detection_count': self.detection_count,
+            'status': self.status,
+            'risk_level': self.risk_level,
+            'confidence_history': [float(v) for v in self.confidence_history],
+            'position_history': [[float(v) for v in bbox] for bbox in self.position_history],
+            'max_duration': self.max_duration
+        }
+    
+    @classmethod
+    def from_state(cls, state, clock=datetime.now, risk_thresholds=None):
+        instrument = cls(state['id'], state['name'], state['bbox'], state['confidence'], state['track_id'], clock=clock, risk_thresholds=risk_thresholds)
+        instrument.first_detected = datetime.fromisoformat(state['first_detected'])
+        instrument.last_seen = datetime.fromisoformat(state['last_seen'])
+        instrument.detection_count = state['detection_count']
+        instrument.status = state['status']
+        instrument.risk_level = state['risk_level']
+        instrument.confidence_history = deque(state['confidence_history'], maxlen=20)
+        instrument.position_history = deque(state['position_history'], maxlen=50)
+        instrument.max_duration = state['max_duration']
+        return instrument
+    
+    def to_dict(self):
+        """Convert instrument info to dictionary for export"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'track_id': self.track_id,
+            'first_detected': self.first_detected.isoformat(),
+            'last_seen': self.last_seen.isoformat(),
+            'duration_minutes': self.get_duration_minutes(),
+            'max_duration': self.max_duration,
+            'detection_count': self.detection_count,
+            'status': self.status,
+            'risk_level': self.risk_level,
+            'average_confidence': self.get_average_confidence(),
+            'movement_distance': self.get_movement_distance(),
+            'final_bbox': self.bbox
+        }
+
+class AlertManager:
+    def __init__(self):
+        self.alert_thresholds = {
+            'warning': 10, 
+            'danger': 20, 
+            'critical': 30,
+            'extended': 45  # New threshold for extended procedures
+        }
+        self.sent_alerts = set()
+        self.alert_sounds = {
+            'warning': '🔔',
+            'danger': '⚠️',
+            'critical': '🚨',
+            'extended': '💀'
+        }
+    
+    def check_and_generate_alerts(self, instruments, current_time=None):
+        current_time = current_time or datetime.now()
+        new_alerts = []
+        
+        for instrument in instruments.values():
+            # Lost instruments had their alerts cleared and must not raise them again
+            if instrument.status == 'lost':
+                continue
+            duration = instrument.get_duration_minutes()
+            instrument_key = f"{instrument.id}_{instrument.track_id}"
+            
+            # Check for extended duration alert
+            if duration > self.alert_thresholds['extended'] and f"extended_{instrument_key}" not in self.sent_alerts:
+                new_alerts.append({
+                    'timestamp': current_time, 
+                    'level': 'extended', 
+                    'message': f"EXTENDED: {instrument.name} (ID:{instrument.track_id}) > 45min - Review required",
+                    'instrument_id': instrument_key,
+                    'instrument': instrument.id,
+                    'duration': duration
+                })
+                self.sent_alerts.add(f"extended_{instrument_key}")
+            
+            elif duration > self.alert_thresholds['critical'] and f"critical_{instrument_key}" not in self.sent_alerts:
+                new_alerts.append({
+                    'timestamp': current_time, 
+                    'level': 'critical', 
+                    'message': f"CRITICAL: {instrument.name} (ID:{instrument.track_id}) > 30min",
+                    'instrument_id': instrument_key,
+                    'instrument': instrument.id,
+                    'duration': duration
+                })
+                self.sent_alerts.add(f"critical_{instrument_key}")
+            
+            elif duration > self.alert_thresholds['danger'] and f"danger_{instrument_key}" not in self.sent_alerts:
+                new_alerts.append({
+                    'timestamp': current_time, 
+                    'level': 'danger', 
+                    'message': f"DANGER: {instrument.name} (ID:{instrument.track_id}) > 20min",
+                    'instrument_id': instrument_key,
+                    'instrument': instrument.id,
+                    'duration': duration
+                })
+                self.sent_alerts.add(f"danger_{instrument_key}")
+            
+            elif duration > self.alert_thresholds['warning'] and f"warning_{instrument_key}" not in self.sent_alerts:
+                new_alerts.append({
+                    'timestamp': current_time, 
+                    'level': 'warning', 
+                    'message': f"WARNING: {instrument.name} (ID:{instrument.track_id}) > 10min",
+                    'instrument_id': instrument_key,
+                    'instrument': instrument.id,
+                    'duration': duration
+                })
+                self.sent_alerts.add(f"warning_{instrument_key}")
+        
+        return new_alerts
+    
+    def clear_alerts_for_instrument(self, instrument_key):
+        """Clear all alerts for a specific instrument when it's removed"""
+        # Keys are f"{level}_{instrument id}_{track id}"; match the id exactly so track 1 does not clear track 12
+        alerts_to_remove = [
+            alert for alert in self.sent_alerts
+            if alert.partition('_')[2].rsplit('_', 1)[0] == instrument_key
+        ]
+        for alert in alerts_to_remove:
+            self.sent_alerts.discard(alert)
+
+class WebhookAlertSink:
+    """POSTs each batch of alerts as one JSON document"""
+    def __init__(self, url, timeout=5.0):
+        self.name = f"webhook {url}"
+        self.url = url
+        self.timeout = timeout
+    
+    def send(self, batch):
+        body = json.dumps({'alerts': batch}, default=_json_default).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise IOError(f"HTTP {response.status}")
+
+class SyslogAlertSink:
+    """Sends one RFC 5424 datagram per alert to a syslog collector over UDP"""
+    SEVERITIES = {'warning': 4, 'danger': 3, 'critical': 2, 'extended': 1}
+    
+    def __init__(self, host='localhost', port=514, facility=16):
+        self.name = f"syslog {host}:{port}"
+        self.address = (host, port)
+        self.facility = facility  # local0
+        self.hostname = socket.gethostname()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    
+    def send(self, batch):
+        for alert in batch:
+            priority = self.facility * 8 + self.SEVERITIES.get(alert['level'], 5)
+            message = (f"<{priority}>1 {alert['timestamp']} {self.hostname} surgisafe - alert - "
+                       f"{json.dumps(alert, default=_json_default)}")
+            self.socket.sendto(message.encode('utf-8'), self.address)
+
+class FileAlertSink:
+    """Appends alerts as JSON lines, flushed to disk per batch"""
+    def __init__(self, path):
+        self.name = f"file {path}"
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+    
+    def send(self, batch):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for alert in batch:
+                f.write(json.dumps(alert, default=_json_default) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+class AlertDispatcher:
+    """Delivers alerts to external sinks from one background worker per sink, never blocking the frame loop"""
+    def __init__(self, sinks, queue_size=1000, batch_size=50, batch_interval=0.5, max_retries=5,
+                 backoff_base=0.5, backoff_max=30.0, dedup_seconds=300):
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.dedup_seconds = dedup_seconds
+        self.recent = {}  # dedup key -> wall time it was last accepted
+        self.deduplicated = 0
+        self.stop_event = threading.Event()
+        self.workers = []
+        for sink in sinks:
+            worker = {
+                'sink': sink,
+                'queue': queue.Queue(maxsize=queue_size),
+                'stats': defaultdict(int),
+                'latencies': deque(maxlen=200)
+            }
+            worker['thread'] = threading.Thread(target=self._worker_loop, args=(worker,), name=f"alerts-{sink.name}", daemon=True)
+            worker['thread'].start()
+            self.workers.append(worker)
+    
+    def submit(self, alerts, session_id=None):
+        """Queue alerts for every sink; duplicates within the window are dropped, as are alerts for a full queue"""
+        now = time.time()
+        for alert in alerts:
+            key = f"{alert['level']}:{alert.get('instrument_id', '')}:{session_id}"
+            if now - self.recent.get(key, -np.inf) < self.dedup_seconds:
+                self.deduplicated += 1
+                continue
+            self.recent[key] = now
+            record = {**alert_to_export(alert), 'session_id': session_id, 'alert_id': uuid.uuid4().hex}
+            for worker in self.workers:
+                try:
+                    worker['queue'].put_nowait((now, record))
+                except queue.Full:
+                    worker['stats']['dropped'] += 1
+        if len(self.recent) > 10000:
+            self.recent = {key: accepted for key, accepted in self.recent.items() if now - accepted < self.dedup_seconds}
+    
+    def _next_batch(self, worker):
+        """Up to batch_size queued alerts, waiting at most batch_interval after the first one"""
+        try:
+            batch = [worker['queue'].get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(worker['queue'].get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _worker_loop(self, worker):
+        sink, stats = worker['sink'], worker['stats']
+        while not (self.stop_event.is_set() and worker['queue'].empty()):
+            batch = self._next_batch(worker)
+            if not batch:
+                continue
+            records = [record for _, record in batch]
+            for attempt in range(self.max_retries + 1):
+                try:
+                    sink.send(records)
+                    delivered = time.time()
+                    worker['latencies'].extend(delivered - queued for queued, _ in batch)
+                    stats['delivered'] += len(batch)
+                    stats['batches'] += 1
+                    break
+                except Exception as e:
+                    stats['errors'] += 1
+                    if attempt == self.max_retries or self.stop_event.is_set():
+                        logger.error(f"Alert delivery to {sink.name} failed, {len(batch)} alert(s) lost: {str(e)}")
+                        stats['failed'] += len(batch)
+                        break
+                    stats['retries'] += 1
+                    # Exponential backoff with jitter so recovering receivers are not stampeded
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+                    self.stop_event.wait(delay)
+    
+    def stats(self):
+        """Per-sink queue depth, delivery counters and enqueue-to-delivery latency"""
+        rows = []
+        for worker in self.workers:
+            latencies = worker['latencies']
+            rows.append({
+                'sink': worker['sink'].name,
+                'queue_depth': worker['queue'].qsize(),
+                **{key: worker['stats'][key] for key in ('delivered', 'batches', 'retries', 'failed', 'dropped')},
+                'latency_p50_ms': float(np.percentile(latencies, 50) * 1000) if latencies else 0.0,
+                'latency_p95_ms': float(np.percentile(latencies, 95) * 1000) if latencies else 0.0
+            })
+        return rows
+    
+    def close(self, timeout=5.0):
+        """Deliver what is queued, retrying no more, then stop the workers"""
+        self.stop_event.set()
+        for worker in self.workers:
+            worker['thread'].join(timeout=timeout)
+
+class LocalAlertReceiver:
+    """Local HTTP endpoint that records webhook deliveries, standing in for a nursing-station system"""
+    def __init__(self, port=0, fail_requests=0):
+        self.batches = []
+        self.fail_requests = fail_requests
+        receiver = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if receiver.fail_requests > 0:
+                    receiver.fail_requests -= 1
+                    self.send_response(503)
+                else:
+                    receiver.batches.append(json.loads(body)['alerts'])
+                    self.send_response(204)
+                self.end_headers()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="alert-receiver", daemon=True)
+        self.thread.start()
+    
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/alerts"
+    
+    def alerts(self):
+        return [alert for batch in self.batches for alert in batch]
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class LiveStateBroadcaster:
+    """Websocket server fanning one session's instrument, alert and stats deltas out to any number of viewers"""
+    MAX_PENDING_ALERTS = 50
+    
+    def __init__(self, host='127.0.0.1', port=8765, min_interval=0.1):
+        self.host = host
+        self.port = port
+        self.min_interval = min_interval
+        # Analysis side: what was last handed to the event loop
+        self.published = {}
+        self.unsent_alerts = []
+        self.last_publish = 0.0
+        # Event loop side: full state for snapshots and a coalesced pending delta per client
+        self.state = {'instruments': {}, 'alerts': deque(maxlen=self.MAX_PENDING_ALERTS), 'stats': {}}
+        self.clients = {}
+        self.sequence = 0
+        self.counters = defaultdict(int)
+        self.loop = None
+        self.server = None
+        self.thread = None
+    
+    @staticmethod
+    def available():
+        return websockets is not None
+    
+    def start(self):
+        if not self.available():
+            raise RuntimeError("The websockets package is required for live broadcasting")
+        ready = threading.Event()
+        errors = []
+        self.loop = asyncio.new_event_loop()
+        
+        async def serve():
+            return await websockets.serve(self._handler, self.host, self.port)
+        
+        def run():
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.server = self.loop.run_until_complete(serve())
+            except Exception as e:
+                errors.append(e)
+                ready.set()
+                return
+            ready.set()
+            self.loop.run_forever()
+        
+        self.thread = threading.Thread(target=run, name="live-broadcast", daemon=True)
+        self.thread.start()
+        ready.wait(timeout=10)
+        if errors:
+            raise errors[0]
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Live state broadcast on ws://{self.host}:{self.port}")
+    
+    def publish(self, state_manager, new_alerts, fps=0.0):
+        """Hand changes since the previous publish to the event loop; called once per analyzed frame"""
+        if self.loop is None:
+            return
+        self.unsent_alerts.extend(new_alerts)
+        now = time.monotonic()
+        # Stats are rate-limited; alerts go out with the next frame
+        if not self.unsent_alerts and now - self.last_publish < self.min_interval:
+            return
+        self.last_publish = now
+        
+        instruments = {}
+        for key, instrument in state_manager.detected_instruments.items():
+            view = (instrument.name, instrument.track_id, instrument.status, instrument.risk_level)
+            if self.published.get(key) != view:
+                self.published[key] = view
+                instruments[key] = {
+                    'name': instrument.name, 'track_id': instrument.track_id, 'status': instrument.status,
+                    'risk_level': instrument.risk_level, 'first_detected': instrument.first_detected.isoformat()
+                }
+        # Spilled instruments leave the live view
+        for key in [key for key in self.published if key not in state_manager.detected_instruments]:
+            del self.published[key]
+            instruments[key] = None
+        
+        delta = {
+            'instruments': instruments,
+            'alerts': [alert_to_export(alert) for alert in self.unsent_alerts[-self.MAX_PENDING_ALERTS:]],
+            'stats': {
+                'processed_frames': state_manager.processed_frames,
+                'active_instruments': sum(1 for view in self.published.values() if view[2] == 'active'),
+                'total_alerts': state_manager.total_alerts(),
+                'fps': round(float(fps), 1)
+            }
+        }
+        self.unsent_alerts = []
+        self.loop.call_soon_threadsafe(self._merge, delta)
+    
+    def _merge(self, delta):
+        """Apply a delta to the full state and coalesce it into every client's pending update"""
+        state = self.state
+        for key, view in delta['instruments'].items():
+            if view is None:
+                state['instruments'].pop(key, None)
+            else:
+                state['instruments'][key] = view
+        state['alerts'].extend(delta['alerts'])
+        state['stats'] = delta['stats']
+        self.counters['deltas'] += 1
+        for client in self.clients.values():
+            pending = client['pending']
+            if pending['stats']:
+                self.counters['coalesced'] += 1
+            pending['instruments'].update(delta['instruments'])
+            pending['alerts'].extend(delta['alerts'])
+            if len(pending['alerts']) > self.MAX_PENDING_ALERTS:
+                pending['alerts_dropped'] += len(pending['alerts']) - self.MAX_PENDING_ALERTS
+                del pending['alerts'][:-self.MAX_PENDING_ALERTS]
+            pending['stats'] = delta['stats']
+            client['dirty'].set()
+    
+    @staticmethod
+    def _empty_pending():
+        return {'instruments': {}, 'alerts': [], 'alerts_dropped': 0, 'stats': {}}
+    
+    async def _send_updates(self, websocket, client):
+        try:
+            snapshot = {
+                'type': 'snapshot', 'instruments': self.state['instruments'],
+                'alerts': list(self.state['alerts']), 'stats': self.state['stats']
+            }
+            await websocket.send(json.dumps(snapshot, default=_json_default))
+            while True:
+                # While a slow client's send is blocked, further deltas merge into its pending update
+                await client['dirty'].wait()
+                client['dirty'].clear()
+                pending, client['pending'] = client['pending'], self._empty_pending()
+                self.sequence += 1
+                await websocket.send(json.dumps({'type': 'delta', 'seq': self.sequence, **pending}, default=_json_default))
+                self.counters['messages'] += 1
+        except websockets.ConnectionClosed:
+            pass
+    
+    async def _handler(self, websocket, path=None):
+        client = {'pending': self._empty_pending(), 'dirty': asyncio.Event()}
+        self.clients[id(websocket)] = client
+        self.counters['connections'] += 1
+        sender = asyncio.ensure_future(self._send_updates(websocket, client))
+        try:
+            # Viewers only listen; this ends when they disconnect
+            async for _ in websocket:
+                pass
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            del self.clients[id(websocket)]
+    
+    def stats(self):
+        return {'clients': len(self.clients), **self.counters}
+    
+    def close(self):
+        if self.loop is None:
+            return
+        
+        async def shutdown():
+            self.server.close()
+            await self.server.wait_closed()
+        
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop.close()
+        self.loop = None
+
+def box_iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU between two (N, 4) and (M, 4) arrays of xyxy boxes"""
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    # Explicit products: these arrays are tiny and np.prod's reduction overhead dominates
+    overlap = np.clip(bottom_right - top_left, 0, None)
+    intersection = overlap[..., 0] * overlap[..., 1]
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+def class_aware_nms(boxes, scores, classes, iou_threshold):
+    """Greedy per-class NMS; returns the kept indices, highest score first"""
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    
+    # Shift each class into its own coordinate range so boxes of different classes never overlap
+    shifted = boxes + classes.astype(np.float32)[:, None] * (float(boxes.max()) + 1)
+    order = np.argsort(-scores, kind='stable')
+    ious = box_iou_matrix(shifted[order], shifted[order])
+    
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= ious[i] > iou_threshold
+    return order[keep]
+
+def empty_candidates():
+    return {
+        'boxes': np.empty((0, 4), dtype=np.float32),
+        'scores': np.empty(0, dtype=np.float32),
+        'classes': np.empty(0, dtype=np.int16)
+    }
+
+def filter_candidates(candidates, conf_threshold, iou_threshold):
+    """Apply a confidence threshold and class-aware NMS to raw candidate boxes"""
+    mask = candidates['scores'] >= conf_threshold
+    boxes = candidates['boxes'][mask]
+    scores = candidates['scores'][mask]
+    classes = candidates['classes'][mask]
+    keep = class_aware_nms(boxes, scores, classes, iou_threshold)
+    return {'boxes': boxes[keep], 'scores': scores[keep], 'classes': classes[keep]}
+
+def merge_cascade_candidates(light, heavy, iou_threshold=0.5):
+    """Heavy-model candidates plus the light-model ones no heavy box of the same class covers"""
+    if len(light['scores']) == 0 or len(heavy['scores']) == 0:
+        return heavy if len(heavy['scores']) > 0 else light
+    overlap = box_iou_matrix(light['boxes'], heavy['boxes'])
+    overlap[light['classes'][:, None] != heavy['classes'][None, :]] = 0
+    extra = overlap.max(axis=1) < iou_threshold
+    return {key: np.concatenate([heavy[key], light[key][extra]]) for key in ('boxes', 'scores', 'classes')}
+
+def linear_assignment(cost, max_cost):
+    """Minimum-cost one-to-one matching; returns matched (rows, cols) with cost <= max_cost"""
+    if cost.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(np.minimum(cost, max_cost + 1.0))
+    else:
+        # Greedy fallback: take pairs in increasing cost order while rows and columns are free
+        order = np.argsort(cost, axis=None, kind='stable')
+        used_rows = np.zeros(cost.shape[0], dtype=bool)
+        used_cols = np.zeros(cost.shape[1], dtype=bool)
+        rows, cols = [], []
+        for row, col in zip(*np.unravel_index(order, cost.shape)):
+            if cost[row, col] > max_cost:
+                break
+            if not used_rows[row] and not used_cols[col]:
+                used_rows[row] = used_cols[col] = True
+                rows.append(row)
+                cols.append(col)
+        rows, cols = np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+    
+    valid = cost[rows, cols] <= max_cost
+    return rows[valid], cols[valid]
+
+class InstrumentTracker:
+    """Lightweight ByteTrack-style tracker: one stable ID per physical instrument"""
+    def __init__(self, high_threshold=0.25, match_iou=0.3, low_match_iou=0.5, max_lost_frames=150):
+        self.high_threshold = high_threshold
+        self.match_iou = match_iou
+        self.low_match_iou = low_match_iou
+        self.max_lost_frames = max_lost_frames
+        self.reset()
+    
+    def reset(self):
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.velocities = np.empty((0, 4), dtype=np.float32)
+        self.classes = np.empty(0, dtype=np.int16)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.lost_frames = np.empty(0, dtype=np.int32)
+        self.next_id = 1
+    
+    def get_state(self):
+        return {
+            'boxes': self.boxes.tolist(),
+            'velocities': self.velocities.tolist(),
+            'classes': self.classes.tolist(),
+            'ids': self.ids.tolist(),
+            'lost_frames': self.lost_frames.tolist(),
+            'next_id': self.next_id
+        }
+    
+    def set_state(self, state):
+        self.boxes = np.array(state['boxes'], dtype=np.float32).reshape(-1, 4)
+        self.velocities = np.array(state['velocities'], dtype=np.float32).reshape(-1, 4)
+        self.classes = np.array(state['classes'], dtype=np.int16)
+        self.ids = np.array(state['ids'], dtype=np.int64)
+        self.lost_frames = np.array(state['lost_frames'], dtype=np.int32)
+        self.next_id = state['next_id']
+    
+    def _match(self, track_indices, boxes, classes, detection_indices, min_iou):
+        """Match a subset of tracks to a subset of detections on a class-gated IoU cost matrix"""
+        if len(track_indices) == 0 or len(detection_indices) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        predicted = self.boxes[track_indices] + self.velocities[track_indices]
+        cost = 1.0 - box_iou_matrix(predicted, boxes[detection_indices])
+        cost[self.classes[track_indices][:, None] != classes[detection_indices][None, :]] = np.inf
+        rows, cols = linear_assignment(cost, 1.0 - min_iou)
+        return track_indices[rows], detection_indices[cols]
+    
+    def update(self, boxes, scores, classes):
+        """Associate one frame of detections; returns a track ID per detection, -1 when unassigned"""
+        assigned = np.full(len(boxes), -1, dtype=np.int64)
+        all_tracks = np.arange(len(self.ids))
+        high = np.flatnonzero(scores >= self.high_threshold)
+        low = np.flatnonzero(scores < self.high_threshold)
+        
+        # First associate confident detections, then let weak ones extend the remaining tracks
+        matched_tracks, matched_detections = self._match(all_tracks, boxes, classes, high, self.match_iou)
+        remaining_mask = np.ones(len(self.ids), dtype=bool)
+        remaining_mask[matched_tracks] = False
+        remaining = np.flatnonzero(remaining_mask)
+        low_tracks, low_detections = self._match(remaining, boxes, classes, low, self.low_match_iou)
+        matched_tracks = np.concatenate([matched_tracks, low_tracks])
+        matched_detections = np.concatenate([matched_detections, low_detections])
+        
+        new_boxes = boxes[matched_detections].astype(np.float32)
+        self.velocities[matched_tracks] = 0.5 * self.velocities[matched_tracks] + 0.5 * (new_boxes - self.boxes[matched_tracks])
+        self.boxes[matched_tracks] = new_boxes
+        self.lost_frames += 1
+        self.lost_frames[matched_tracks] = 0
+        assigned[matched_detections] = self.ids[matched_tracks]
+        
+        # Unmatched tracks coast on a decaying velocity until they expire
+        coasting = self.lost_frames > 0
+        self.boxes[coasting] += self.velocities[coasting]
+        self.velocities[coasting] *= 0.5
+        alive = self.lost_frames <= self.max_lost_frames
+        self.boxes, self.velocities = self.boxes[alive], self.velocities[alive]
+        self.classes, self.ids, self.lost_frames = self.classes[alive], self.ids[alive], self.lost_frames[alive]
+        
+        # Unmatched confident detections start new tracks
+        new_mask = scores >= self.high_threshold
+        new_mask[matched_detections] = False
+        new_detections = np.flatnonzero(new_mask)
+        if len(new_detections) > 0:
+            new_ids = np.arange(self.next_id, self.next_id + len(new_detections))
+            self.next_id += len(new_detections)
+            self.boxes = np.concatenate([self.boxes, boxes[new_detections].astype(np.float32)])
+            self.velocities = np.concatenate([self.velocities, np.zeros((len(new_detections), 4), dtype=np.float32)])
+            self.classes = np.concatenate([self.classes, classes[new_detections].astype(np.int16)])
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.lost_frames = np.concatenate([self.lost_frames, np.zeros(len(new_detections), dtype=np.int32)])
+            assigned[new_detections] = new_ids
+        
+        return assigned
+
+class SurgicalFieldROI:
+    """Chooses the region sent to the model: the endoscope field of view, narrowed to recent instruments"""
+    MODES = {'off': "Full frame", 'field': "Field of view", 'adaptive': "Adaptive ROI"}
+    
+    def __init__(self, mode='off', padding=0.25, history_frames=15, full_sweep_interval=30, min_size=192, vignette_threshold=20):
+        self.mode = mode
+        self.padding = padding
+        self.history_frames = history_frames
+        self.full_sweep_interval = full_sweep_interval
+        self.min_size = min_size
+        self.vignette_threshold = vignette_threshold
+        self.pixel_ratios = deque(maxlen=100)
+        self.reset()
+    
+    def reset(self):
+        self.field = None
+        self.frame_shape = None
+        self.recent_boxes = deque(maxlen=self.history_frames)
+        self.frames_since_sweep = 0
+    
+    def settings(self):
+        """Parameters that change the candidates produced for a given frame"""
+        if self.mode == 'off':
+            return {'mode': 'off'}
+        return {'mode': self.mode, 'padding': self.padding, 'history_frames': self.history_frames,
+                'full_sweep_interval': self.full_sweep_interval, 'min_size': self.min_size,
+                'vignette_threshold': self.vignette_threshold}
+    
+    def detect_field(self, frame):
+        """Bounding box of the non-black endoscope image inside the vignette"""
+        height, width = frame.shape[:2]
+        lit = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) > self.vignette_threshold
+        rows = np.flatnonzero(lit.mean(axis=1) > 0.02)
+        cols = np.flatnonzero(lit.mean(axis=0) > 0.02)
+        if len(rows) == 0 or len(cols) == 0:
+            return (0, 0, width, height)
+        return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+    
+    def next_region(self, frame):
+        """Region (x1, y1, x2, y2) for the next inference, or None for the whole frame"""
+        if self.mode == 'off':
+            return None
+        height, width = frame.shape[:2]
+        if self.field is None or self.frame_shape != frame.shape:
+            self.field = self.detect_field(frame)
+            self.frame_shape = frame.shape
+        region = self.field
+        
+        # Periodic sweeps over the whole field catch instruments entering the scene
+        self.frames_since_sweep += 1
+        recent = [boxes for boxes in self.recent_boxes if len(boxes)]
+        if self.mode == 'adaptive' and recent and self.frames_since_sweep < self.full_sweep_interval:
+            boxes = np.concatenate(recent)
+            x1, y1 = boxes[:, 0].min(), boxes[:, 1].min()
+            x2, y2 = boxes[:, 2].max(), boxes[:, 3].max()
+            pad_x = max((x2 - x1) * self.padding, (self.min_size - (x2 - x1)) / 2)
+            pad_y = max((y2 - y1) * self.padding, (self.min_size - (y2 - y1)) / 2)
+            fx1, fy1, fx2, fy2 = self.field
+            region = (
+                int(max(fx1, x1 - pad_x)), int(max(fy1, y1 - pad_y)),
+                int(min(fx2, x2 + pad_x)), int(min(fy2, y2 + pad_y))
+            )
+        else:
+            self.frames_since_sweep = 0
+        
+        self.pixel_ratios.append((region[2] - region[0]) * (region[3] - region[1]) / float(width * height))
+        return region
+    
+    def observe(self, tracks):
+        self.recent_boxes.append(np.array([track['bbox'] for track in tracks], dtype=np.float32).reshape(-1, 4))
+
+class FramePreprocessor:
+    """Letterbox, BGR->RGB, normalization and HWC->CHW in one stage writing into buffers reused across frames"""
+    def __init__(self, input_size=640, pad_value=114, stride=32):
+        self.input_size = input_size
+        self.pad_value = pad_value
+        self.stride = stride
+        self.canvas = None
+        self.planes = None
+        self.tensor = None
+    
+    @staticmethod
+    def letterbox_geometry(height, width, input_size, stride=32):
+        """Resized size, padded canvas size and top-left padding of the Ultralytics predictor letterbox
+        
+        Like LetterBox(auto=True) for .pt models, pads only up to a multiple of the stride, e.g. 640x384 for 16:9.
+        """
+        scale = min(input_size / height, input_size / width)
+        new_width, new_height = int(round(width * scale)), int(round(height * scale))
+        pad_width, pad_height = (input_size - new_width) % stride / 2, (input_size - new_height) % stride / 2
+        left, right = int(round(pad_width - 0.1)), int(round(pad_width + 0.1))
+        top, bottom = int(round(pad_height - 0.1)), int(round(pad_height + 0.1))
+        return (new_width, new_height), (new_width + left + right, new_height + top + bottom), (left, top)
+    
+    def _ensure_buffers(self, canvas_size, batch_size=1):
+        canvas_width, canvas_height = canvas_size
+        if self.canvas is None or self.canvas.shape[:2] != (canvas_height, canvas_width):
+            self.canvas = np.empty((canvas_height, canvas_width, 3), dtype=np.uint8)
+            self.planes = np.empty((3, canvas_height, canvas_width), dtype=np.uint8)
+        if self.tensor is None or self.tensor.shape != (batch_size, 3, canvas_height, canvas_width):
+            self.tensor = np.empty((batch_size, 3, canvas_height, canvas_width), dtype=np.float32)
+    
+    def to_tensor(self, image, region=None, batch_index=0, batch_size=1):
+        """Model input tensor for a region of a BGR image, plus the transform mapping boxes back to the image
+        
+        With batch_size > 1 the image fills slot batch_index of a batch tensor shared by all slots,
+        which must then all be the same size.
+        """
+        x_offset, y_offset = (region[0], region[1]) if region else (0, 0)
+        source = image[region[1]:region[3], region[0]:region[2]] if region else image
+        height, width = source.shape[:2]
+        
+        # Resize straight into the letterbox canvas, same geometry as the Ultralytics predictor
+        (new_width, new_height), canvas_size, (left, top) = self.letterbox_geometry(height, width, self.input_size, self.stride)
+        self._ensure_buffers(canvas_size, batch_size)
+        self.canvas.fill(self.pad_value)
+        cv2.resize(source, (new_width, new_height), dst=self.canvas[top:top + new_height, left:left + new_width],
+                   interpolation=cv2.INTER_LINEAR)
+        
+        # Channel planes in RGB order, then one float32 scaling pass into the tensor
+        for channel in range(3):
+            cv2.extractChannel(self.canvas, 2 - channel, dst=self.planes[channel])
+        np.multiply(self.planes, np.float32(1.0 / 255.0), out=self.tensor[batch_index], dtype=np.float32, casting='unsafe')
+        return self.tensor, (new_width / width, new_height / height, left, top, x_offset, y_offset)
+    
+    @staticmethod
+    def boxes_to_image(boxes, transform):
+        scale_x, scale_y, left, top, x_offset, y_offset = transform
+        return ((boxes - np.array([left, top, left, top], dtype=np.float32))
+                / np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+                + np.array([x_offset, y_offset, x_offset, y_offset], dtype=np.float32)).astype(np.float32)
+
+def _legacy_preprocess(frame, target_width, input_size, stride=32):
+    """Previous path: resize, then the steps model.predict runs on a BGR frame (letterbox, RGB, CHW, scaling), each allocating"""
+    height, width = frame.shape[:2]
+    display = cv2.resize(frame, target_frame_size(width, height, target_width))
+    height, width = display.shape[:2]
+    (new_width, new_height), (canvas_width, canvas_height), (left, top) = FramePreprocessor.letterbox_geometry(
+        height, width, input_size, stride
+    )
+    resized = cv2.resize(display, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    letterboxed = cv2.copyMakeBorder(resized, top, canvas_height - new_height - top, left, canvas_width - new_width - left,
+                                     cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    tensor = np.ascontiguousarray(letterboxed[..., ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255.0
+    display_rgb = cv2.cvtColor(display, cv2.COLOR_BGR2RGB)
+    return tensor, display_rgb
+
+def benchmark_preprocessing(frame, target_width=640, input_size=640, iterations=100):
+    """Compare the legacy per-step preprocessing with the fused stage on one decoded frame"""
+    import tracemalloc
+    height, width = frame.shape[:2]
+    display_size = target_frame_size(width, height, target_width)
+    display = np.empty((display_size[1], display_size[0], 3), dtype=np.uint8)
+    display_rgb = np.empty_like(display)
+    preprocessor = FramePreprocessor(input_size)
+    
+    def fused():
+        cv2.resize(frame, display_size, dst=display)
+        preprocessor.to_tensor(display)
+        cv2.cvtColor(display, cv2.COLOR_BGR2RGB, dst=display_rgb)
+    
+    def legacy():
+        _legacy_preprocess(frame, target_width, input_size)
+    
+    results = {}
+    for name, step in (('legacy', legacy), ('fused', fused)):
+        step()  # Warm-up, also allocates the fused buffers
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            step()
+        elapsed_ms = (time.perf_counter() - start_time) / iterations * 1000
+        
+        tracemalloc.start()
+        for _ in range(10):
+            step()
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {'ms_per_frame': elapsed_ms, 'peak_allocated_kb': allocated / 1024}
+    
+    results['speedup'] = results['legacy']['ms_per_frame'] / max(results['fused']['ms_per_frame'], 1e-9)
+    return results
+
+class StereoMatcher:
+    """Pairs left/right detections of one physical instrument under a rectified-row or epipolar constraint"""
+    MODES = {
+        'off': "Mono (single video)",
+        'batch': "Detect in both views (one batch)",
+        'left_only': "Detect in left view, transfer to right"
+    }
+    
+    def __init__(self, row_tolerance=0.04, max_disparity=0.3, fundamental=None):
+        # Tolerances are fractions of the frame height (rows) and width (disparity)
+        self.row_tolerance = row_tolerance
+        self.max_disparity = max_disparity
+        self.fundamental = fundamental
+        self.disparity = None
+        self.last_matches = 0
+    
+    @staticmethod
+    def fundamental_from_calibration(calibration, scale=1.0):
+        """Fundamental matrix from calibration data ('F', or 'K1'/'K2'/'R'/'T'), for frames resized by scale"""
+        if 'F' in calibration or 'fundamental_matrix' in calibration:
+            fundamental = np.array(calibration.get('F', calibration.get('fundamental_matrix')), dtype=np.float64).reshape(3, 3)
+        else:
+            k1 = np.array(calibration['K1'], dtype=np.float64).reshape(3, 3)
+            k2 = np.array(calibration['K2'], dtype=np.float64).reshape(3, 3)
+            rotation = np.array(calibration['R'], dtype=np.float64).reshape(3, 3)
+            tx, ty, tz = np.array(calibration['T'], dtype=np.float64).ravel()
+            cross = np.array([[0, -tz, ty], [tz, 0, -tx], [-ty, tx, 0]])
+            fundamental = np.linalg.inv(k2).T @ cross @ rotation @ np.linalg.inv(k1)
+        # Pixel coordinates of resized frames are scale times the calibrated ones
+        inverse_scale = np.diag([1.0 / scale, 1.0 / scale, 1.0])
+        return inverse_scale @ fundamental @ inverse_scale
+    
+    @staticmethod
+    def _centers(boxes):
+        return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+    
+    def match(self, left, right, frame_shape):
+        """Indices of matched (left, right) detections and their disparities"""
+        height, width = frame_shape[:2]
+        if len(left['scores']) == 0 or len(right['scores']) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        left_centers, right_centers = self._centers(left['boxes']), self._centers(right['boxes'])
+        
+        if self.fundamental is not None:
+            # Distance of each right center to the epipolar line of each left center
+            lines = np.hstack([left_centers, np.ones((len(left_centers), 1))]) @ self.fundamental.T
+            row_error = np.abs(lines[:, None, 0] * right_centers[None, :, 0] + lines[:, None, 1] * right_centers[None, :, 1] + lines[:, None, 2])
+            row_error /= np.maximum(np.hypot(lines[:, 0], lines[:, 1]), 1e-9)[:, None]
+        else:
+            row_error = np.abs(left_centers[:, None, 1] - right_centers[None, :, 1])
+        disparity = left_centers[:, None, 0] - right_centers[None, :, 0]
+        
+        # Same physical instrument: same class, on the epipolar line, plausible disparity and similar height
+        left_heights = left['boxes'][:, 3] - left['boxes'][:, 1]
+        right_heights = right['boxes'][:, 3] - right['boxes'][:, 1]
+        cost = row_error / (self.row_tolerance * height) + np.abs(np.log(np.maximum(left_heights[:, None], 1) / np.maximum(right_heights[None, :], 1)))
+        invalid = (
+            (row_error > self.row_tolerance * height)
+            | (np.abs(disparity) > self.max_disparity * width)
+            | (left['classes'][:, None] != right['classes'][None, :])
+        )
+        cost[invalid] = np.inf
+        rows, cols = linear_assignment(cost, 2.0)
+        return rows, cols, disparity[rows, cols].astype(np.float32)
+    
+    def _update_disparity(self, disparities):
+        if len(disparities) == 0:
+            return
+        measured = float(np.median(disparities))
+        self.disparity = measured if self.disparity is None else 0.8 * self.disparity + 0.2 * measured
+    
+    def fuse(self, left, right, frame_shape, conf_threshold):
+        """One left-view candidate per physical instrument from both views' candidates"""
+        left = {key: value[left['scores'] >= conf_threshold] for key, value in left.items()}
+        right = {key: value[right['scores'] >= conf_threshold] for key, value in right.items()}
+        rows, cols, disparities = self.match(left, right, frame_shape)
+        self.last_matches = len(rows)
+        self._update_disparity(disparities)
+        
+        # Matched pairs keep the left box with the stronger of both scores
+        scores = left['scores'].copy()
+        scores[rows] = np.maximum(scores[rows], right['scores'][cols])
+        fused = {'boxes': left['boxes'], 'scores': scores, 'classes': left['classes']}
+        
+        # Instruments only the right camera sees are moved into the left view by the running disparity
+        right_only = np.ones(len(right['scores']), dtype=bool)
+        right_only[cols] = False
+        if np.any(right_only) and self.disparity is not None:
+            shift = np.array([self.disparity, 0, self.disparity, 0], dtype=np.float32)
+            fused = {
+                'boxes': np.concatenate([fused['boxes'], right['boxes'][right_only] + shift]),
+                'scores': np.concatenate([fused['scores'], right['scores'][right_only]]),
+                'classes': np.concatenate([fused['classes'], right['classes'][right_only]])
+            }
+        return fused
+    
+    def transfer(self, boxes, left_image=None, right_image=None):
+        """Right-view boxes for left-view boxes: row-constrained template matching when the views are rectified, else the running disparity"""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        disparities = np.full(len(boxes), self.disparity or 0.0, dtype=np.float32)
+        matched = np.zeros(len(boxes), dtype=bool)
+        if left_image is not None and right_image is not None and self.fundamental is None:
+            height, width = left_image.shape[:2]
+            max_shift = int(self.max_disparity * width)
+            for i, (x1, y1, x2, y2) in enumerate(boxes.astype(int)):
+                x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2, width), min(y2, height)
+                if x2 - x1 < 8 or y2 - y1 < 8:
+                    continue
+                strip_x1 = max(x1 - max_shift, 0)
+                template = left_image[y1:y2, x1:x2]
+                strip = right_image[y1:y2, strip_x1:x2]
+                if strip.shape[1] < template.shape[1]:
+                    continue
+                scores = cv2.matchTemplate(strip, template, cv2.TM_CCOEFF_NORMED)
+                _, best_score, _, best_location = cv2.minMaxLoc(scores)
+                if best_score > 0.5:
+                    disparities[i] = x1 - (strip_x1 + best_location[0])
+                    matched[i] = True
+            self._update_disparity(disparities[matched])
+        return boxes - np.stack([disparities, np.zeros_like(disparities), disparities, np.zeros_like(disparities)], axis=1)
+
+def parse_cpu_list(text):
+    """CPU ids of a Linux cpulist such as '0-3,8-11'"""
+    cpus = []
+    for part in text.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+def _autotune_worker(model_path, class_names, frame, target_width, entry, iterations, barrier, results):
+    """Autotune process: one stream's resize + inference loop under a candidate thread split"""
+    fps, error = 0.0, None
+    try:
+        ThreadPlanner.apply_entry(entry)
+        manager = YOLOModelManager()
+        manager.class_names = class_names
+        manager.load_model_or_raise(model_path)
+        height, width = frame.shape[:2]
+        size = target_frame_size(width, height, target_width)
+        manager.detect_candidates(cv2.resize(frame, size))  # Warm-up
+        # All streams start timing together so they compete for the machine as in production
+        barrier.wait(timeout=600)
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            manager.detect_candidates(cv2.resize(frame, size))
+        fps = iterations / (time.perf_counter() - start_time)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        logger.error(f"Autotune stream {entry['stream']} failed: {error}")
+        # Release the streams waiting for this one at the barrier
+        barrier.abort()
+    finally:
+        # The parent reports the error: this process has no page to show it on
+        results.put((entry['stream'], fps, error))
+
+class ThreadPlanner:
+    """Splits this machine's cores between the inference, OpenCV and decode threads of each active stream"""
+    NODE_ROOT = Path("/sys/devices/system/node")
+    
+    def __init__(self, numa_aware=True, pin=True, decode_share=0.25):
+        self.numa_aware = numa_aware
+        self.pin = pin
+        self.decode_share = decode_share
+        self.tuned = {}  # streams -> (torch_threads, opencv_threads) found by autotune
+        self.applied = None
+    
+    @staticmethod
+    def available_cores():
+        if hasattr(os, 'sched_getaffinity'):
+            return sorted(os.sched_getaffinity(0))
+        return list(range(os.cpu_count() or 1))
+    
+    @classmethod
+    def numa_nodes(cls):
+        """{node: cpus} from sysfs restricted to the cores this process may use; a single node when unknown"""
+        cores = set(cls.available_cores())
+        nodes = {}
+        try:
+            for node_dir in sorted(cls.NODE_ROOT.glob("node[0-9]*")):
+                cpus = [cpu for cpu in parse_cpu_list((node_dir / "cpulist").read_text()) if cpu in cores]
+                if cpus:
+                    nodes[int(node_dir.name[4:])] = cpus
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read NUMA topology: {str(e)}")
+            nodes = {}
+        return nodes or {0: sorted(cores)}
+    
+    def core_blocks(self, streams):
+        """One (node, cores) block per stream; a stream never spans NUMA nodes while they have room"""
+        nodes = self.numa_nodes() if self.numa_aware else {0: self.available_cores()}
+        total = sum(len(cpus) for cpus in nodes.values())
+        if streams >= total:
+            # Oversubscribed: one core per stream, wrapping around
+            flat = [(node, cpu) for node, cpus in nodes.items() for cpu in cpus]
+            return [(flat[i % total][0], [flat[i % total][1]]) for i in range(streams)]
+        
+        # Streams per node in proportion to its cores, largest remainders first
+        shares = {node: streams * len(cpus) / total for node, cpus in nodes.items()}
+        counts = {node: int(share) for node, share in shares.items()}
+        for node in sorted(shares, key=lambda node: counts[node] - shares[node])[:streams - sum(counts.values())]:
+            counts[node] += 1
+        blocks = []
+        for node, cpus in nodes.items():
+            if counts[node]:
+                blocks.extend((node, chunk.tolist()) for chunk in np.array_split(np.array(cpus), counts[node]))
+        return blocks
+    
+    def plan(self, streams=1):
+        """Per-stream cores and thread counts for the given number of concurrent inference streams"""
+        entries = []
+        for stream, (node, cores) in enumerate(self.core_blocks(streams)):
+            count = len(cores)
+            decode_threads = max(1, round(count * self.decode_share)) if count > 1 else 1
+            torch_threads, opencv_threads = self.tuned.get(streams, (max(1, count - decode_threads), decode_threads))
+            entries.append({
+                'stream': stream,
+                'node': node,
+                'cores': cores,
+                'torch_threads': min(torch_threads, count),
+                'opencv_threads': min(opencv_threads, count),
+                # Decoder subprocesses get the tail of the block
+                'decode_cores': cores[-decode_threads:]
+            })
+        return entries
+    
+    @staticmethod
+    def apply_entry(entry, pin=True):
+        """Set this process's thread pools, and its affinity, to one plan entry"""
+        torch.set_num_threads(entry['torch_threads'])
+        cv2.setNumThreads(entry['opencv_threads'])
+        if pin and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, entry['cores'])
+    
+    def apply(self, streams=1, stream=0):
+        entry = self.plan(streams)[stream]
+        try:
+            self.apply_entry(entry, self.pin)
+            self.applied = entry
+            logger.info(f"Thread plan applied: {entry}")
+        except Exception as e:
+            logger.error(f"Error applying thread plan: {str(e)}")
+        return entry
+    
+    def pin_decoders(self, source, entry):
+        """Pin the decoder subprocesses of a frame source, stereo pairs included, to the stream's decode cores"""
+        if not (self.pin and hasattr(os, 'sched_setaffinity')):
+            return
+        parts = [source.left_source, source.right_source] if isinstance(source, StereoFrameSource) else [source]
+        for part in parts:
+            process = getattr(part, 'process', None)
+            if process is not None and process.pid:
+                try:
+                    os.sched_setaffinity(process.pid, entry['decode_cores'])
+                except OSError as e:
+                    logger.warning(f"Could not pin decoder process {process.pid}: {str(e)}")
+    
+    def candidate_splits(self, streams):
+        """(torch_threads, opencv_threads) pairs worth measuring for the smallest block"""
+        count = min(len(cores) for _, cores in self.core_blocks(streams))
+        torch_counts = sorted({count, max(1, count - 1)} | {2 ** i for i in range(count.bit_length()) if 2 ** i <= count})
+        return [
+            (torch_threads, opencv_threads) for torch_threads in torch_counts
+            for opencv_threads in sorted({1, max(1, count - torch_threads)})
+        ]
+    
+    def autotune(self, model_path, class_names, frame, streams=1, target_width=640, iterations=20, progress=None, timeout=900):
+        """Measure aggregate FPS of every candidate split with all streams running at once; keep the best
+        
+        A split whose streams do not all report within timeout seconds scores 0 for the missing ones.
+        Raises RuntimeError with the streams' errors when none of a split's streams ran, e.g. the model did not load.
+        """
+        context = multiprocessing.get_context()
+        splits = self.candidate_splits(streams)
+        blocks = self.core_blocks(streams)
+        rows = []
+        for done, (torch_threads, opencv_threads) in enumerate(splits, 1):
+            barrier = context.Barrier(streams)
+            results = context.Queue()
+            processes = []
+            for stream, (node, cores) in enumerate(blocks):
+                entry = {
+                    'stream': stream, 'node': node, 'cores': cores,
+                    'torch_threads': min(torch_threads, len(cores)), 'opencv_threads': min(opencv_threads, len(cores))
+                }
+                process = context.Process(
+                    target=_autotune_worker,
+                    args=(model_path, class_names, frame, target_width, entry, iterations, barrier, results),
+                    daemon=True
+                )
+                process.start()
+                processes.append(process)
+            stream_fps = {stream: 0.0 for stream in range(len(processes))}
+            errors = {}
+            deadline = time.time() + timeout
+            try:
+                for _ in processes:
+                    stream, fps, error = results.get(timeout=max(deadline - time.time(), 0.1))
+                    stream_fps[stream] = fps
+                    if error is not None:
+                        errors[stream] = error
+            except queue.Empty:
+                logger.error(f"Autotune split {torch_threads}/{opencv_threads} timed out")
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            if errors and not any(stream_fps.values()):
+                raise RuntimeError("; ".join(f"stream {stream}: {error}" for stream, error in sorted(errors.items())))
+            rows.append({
+                'torch_threads': torch_threads,
+                'opencv_threads': opencv_threads,
+                'aggregate_fps': sum(stream_fps.values()),
+                'min_stream_fps': min(stream_fps.values())
+            })
+            if progress:
+                progress(done / len(splits))
+        best = max(rows, key=lambda row: row['aggregate_fps'])
+        if best['aggregate_fps'] > 0:
+            self.tuned[streams] = (best['torch_threads'], best['opencv_threads'])
+        return rows
+
+class YOLOModelManager:
+    def __init__(self):
+        self.model = None
+        self.class_names = {
+            0: "Right_Prograsp_Forceps_labels",
+            1: "Other_labels",
+            2: "Maryland_Bipolar_Forceps_labels",
+            3: "Left_Prograsp_Forceps_labels",
+            4: "Right_Large_Needle_Driver_labels",
+            5: "Left_Large_Needle_Driver_labels",
+            6: "Prograsp_Forceps_labels"
+        }
+        self.tracker = InstrumentTracker()
+        self.preprocessor = FramePreprocessor()
+        self.fused_preprocessing = True
+        self.model_info = {}
+        self.model_performance = defaultdict(list)
+        # The model runs once at these floors; user thresholds are applied afterwards
+        self.candidate_conf_floor = 0.01
+        self.candidate_iou_floor = 0.9
+        self.last_candidates = empty_candidates()
+        
+        # Two-tier cascade: the heavy model only sees frames the light one is unsure about
+        self.heavy_model = None
+        self.heavy_model_info = {}
+        self.cascade_enabled = False
+        self.cascade_band = (0.25, 0.6)
+        self.last_escalation = []
+        self.reset_cascade_stats()
+        
+        self.thread_planner = ThreadPlanner()
+        
+        # Several model processes working on consecutive frames of one stream
+        self.replicas = 1
+        self.replica_pool = None
+    
+    def candidate_settings(self):
+        """Parameters that change the raw candidates produced for a given frame"""
+        settings = {
+            'conf_floor': self.candidate_conf_floor,
+            'iou_floor': self.candidate_iou_floor,
+            'fused_preprocessing': self.fused_preprocessing
+        }
+        if self.cascade_active():
+            settings['cascade'] = {'heavy_hash': self.heavy_model_info.get('file_hash'), 'band': list(self.cascade_band)}
+        return settings
+    
+    def _load(self, model_path):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model not found: {model_path}")
+        
+        start_time = time.time()
+        model = YOLO(model_path)
+        load_time = time.time() - start_time
+        
+        return model, {
+            'path': model_path,
+            'classes': self.class_names,
+            'num_classes': len(self.class_names),
+            'device': 'cuda' if torch.cuda.is_available() else 'cpu',
+            'load_time': load_time,
+            'model_size': os.path.getsize(model_path) / (1024 * 1024),  # MB
+            'file_hash': file_content_hash(model_path)
+        }
+    
+    def load_model_or_raise(self, model_path):
+        """Load the main model, raising on failure; for worker processes, which have no page to show errors on"""
+        self.model, self.model_info = self._load(model_path)
+        logger.info(f"Model loaded successfully: {self.model_info}")
+    
+    def load_model(self, model_path):
+        try:
+            self.load_model_or_raise(model_path)
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error loading model: {str(e)}")
+            st.error(f"Error loading model: {str(e)}")
+            return False
+    
+    def load_heavy_model(self, model_path):
+        """Load the accurate, slower model of the cascade's second tier"""
+        try:
+            self.heavy_model, self.heavy_model_info = self._load(model_path)
+            self.reset_cascade_stats()
+            logger.info(f"Heavy model loaded successfully: {self.heavy_model_info}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error loading heavy model: {str(e)}")
+            st.error(f"Error loading heavy model: {str(e)}")
+            return False
+    
+    def cascade_active(self):
+        return self.cascade_enabled and self.heavy_model is not None
+    
+    def replicas_active(self):
+        """Replicas only run the main model: the cascade needs the tracker state of the previous frame"""
+        return self.replicas > 1 and self.model is not None and not self.cascade_active()
+    
+    def get_replica_pool(self, frame_shape):
+        """Replica pool for frames of this shape, restarted when the model, replica count or shape changes"""
+        settings = {
+            'fused_preprocessing': self.fused_preprocessing,
+            'conf_floor': self.candidate_conf_floor,
+            'iou_floor': self.candidate_iou_floor
+        }
+        pool = ModelReplicaPool(
+            self.model_info['path'], self.class_names, settings, self.thread_planner.plan(self.replicas), frame_shape
+        )
+        if self.replica_pool is not None and self.replica_pool.key == pool.key and not self.replica_pool.broken:
+            return self.replica_pool
+        self.close_replica_pool()
+        pool.start()
+        self.replica_pool = pool
+        return pool
+    
+    def close_replica_pool(self):
+        if self.replica_pool is not None:
+            self.replica_pool.close()
+            self.replica_pool = None
+    
+    def replica_candidates(self, source, next_region):
+        """Yield (frame_index, frame, candidates) of a frame source with inference spread over the replicas"""
+        first_item = source.read()
+        if first_item is None:
+            return
+        pool = self.get_replica_pool(first_item[1].shape)
+        yield from pool.stream(source, next_region, first_item)
+    
+    def reset_cascade_stats(self):
+        self.cascade_stats = defaultdict(float)
+    
+    def cascade_summary(self):
+        """Escalation rate and compute saved compared with running the heavy model on every frame"""
+        stats = self.cascade_stats
+        frames, escalations = stats['frames'], stats['escalations']
+        if frames == 0:
+            return None
+        actual_time = stats['light_time'] + stats['heavy_time']
+        heavy_every_frame = stats['heavy_time'] / escalations * frames if escalations else 0.0
+        return {
+            'frames': int(frames),
+            'escalation_rate': escalations / frames,
+            'light_hit_rate': 1 - escalations / frames,
+            'reasons': {reason: int(stats[reason]) for reason in ('uncertain', 'new_instrument', 'missed_track')},
+            'cost_saved': 1 - actual_time / heavy_every_frame if heavy_every_frame > 0 else None
+        }
+    
+    def escalation_reasons(self, candidates):
+        """Why the heavy model should look at this frame, given the light model's candidates and the tracker"""
+        low, high = self.cascade_band
+        boxes, scores, classes = candidates['boxes'], candidates['scores'], candidates['classes']
+        tracker = self.tracker
+        predicted = tracker.boxes + tracker.velocities
+        reasons = []
+        
+        if np.any((scores >= low) & (scores < high)):
+            reasons.append('uncertain')
+        
+        # A confident detection no track explains is a new instrument
+        confident = scores >= high
+        if np.any(confident):
+            overlap = box_iou_matrix(boxes[confident], predicted)
+            overlap[classes[confident][:, None] != tracker.classes[None, :]] = 0
+            if len(tracker.ids) == 0 or np.any(overlap.max(axis=1) < tracker.match_iou):
+                reasons.append('new_instrument')
+        
+        # A track seen in the previous frame without any plausible detection now disagrees with the light model
+        seen = tracker.lost_frames == 0
+        if np.any(seen):
+            visible = scores >= low
+            overlap = box_iou_matrix(predicted[seen], boxes[visible])
+            overlap[tracker.classes[seen][:, None] != classes[visible][None, :]] = 0
+            if not np.any(visible) or np.any(overlap.max(axis=1) < tracker.match_iou):
+                reasons.append('missed_track')
+        return reasons
+    
+    def _predict(self, model, model_input, transforms):
+        """Candidates for each image of the model input, mapped back with its transform"""
+        results = model.predict(model_input, conf=self.candidate_conf_floor, iou=self.candidate_iou_floor, verbose=False)
+        batch = []
+        for i, transform in enumerate(transforms):
+            if i < len(results) and results[i].boxes is not None:
+                boxes = results[i].boxes
+                batch.append({
+                    'boxes': FramePreprocessor.boxes_to_image(boxes.xyxy.cpu().numpy(), transform),
+                    'scores': boxes.conf.cpu().numpy().astype(np.float32),
+                    'classes': boxes.cls.cpu().numpy().astype(np.int16)
+                })
+            else:
+                batch.append(empty_candidates())
+        return batch
+    
+    def detect_candidates_batch(self, frames):
+        """Raw candidates for several frames from a single batched model call, e.g. both views of a stereo pair"""
+        if self.model is None:
+            logger.error("No model loaded")
+            return [empty_candidates() for _ in frames]
+        
+        try:
+            start_time = time.time()
+            if self.fused_preprocessing:
+                transforms = [
+                    self.preprocessor.to_tensor(frame, batch_index=i, batch_size=len(frames))[1]
+                    for i, frame in enumerate(frames)
+                ]
+                model_input = torch.from_numpy(self.preprocessor.tensor)
+            else:
+                transforms = [(1.0, 1.0, 0, 0, 0, 0)] * len(frames)
+                model_input = list(frames)
+            batch = self._predict(self.model, model_input, transforms)
+            
+            inference_time = time.time() - start_time
+            self.model_performance['inference_times'].append(inference_time)
+            self.model_performance['detections_per_frame'].append(sum(len(c['scores']) for c in batch))
+            if len(self.model_performance['inference_times']) > 100:
+                self.model_performance['inference_times'].pop(0)
+                self.model_performance['detections_per_frame'].pop(0)
+            return batch
+            
+        except Exception as e:
+            logger.error(f"YOLOv8 Batch Inference Error: {str(e)}")
+            return [empty_candidates() for _ in frames]
+    
+    def detect_candidates(self, frame, region=None):
+        """Run the model once at the floor thresholds and return the raw candidate boxes in frame coordinates"""
+        if self.model is None:
+            logger.error("No model loaded")
+            return empty_candidates()
+        
+        try:
+            start_time = time.time()
+            if self.fused_preprocessing:
+                # A ready tensor makes Ultralytics skip its own letterbox and normalization
+                tensor, transform = self.preprocessor.to_tensor(frame, region)
+                model_input = torch.from_numpy(tensor)
+            else:
+                transform = (1.0, 1.0, 0, 0, region[0], region[1]) if region else (1.0, 1.0, 0, 0, 0, 0)
+                model_input = frame[region[1]:region[3], region[0]:region[2]] if region else frame
+            candidates = self._predict(self.model, model_input, [transform])[0]
+            
+            # Escalate to the heavy model on the same input tensor, then merge both tiers
+            if self.cascade_active():
+                self.cascade_stats['light_time'] += time.time() - start_time
+                self.cascade_stats['frames'] += 1
+                self.last_escalation = self.escalation_reasons(candidates)
+                if self.last_escalation:
+                    heavy_start = time.time()
+                    heavy_candidates = self._predict(self.heavy_model, model_input, [transform])[0]
+                    self.cascade_stats['heavy_time'] += time.time() - heavy_start
+                    self.cascade_stats['escalations'] += 1
+                    for reason in self.last_escalation:
+                        self.cascade_stats[reason] += 1
+                    candidates = merge_cascade_candidates(candidates, heavy_candidates)
+            
+            # Record performance metrics
+            inference_time = time.time() - start_time
+            self.model_performance['inference_times'].append(inference_time)
+            self.model_performance['detections_per_frame'].append(len(candidates['scores']))
+            
+            # Keep only last 100 measurements
+            if len(self.model_performance['inference_times']) > 100:
+                self.model_performance['inference_times'].pop(0)
+                self.model_performance['detections_per_frame'].pop(0)
+            
+            return candidates
+            
+        except Exception as e:
+            logger.error(f"YOLOv8 Inference Error: {str(e)}")
+            return empty_candidates()
+    
+    def reset_tracking(self):
+        self.tracker.reset()
+    
+    def candidates_to_tracks(self, candidates, conf_threshold=0.3, iou_threshold=0.4):
+        """Threshold raw candidates, assign track IDs and convert them to track dictionaries"""
+        filtered = filter_candidates(candidates, conf_threshold, iou_threshold)
+        known_lookup = np.zeros(max(self.class_names) + 2, dtype=bool)
+        known_lookup[list(self.class_names)] = True
+        known = known_lookup[np.clip(filtered['classes'], -1, len(known_lookup) - 1)]
+        boxes, scores, classes = filtered['boxes'][known], filtered['scores'][known], filtered['classes'][known]
+        
+        start_time = time.time()
+        track_ids = self.tracker.update(boxes, scores, classes)
+        self.model_performance['tracker_times'].append(time.time() - start_time)
+        if len(self.model_performance['tracker_times']) > 100:
+            self.model_performance['tracker_times'].pop(0)
+        
+        tracks = []
+        for box, confidence, class_id, track_id in zip(boxes, scores, classes, track_ids):
+            if track_id < 0:
+                continue
+            class_id = int(class_id)
+            x1, y1, x2, y2 = (int(v) for v in box)
+            tracks.append({
+                'track_id': int(track_id),
+                'class_id': class_id,
+                'bbox': [x1, y1, x2, y2],
+                'class_name': self.class_names[class_id],
+                'confidence': float(confidence)
+            })
+        return tracks
+
+class SurgiSafeCore:
+    RISK_COLORS = {
+        'normal': (0, 255, 0),      # Green
+        'warning': (0, 255, 255),   # Yellow
+        'danger': (0, 165, 255),    # Orange
+        'critical': (0, 0, 255),    # Red
+        'extended': (128, 0, 128),  # Purple
+        'lost': (128, 128, 128),    # Gray
+        'pending': (255, 165, 0)    # Orange for pending confirmation
+    }
+    
+    def __init__(self, state_manager=None):
+        # Without an explicit state manager the core works on the Streamlit session's one
+        self._state_manager = state_manager
+        self.model_manager = YOLOModelManager()
+        self.alert_manager = AlertManager()
+        self.roi = SurgicalFieldROI()
+        self.clock = datetime.now
+        self.last_candidates = empty_candidates()
+        self.current_frame_index = None
+        self.annotation_buffer = None
+        self.checkpointer = None
+        self.lost_after_seconds = 5
+        self.risk_thresholds = dict(InstrumentInfo.RISK_THRESHOLDS)
+        self.last_tracks = []
+        self.stereo = StereoMatcher()
+        self.stereo_buffer = None
+        self.alert_dispatcher = None
+        self.broadcaster = None
+        self.live = True  # False while replaying recorded detections: nothing is sent to alert sinks or viewers
+        self.frame_size = None
+        self.clip_buffer = None
+        self.newly_pending = []
+    
+    @property
+    def state_manager(self):
+        if self._state_manager is not None:
+            return self._state_manager
+        return st.session_state.state_manager
+    
+    def reset_tracking(self):
+        self.model_manager.reset_tracking()
+        self.roi.reset()
+    
+    def attach_checkpointer(self, state_manager):
+        """Checkpoint the given session, replacing the checkpointer of a previous one"""
+        if self.checkpointer is not None and self.checkpointer.session_id == state_manager.session_id:
+            return self.checkpointer
+        self.detach_checkpointer()
+        self.checkpointer = SessionCheckpointer(state_manager.session_id)
+        return self.checkpointer
+    
+    def detach_checkpointer(self, state_manager=None, position=0):
+        """Stop checkpointing, writing a final snapshot of state_manager when given"""
+        if self.checkpointer is None:
+            return
+        try:
+            if state_manager is not None and state_manager.session_id == self.checkpointer.session_id:
+                self.checkpointer.flush(state_manager, self, position)
+            self.checkpointer.close()
+        except Exception as e:
+            logger.error(f"Error closing checkpointer: {str(e)}")
+        self.checkpointer = None
+    
+    def candidate_settings(self, conf_threshold, iou_threshold):
+        """Everything that changes the raw candidates, for detection cache keys"""
+        settings = {**self.model_manager.candidate_settings(), 'roi': self.roi.settings()}
+        # The adaptive ROI and cascade escalation follow the tracks, which depend on the thresholds,
+        # so their candidates only replay at the same ones
+        if self.roi.mode == 'adaptive' or self.model_manager.cascade_active():
+            settings['tracking_thresholds'] = [conf_threshold, iou_threshold]
+        return settings
+    
+    def restore_checkpoint(self, state):
+        """Restore alert and tracker state saved by SessionCheckpointer"""
+        self.reset_tracking()
+        self.model_manager.tracker.set_state(state['tracker'])
+        self.alert_manager.sent_alerts = set(state['sent_alerts'])
+    
+    def process_frame(self, frame, conf_threshold=0.3, iou_threshold=0.4, candidates=None, tracks=None):
+        """Run tracking and alert logic on a frame, or on precomputed raw candidates or tracks when given"""
+        try:
+            start_time = time.time()
+            self.last_candidates = empty_candidates()
+            
+            # Run the model unless candidates were replayed from the detection cache or tracks from a log
+            if tracks is None:
+                if candidates is None:
+                    candidates = self.model_manager.detect_candidates(frame, self.roi.next_region(frame))
+                self.last_candidates = candidates
+                tracks = self.model_manager.candidates_to_tracks(candidates, conf_threshold, iou_threshold)
+            self.roi.observe(tracks)
+            self.last_tracks = tracks
+            
+            # Update instrument tracking
+            self.newly_pending = []
+            self._update_detected_instruments(tracks)
+            self._update_risk_levels()
+            if frame is not None:
+                self.frame_size = (frame.shape[1], frame.shape[0])
+            if self.frame_size is not None:
+                self.state_manager.occupancy.update(
+                    [f"{track['class_name']}_{track['track_id']}" for track in tracks],
+                    [track['bbox'] for track in tracks], self.frame_size, self.clock()
+                )
+            
+            # Generate alerts
+            new_alerts = self.alert_manager.check_and_generate_alerts(
+                self.state_manager.detected_instruments, self.clock()
+            )
+            
+            # Add alerts to queue and history
+            for alert in new_alerts:
+                if self.current_frame_index is not None:
+                    alert['frame_index'] = self.current_frame_index
+                self.state_manager.alerts_queue.append(alert)
+                self.state_manager.alert_history.append(alert)
+                self.state_manager.alert_level_counts[alert['level']] += 1
+            if new_alerts and self.alert_dispatcher is not None and self.live:
+                self.alert_dispatcher.submit(new_alerts, self.state_manager.session_id)
+            
+            # Update statistics
+            self._update_stats(tracks)
+            
+            # Periodically compact old records to disk
+            state_manager = self.state_manager
+            if state_manager.processed_frames % state_manager.retention.compaction_interval_frames == 0:
+                state_manager.compact(self.clock(), self.alert_manager)
+            
+            # Journal this frame for crash recovery
+            if self.checkpointer is not None:
+                position = 0 if self.current_frame_index is None else self.current_frame_index + 1
+                self.checkpointer.record_frame(state_manager, self, new_alerts, position)
+            
+            # Calculate FPS
+            processing_time = time.time() - start_time
+            if processing_time > 0:
+                self.state_manager.fps_counter.append(1.0 / processing_time)
+            
+            # Store detection data for export
+            detection_data = {
+                'timestamp': self.clock().isoformat(),
+                'frame_index': self.current_frame_index,
+                'frame_number': self.state_manager.processed_frames,
+                'detections': len(tracks),
+                'processing_time': processing_time,
+                'tracks': tracks
+            }
+            self.state_manager.detection_history.append(detection_data)
+            self.state_manager.track_records.append(track_log_record(detection_data, self.state_manager.session_start_time))
+            
+            if self.broadcaster is not None and self.live:
+                self.broadcaster.publish(self.state_manager, new_alerts, self.state_manager.fps_counter[-1] if self.state_manager.fps_counter else 0.0)
+            
+            if frame is None:
+                return None
+            
+            # Annotate frame
+            annotated_frame = self._annotate_frame(frame, tracks)
+            
+            # Visual evidence for critical alerts and instruments awaiting a loss confirmation
+            if self.clip_buffer is not None:
+                self.clip_buffer.add(annotated_frame, self.clock())
+                clip_dir = state_manager.get_spill_store().session_dir / "clips"
+                for alert in new_alerts:
+                    if alert['level'] in PreAlertClipBuffer.CLIP_LEVELS:
+                        alert.update(self.clip_buffer.request_clip(f"{alert['level']}_{alert['instrument_id']}", clip_dir))
+                for instrument_id in self.newly_pending:
+                    state_manager.loss_evidence[instrument_id] = self.clip_buffer.request_clip(f"pending_{instrument_id}", clip_dir)
+            self.newly_pending = []
+            
+            return annotated_frame
+            
+        except Exception as e:
+            logger.error(f"Frame processing error: {str(e)}")
+            return frame
+    
+    def process_stereo_frame(self, left, right, conf_threshold=0.3, iou_threshold=0.4, detect_right=True):
+        """Track one instrument set over a stereo pair; returns both annotated views side by side"""
+        if detect_right:
+            # Both views in one batched model call, fused into left-view candidates
+            left_candidates, right_candidates = self.model_manager.detect_candidates_batch([left, right])
+            candidates = self.stereo.fuse(left_candidates, right_candidates, left.shape, conf_threshold)
+        else:
+            candidates = self.model_manager.detect_candidates(left)
+        annotated_left = self.process_frame(left, conf_threshold, iou_threshold, candidates=candidates)
+        
+        height, width = left.shape[:2]
+        if self.stereo_buffer is None or self.stereo_buffer.shape != (height, 2 * width, 3):
+            self.stereo_buffer = np.empty((height, 2 * width, 3), dtype=np.uint8)
+        np.copyto(self.stereo_buffer[:, :width], annotated_left)
+        annotated_right = self.stereo_buffer[:, width:]
+        np.copyto(annotated_right, right)
+        
+        # The right view shows the same instruments, moved by the disparity of their current detection
+        visible = [
+            (track['bbox'], self.state_manager.detected_instruments[f"{track['class_name']}_{track['track_id']}"])
+            for track in self.last_tracks
+            if f"{track['class_name']}_{track['track_id']}" in self.state_manager.detected_instruments
+        ]
+        if visible:
+            detected_boxes = np.array([bbox for bbox, _ in visible], dtype=np.float32)
+            disparities = detected_boxes[:, 0] - self.stereo.transfer(
+                detected_boxes, None if detect_right else left, None if detect_right else right
+            )[:, 0]
+            for (_, instrument), disparity in zip(visible, disparities):
+                box = (np.array(instrument.bbox) - np.array([disparity, 0, disparity, 0])).astype(int)
+                color = self.RISK_COLORS.get(instrument.risk_level if instrument.status != 'pending' else 'pending', (255, 255, 255))
+                cv2.rectangle(annotated_right, (box[0], box[1]), (box[2], box[3]), color, 2)
+                cv2.putText(annotated_right, f"ID:{instrument.track_id}", (box[0] + 5, box[1] - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+        return self.stereo_buffer
+    
+    def _update_detected_instruments(self, tracks):
+        current_time = self.clock()
+        active_ids = set()
+        
+        for track in tracks:
+            instrument_id = f"{track['class_name']}_{track['track_id']}"
+            active_ids.add(instrument_id)
+            
+            if instrument_id in self.state_manager.detected_instruments:
+                # Update existing instrument
+                instrument = self.state_manager.detected_instruments[instrument_id]
+                if instrument.status != 'active':
+                    # Seen again: no longer lost nor awaiting a loss confirmation
+                    self.state_manager.pending_confirmations.pop(instrument_id, None)
+                    instrument.status = 'active'
+                bbox_history = self.state_manager.bbox_history[instrument_id]
+                bbox_history.append(track['bbox'])
+                
+                # Calculate averaged bbox for smoother tracking
+                avg_bbox = [
+                    int(sum(b[i] for b in bbox_history) / len(bbox_history))
+                    for i in range(4)
+                ]
+                instrument.update_position(avg_bbox, track['confidence'])
+            else:
+                # Create new instrument
+                instrument = InstrumentInfo(
+                    instrument_id=instrument_id,
+                    name=track['class_name'],
+                    bbox=track['bbox'],
+                    confidence=track['confidence'],
+                    track_id=track['track_id'],
+                    clock=self.clock,
+                    risk_thresholds=self.risk_thresholds
+                )
+                self.state_manager.detected_instruments[instrument_id] = instrument
+                self.state_manager.bbox_history[instrument_id].append(track['bbox'])
+        
+        # Mark instruments as lost if not seen for too long, with confirmation for critical cases
+        for instrument in self.state_manager.detected_instruments.with_status('active'):
+            instrument_id = instrument.id
+            if instrument_id not in active_ids:
+                time_since_last_seen = (current_time - instrument.last_seen).total_seconds()
+                if time_since_last_seen > self.lost_after_seconds:
+                    if instrument.risk_level == 'critical' and instrument_id not in self.state_manager.pending_confirmations:
+                        self.state_manager.pending_confirmations[instrument_id] = instrument
+                        instrument.status = 'pending'
+                        self.newly_pending.append(instrument_id)
+                    elif instrument_id not in self.state_manager.pending_confirmations:
+                        instrument.status = 'lost'
+                        self.alert_manager.clear_alerts_for_instrument(instrument_id)
+    
+    def _update_risk_levels(self):
+        for instrument in self.state_manager.detected_instruments.with_status('active'):
+            instrument.update_risk_level()
+    
+    def _update_stats(self, tracks):
+        self.state_manager.tracking_stats['total_detections'] += len(tracks)
+        self.state_manager.tracking_stats['active_tracks'] = len(tracks)
+        self.state_manager.processed_frames += 1
+        
+        # Update performance metrics
+        current_time = self.clock()
+        self.state_manager.performance_metrics['timestamps'].append(current_time)
+        self.state_manager.performance_metrics['detections'].append(len(tracks))
+        
+        # Keep only last 1000 measurements
+        if len(self.state_manager.performance_metrics['timestamps']) > 1000:
+            self.state_manager.performance_metrics['timestamps'].pop(0)
+            self.state_manager.performance_metrics['detections'].pop(0)
+    
+    def _annotate_frame(self, frame, tracks):
+        # Draw into a buffer reused across frames instead of a fresh copy
+        if self.annotation_buffer is None or self.annotation_buffer.shape != frame.shape:
+            self.annotation_buffer = np.empty_like(frame)
+        annotated_frame = self.annotation_buffer
+        np.copyto(annotated_frame, frame)
+        colors = self.RISK_COLORS
+        
+        for track in tracks:
+            instrument_id = f"{track['class_name']}_{track['track_id']}"
+            if instrument_id in self.state_manager.detected_instruments:
+                instrument = self.state_manager.detected_instruments[instrument_id]
+                color = colors.get(instrument.risk_level if instrument.status != 'pending' else 'pending', (255, 255, 255))
+                
+                x1, y1, x2, y2 = instrument.bbox
+                
+                # Draw bounding box with thickness based on risk level
+                thickness = 3 if instrument.risk_level in ['critical', 'extended'] else 2
+                cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), color, thickness)
+                
+                # Prepare labels
+                duration = instrument.get_duration_minutes()
+                confidence = instrument.get_average_confidence()
+                
+                # Main label
+                label = f"{instrument.name.replace('_labels', '')} (ID:{instrument.track_id})"
+                status_text = f"{duration:.1f}min | {confidence:.2f} ({instrument.risk_level.upper() if instrument.status != 'pending' else 'PENDING'})"
+                
+                # Draw labels with background
+                label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
+                status_size = cv2.getTextSize(status_text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)[0]
+                
+                # Draw background rectangles
+                cv2.rectangle(annotated_frame, (x1, y1 - 35), (x1 + max(label_size[0], status_size[0]) + 10, y1), color, -1)
+                
+                # Draw text
+                cv2.putText(annotated_frame, label, (x1 + 5, y1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                cv2.putText(annotated_frame, status_text, (x1 + 5, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        
+        # Add system information overlay
+        self._add_system_overlay(annotated_frame)
+        
+        return annotated_frame
+    
+    def _add_system_overlay(self, frame):
+        """Add system information overlay to the frame"""
+        # System stats
+        timestamp = self.clock().strftime("%d/%m/%Y %H:%M:%S")
+        fps = np.mean(list(self.state_manager.fps_counter)) if self.state_manager.fps_counter else 0
+        active_instruments = self.state_manager.detected_instruments.count('active')
+        
+        # Session duration
+        session_duration = self.clock() - self.state_manager.session_start_time
+        session_minutes = int(session_duration.total_seconds() / 60)
+        
+        # Overlay background: blending a black box at 70% is darkening the region in place
+        panel = frame[10:121, 10:401]
+        np.multiply(panel, 0.3, out=panel, casting='unsafe')
+        
+        # System information
+        info_lines = [
+            f"Time: {timestamp}",
+            f"FPS: {fps:.1f} | Frame: {self.state_manager.processed_frames}",
+            f"Active Instruments: {active_instruments}",
+            f"Session Duration: {session_minutes}min"
+        ]
+        
+        for i, line in enumerate(info_lines):
+            cv2.putText(frame, line, (15, 30 + i * 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (102, 126, 234), 1)
+
+class VideoUploadManager:
+    """Stores uploaded videos on disk in fixed-size chunks, grouped by session, under a disk quota"""
+    def __init__(self, root=None, chunk_size=8 * 1024 * 1024, quota_bytes=20 * 1024 ** 3, max_age_hours=24):
+        self.root = Path(root) if root else Path(tempfile.gettempdir()) / "surgisafe_uploads"
+        self.chunk_size = chunk_size
+        self.quota_bytes = quota_bytes
+        self.max_age_hours = max_age_hours
+    
+    def session_dir(self, session_id):
+        return self.root / session_id
+    
+    def save(self, uploaded_file, session_id, prefix="upload"):
+        """Copy an uploaded file to disk chunk by chunk and probe its metadata once"""
+        size = getattr(uploaded_file, 'size', 0)
+        self.collect_garbage(keep_session=session_id, incoming_bytes=size)
+        
+        session_dir = self.session_dir(session_id)
+        session_dir.mkdir(parents=True, exist_ok=True)
+        # Only one upload per prefix is kept per session: the new video replaces the previous one
+        for old_file in session_dir.glob(f"{prefix}_*"):
+            old_file.unlink(missing_ok=True)
+        
+        suffix = Path(uploaded_file.name).suffix or '.mp4'
+        video_path = session_dir / f"{prefix}_{uuid.uuid4().hex[:8]}{suffix}"
+        content_hash = hashlib.blake2b(digest_size=16)
+        uploaded_file.seek(0)
+        try:
+            with open(video_path, 'wb') as out_file:
+                while True:
+                    chunk = uploaded_file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    out_file.write(chunk)
+                    content_hash.update(chunk)
+        except Exception:
+            video_path.unlink(missing_ok=True)
+            raise
+        
+        metadata = self.probe(video_path)
+        metadata['original_name'] = uploaded_file.name
+        metadata['content_hash'] = content_hash.hexdigest()
+        return str(video_path), metadata
+    
+    @staticmethod
+    def probe(video_path):
+        """Read container metadata with a single VideoCapture"""
+        if ImageSequenceSource.is_sequence(video_path):
+            return ImageSequenceSource.probe(video_path)
+        cap = cv2.VideoCapture(str(video_path))
+        try:
+            if not cap.isOpened():
+                raise ValueError("Invalid video file")
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            metadata = {
+                'path': str(video_path),
+                'total_frames': total_frames,
+                'fps': fps,
+                'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                'duration': total_frames / fps if fps > 0 else 0,
+                'size_bytes': os.path.getsize(video_path) if os.path.isfile(str(video_path)) else 0
+            }
+        finally:
+            cap.release()
+        return metadata
+    
+    def release_session(self, session_id):
+        """Delete every temporary file belonging to a session"""
+        shutil.rmtree(self.session_dir(session_id), ignore_errors=True)
+    
+    def collect_garbage(self, keep_session=None, incoming_bytes=0):
+        """Remove expired sessions, then the oldest ones until the quota can hold the incoming upload"""
+        if not self.root.exists():
+            return
+        
+        sessions = []
+        for session_dir in self.root.iterdir():
+            if not session_dir.is_dir():
+                continue
+            files = [f for f in session_dir.iterdir() if f.is_file()]
+            size = sum(f.stat().st_size for f in files)
+            mtime = max((f.stat().st_mtime for f in files), default=session_dir.stat().st_mtime)
+            sessions.append((mtime, size, session_dir))
+        sessions.sort()
+        
+        expiry = time.time() - self.max_age_hours * 3600
+        total_size = sum(size for _, size, _ in sessions)
+        for mtime, size, session_dir in sessions:
+            if session_dir.name == keep_session:
+                continue
+            if mtime < expiry or total_size + incoming_bytes > self.quota_bytes:
+                shutil.rmtree(session_dir, ignore_errors=True)
+                total_size -= size
+                logger.info(f"Removed temporary uploads: {session_dir}")
+
+class FrameIndex:
+    """Per-video table of frame timestamps, packet byte offsets and keyframes for random access"""
+    def __init__(self, video_path, timestamps, byte_offsets, keyframes, fps):
+        self.video_path = str(video_path)
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.byte_offsets = np.asarray(byte_offsets, dtype=np.int64)
+        self.keyframes = np.asarray(keyframes, dtype=bool)
+        self.fps = fps
+        self.keyframe_indices = np.flatnonzero(self.keyframes)
+    
+    def __len__(self):
+        return len(self.timestamps)
+    
+    @staticmethod
+    def index_path(video_path):
+        return Path(f"{video_path}.sidx.npz")
+    
+    @classmethod
+    def load_or_build(cls, video_path, metadata=None):
+        """Load the index persisted next to the video, rebuilding it if the video changed"""
+        stat = os.stat(video_path)
+        index_path = cls.index_path(video_path)
+        if index_path.exists():
+            try:
+                with np.load(index_path) as data:
+                    if int(data['source_size']) == stat.st_size and float(data['source_mtime']) == stat.st_mtime:
+                        return cls(video_path, data['timestamps'], data['byte_offsets'], data['keyframes'], float(data['fps']))
+            except Exception as e:
+                logger.warning(f"Rebuilding unreadable frame index {index_path}: {str(e)}")
+        
+        index = cls.build(video_path, metadata)
+        try:
+            np.savez(index_path, timestamps=index.timestamps, byte_offsets=index.byte_offsets,
+                     keyframes=index.keyframes, fps=index.fps,
+                     source_size=stat.st_size, source_mtime=stat.st_mtime)
+        except OSError as e:
+            logger.warning(f"Could not persist frame index next to {video_path}: {str(e)}")
+        return index
+    
+    @classmethod
+    def build(cls, video_path, metadata=None):
+        metadata = metadata or VideoUploadManager.probe(video_path)
+        fps = metadata['fps'] if metadata['fps'] > 0 else 30
+        if shutil.which("ffprobe"):
+            try:
+                return cls._build_with_ffprobe(video_path, fps)
+            except Exception as e:
+                logger.warning(f"ffprobe indexing failed, falling back to constant frame rate: {str(e)}")
+        
+        # Without packet information every frame is assumed seekable through OpenCV
+        total_frames = max(metadata['total_frames'], 0)
+        keyframes = np.zeros(total_frames, dtype=bool)
+        keyframes[:1] = True
+        return cls(video_path, np.arange(total_frames) / fps, np.full(total_frames, -1), keyframes, fps)
+    
+    @classmethod
+    def _build_with_ffprobe(cls, video_path, fps):
+        """Read packet timestamps, offsets and key flags without decoding any frame"""
+        command = [
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,pos,flags", "-of", "compact=p=0",
+            str(video_path)
+        ]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        
+        packets = []
+        for line in output.splitlines():
+            fields = dict(field.split('=', 1) for field in line.split('|') if '=' in field)
+            if fields.get('pts_time', 'N/A') == 'N/A':
+                continue
+            position = fields.get('pos', 'N/A')
+            packets.append((float(fields['pts_time']), int(position) if position != 'N/A' else -1, 'K' in fields.get('flags', '')))
+        if not packets:
+            raise ValueError("no video packets found")
+        
+        # Packets come in decode order; frames are numbered in presentation order
+        packets.sort(key=lambda packet: packet[0])
+        timestamps, byte_offsets, keyframes = zip(*packets)
+        timestamps = np.array(timestamps) - packets[0][0]
+        return cls(video_path, timestamps, byte_offsets, keyframes, fps)
+    
+    def frame_at_time(self, seconds):
+        """Index of the frame displayed at the given media time"""
+        if len(self) == 0:
+            return 0
+        return int(np.clip(np.searchsorted(self.timestamps, seconds, side='right') - 1, 0, len(self) - 1))
+    
+    def keyframe_before(self, frame_index):
+        position = np.searchsorted(self.keyframe_indices, frame_index, side='right') - 1
+        return int(self.keyframe_indices[position]) if position >= 0 else 0
+    
+    def gop_ranges(self):
+        """Half-open (start, end) frame ranges that can be decoded independently"""
+        bounds = list(self.keyframe_indices) + [len(self)]
+        return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    
+    def seek(self, cap, frame_index):
+        """Position a VideoCapture so that the next read returns frame_index"""
+        keyframe = self.keyframe_before(frame_index)
+        if len(self.keyframe_indices) <= 1:
+            # Keyframes unknown: let the backend do the accurate seek
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            return
+        cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        for _ in range(frame_index - keyframe):
+            if not cap.grab():
+                break
+    
+    def read_frame(self, frame_index):
+        """Decode a single frame, e.g. for an alert thumbnail"""
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            self.seek(cap, frame_index)
+            ret, frame = cap.read()
+            return frame if ret else None
+        finally:
+            cap.release()
+    
+    def parallel_decode(self, frame_fn, max_workers=None, frame_range=None, ranges=None):
+        """Decode independent GOP ranges in worker threads, calling frame_fn(frame_index, frame) for each frame
+        
+        Explicit disjoint ranges are decoded as given; otherwise frame_range is split at keyframes.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        if ranges is not None:
+            chunks = ranges
+        else:
+            start, end = frame_range or (0, len(self))
+            if len(self.keyframe_indices) > 1:
+                ranges = [(max(s, start), min(e, end)) for s, e in self.gop_ranges() if e > start and s < end]
+            else:
+                # Keyframes unknown: any split works since seek() falls back to accurate backend seeking
+                step = max(1, -(-(end - start) // (max_workers * 4)))
+                ranges = [(s, min(s + step, end)) for s in range(start, end, step)]
+            
+            # Group consecutive GOPs so each worker opens its capture a handful of times only
+            chunks = self._split_contiguous(ranges, max(1, min(len(ranges), max_workers * 4))) if ranges else []
+        
+        def decode_range(frame_range):
+            cap = cv2.VideoCapture(self.video_path)
+            results = []
+            try:
+                range_start, range_end = frame_range
+                self.seek(cap, range_start)
+                for frame_index in range(range_start, range_end):
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    results.append(frame_fn(frame_index, frame))
+                return results
+            finally:
+                cap.release()
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = []
+            for chunk_results in executor.map(decode_range, chunks):
+                results.extend(chunk_results)
+        return results
+    
+    def read_frames(self, frame_indices, max_workers=None):
+        """Decode several frames at once, each GOP that holds one of them decoded once and GOPs in parallel"""
+        wanted = set(int(i) for i in frame_indices if 0 <= i < len(self))
+        ranges = []
+        for frame_index in sorted(wanted):
+            # With keyframes unknown seek() is accurate, so each frame is its own range
+            start = self.keyframe_before(frame_index) if len(self.keyframe_indices) > 1 else frame_index
+            if ranges and start < ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], frame_index + 1)
+            else:
+                ranges.append((start, frame_index + 1))
+        decoded = self.parallel_decode(
+            lambda frame_index, frame: (frame_index, frame) if frame_index in wanted else None,
+            max_workers, ranges=ranges
+        )
+        return dict(item for item in decoded if item is not None)
+    
+    @staticmethod
+    def _split_contiguous(ranges, chunk_count):
+        per_chunk = -(-len(ranges) // chunk_count)
+        return [(ranges[i][0], ranges[min(i + per_chunk, len(ranges)) - 1][1]) for i in range(0, len(ranges), per_chunk)]
+
+def target_frame_size(width, height, target_width):
+    """(width, height) of a frame resized to target_width with its aspect ratio preserved"""
+    return target_width, int(height * (target_width / width))
+
+class OpenCVFrameSource:
+    """Decodes and resizes frames in the analysis process into reused buffers"""
+    def __init__(self, video_source, target_width, start_frame=0, frame_index=None):
+        self.video_source = video_source
+        self.target_width = target_width
+        self.position = start_frame
+        self.frame_index = frame_index
+        self.cap = None
+        self.decode_buffer = None
+        self.resize_buffer = None
+    
+    def open(self):
+        self.cap = cv2.VideoCapture(self.video_source)
+        if not self.cap.isOpened():
+            return False
+        if self.position > 0:
+            self.frame_index.seek(self.cap, self.position)
+        return True
+    
+    def read(self):
+        """Next (frame_index, frame); the frame stays valid until the following read"""
+        ret, self.decode_buffer = self.cap.read(self.decode_buffer)
+        if not ret:
+            return None
+        height, width = self.decode_buffer.shape[:2]
+        size = target_frame_size(width, height, self.target_width)
+        if self.resize_buffer is None or self.resize_buffer.shape[:2] != (size[1], size[0]):
+            self.resize_buffer = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        cv2.resize(self.decode_buffer, size, dst=self.resize_buffer)
+        self.position += 1
+        return self.position - 1, self.resize_buffer
+    
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+class LatestFrameReader:
+    """Captures a live camera on its own thread and hands out only the newest frame"""
+    def __init__(self, video_source, target_width):
+        self.video_source = video_source
+        self.target_width = target_width
+        self.cap = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.condition = threading.Condition()
+        
+        # Triple buffering: the capture thread fills back, publishes it as latest, the consumer holds front
+        self.back = None
+        self.latest = None
+        self.front = None
+        self.latest_fresh = False
+        self.latest_position = -1
+        self.latest_capture_time = None
+        self.finished = False
+        self.frames_captured = 0
+        self.frames_superseded = 0
+        self.capture_time = None
+    
+    def open(self):
+        self.cap = cv2.VideoCapture(self.video_source)
+        if not self.cap.isOpened():
+            return False
+        # Keep the driver queue at one frame so grabs are never served from a stale backlog
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.thread = threading.Thread(target=self._capture_loop, name="latest-frame-capture", daemon=True)
+        self.thread.start()
+        return True
+    
+    def _capture_loop(self):
+        decode_buffer = None
+        try:
+            while not self.stop_event.is_set():
+                if not self.cap.grab():
+                    break
+                captured = time.monotonic()
+                ret, decode_buffer = self.cap.retrieve(decode_buffer)
+                if not ret:
+                    break
+                height, width = decode_buffer.shape[:2]
+                size = target_frame_size(width, height, self.target_width)
+                back = self.back
+                if back is None or back.shape[:2] != (size[1], size[0]):
+                    back = np.empty((size[1], size[0], 3), dtype=np.uint8)
+                cv2.resize(decode_buffer, size, dst=back)
+                with self.condition:
+                    if self.latest_fresh:
+                        self.frames_superseded += 1
+                    self.back, self.latest = self.latest, back
+                    self.latest_fresh = True
+                    self.latest_position = self.frames_captured
+                    self.latest_capture_time = captured
+                    self.frames_captured += 1
+                    self.condition.notify()
+        except Exception as e:
+            logger.error(f"Camera capture error: {str(e)}")
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+    
+    def read(self):
+        """Newest (frame_index, frame), waiting for one captured after the previous read"""
+        with self.condition:
+            while not self.latest_fresh:
+                if self.finished:
+                    return None
+                self.condition.wait(timeout=1.0)
+            self.front, self.latest = self.latest, self.front
+            self.latest_fresh = False
+            self.capture_time = self.latest_capture_time
+            return self.latest_position, self.front
+    
+    def latency_ms(self):
+        """Milliseconds since the frame returned by the last read was captured"""
+        return (time.monotonic() - self.capture_time) * 1000 if self.capture_time is not None else None
+    
+    def release(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+class SharedFrameRing:
+    """Preallocated frame slots in shared memory, exchanged between processes by slot index"""
+    # Rings whose close had to wait for frame views still held by a consumer
+    deferred = []
+    
+    def __init__(self, slot_shape, slot_count, name=None, create=True):
+        self.close_deferred()
+        self.slot_shape = tuple(slot_shape)
+        self.slot_count = slot_count
+        size = int(np.prod(self.slot_shape)) * slot_count
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.frames = np.ndarray((slot_count, *self.slot_shape), dtype=np.uint8, buffer=self.shm.buf)
+        self.views = []  # Weak references to slot views handed out of this process's code
+    
+    def view(self, slot):
+        """Slot as an array for a consumer; the mapping stays open while this view (or one derived from it) lives"""
+        frame = self.frames[slot]
+        self.views = [ref for ref in self.views if ref() is not None]
+        self.views.append(weakref.ref(frame))
+        return frame
+    
+    def in_use(self):
+        return any(ref() is not None for ref in self.views)
+    
+    @property
+    def name(self):
+        return self.shm.name
+    
+    def close(self):
+        """Unmap the ring, deferred while a frame handed to a consumer still points into it"""
+        # Views into the buffer must be dropped before the mapping can be closed
+        self.frames = None
+        SharedFrameRing.deferred.append(self)
+        self.close_deferred()
+    
+    @classmethod
+    def close_deferred(cls):
+        pending, cls.deferred = cls.deferred, []
+        for ring in pending:
+            try:
+                if ring.in_use():
+                    raise BufferError("frame view still held")
+                ring.shm.close()
+            except BufferError:
+                cls.deferred.append(ring)
+    
+    def unlink(self):
+        self.shm.unlink()
+
+def _shared_memory_decoder_main(video_source, frame_index, start_frame, ring_name, slot_shape, slot_count,
+                                free_slots, filled_slots, stop_event):
+    """Decoder process: decode, resize straight into free ring slots and publish their indices"""
+    ring = SharedFrameRing(slot_shape, slot_count, name=ring_name, create=False)
+    cap = cv2.VideoCapture(video_source)
+    decode_buffer = None
+    position = start_frame
+    try:
+        if start_frame > 0:
+            frame_index.seek(cap, start_frame)
+        while not stop_event.is_set():
+            ret, decode_buffer = cap.read(decode_buffer)
+            if not ret:
+                break
+            slot = None
+            while slot is None and not stop_event.is_set():
+                try:
+                    slot = free_slots.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            if slot is None:
+                break
+            cv2.resize(decode_buffer, (slot_shape[1], slot_shape[0]), dst=ring.frames[slot])
+            filled_slots.put((slot, position))
+            position += 1
+    finally:
+        filled_slots.put(None)
+        cap.release()
+        ring.close()
+
+class SharedMemoryFrameSource:
+    """Frames decoded by a separate process into a shared-memory ring, read here without copying"""
+    def __init__(self, video_source, frame_size, start_frame=0, frame_index=None, slot_count=8):
+        self.video_source = video_source
+        self.frame_size = frame_size
+        self.start_frame = start_frame
+        self.frame_index = frame_index
+        self.slot_count = slot_count
+        self.ring = None
+        self.process = None
+        self.held_slot = None
+    
+    def open(self):
+        context = multiprocessing.get_context()
+        slot_shape = (self.frame_size[1], self.frame_size[0], 3)
+        self.ring = SharedFrameRing(slot_shape, self.slot_count)
+        self.free_slots = context.Queue()
+        self.filled_slots = context.Queue()
+        self.stop_event = context.Event()
+        for slot in range(self.slot_count):
+            self.free_slots.put(slot)
+        self.process = context.Process(
+            target=_shared_memory_decoder_main,
+            args=(self.video_source, self.frame_index, self.start_frame, self.ring.name, slot_shape,
+                  self.slot_count, self.free_slots, self.filled_slots, self.stop_event),
+            daemon=True
+        )
+        self.process.start()
+        return True
+    
+    def read(self):
+        """Next (frame_index, frame) as a view into the ring; the slot is recycled on the following read"""
+        if self.held_slot is not None:
+            self.free_slots.put(self.held_slot)
+            self.held_slot = None
+        while True:
+            try:
+                item = self.filled_slots.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not self.process.is_alive():
+                    return None
+        if item is None:
+            return None
+        self.held_slot, position = item
+        return position, self.ring.view(self.held_slot)
+    
+    def release(self):
+        if self.process is None:
+            return
+        self.stop_event.set()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+        # The caller may still hold the last frame; unlinking first frees the name whatever close() manages
+        self.held_slot = None
+        self.ring.unlink()
+        self.ring.close()
+
+def _replica_worker_main(model_path, class_names, settings, entry, ring_name, slot_shape, slot_count, tasks, results):
+    """Replica process: run the model on ring slots named by (sequence, slot, region) tasks"""
+    ring = SharedFrameRing(slot_shape, slot_count, name=ring_name, create=False)
+    try:
+        ThreadPlanner.apply_entry(entry)
+        manager = YOLOModelManager()
+        manager.class_names = class_names
+        manager.fused_preprocessing = settings['fused_preprocessing']
+        manager.candidate_conf_floor = settings['conf_floor']
+        manager.candidate_iou_floor = settings['iou_floor']
+        try:
+            manager.load_model_or_raise(model_path)
+        except Exception as e:
+            # The parent reports the error: this process has no page to show it on
+            logger.error(f"Replica {entry['stream']} could not load {model_path}: {str(e)}")
+            results.put(('ready', entry['stream'], str(e)))
+            return
+        results.put(('ready', entry['stream'], None))
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            sequence, slot, region = task
+            try:
+                candidates = manager.detect_candidates(ring.frames[slot], region)
+            except Exception as e:
+                logger.error(f"Replica {entry['stream']} failed on frame {sequence}: {str(e)}")
+                candidates = empty_candidates()
+            results.put((sequence, slot, candidates))
+    finally:
+        ring.close()
+
+class ModelReplicaPool:
+    """Model replicas in worker processes fed through a shared-memory ring, with results reassembled in frame order"""
+    def __init__(self, model_path, class_names, settings, plan, frame_shape, slots_per_replica=2):
+        self.model_path = model_path
+        self.class_names = class_names
+        self.settings = settings
+        self.plan = plan
+        self.frame_shape = tuple(frame_shape)
+        self.slot_count = len(plan) * slots_per_replica + 1
+        self.key = (model_path, len(plan), self.frame_shape, tuple(sorted(settings.items())))
+        self.ring = None
+        self.processes = []
+        self.free_slots = deque(range(self.slot_count))
+        self.held_slot = None
+        self.next_sequence = 0
+        self.next_result_sequence = 0
+        self.in_flight = {}  # sequence -> (slot, meta)
+        self.completed = {}  # sequence -> candidates that arrived ahead of an older frame
+        self.completion_times = deque(maxlen=60)
+        self.reorder_waits = 0
+        self.broken = False
+    
+    def start(self):
+        """Start the replicas and wait until each has loaded its model"""
+        context = multiprocessing.get_context()
+        self.ring = SharedFrameRing(self.frame_shape, self.slot_count)
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        for entry in self.plan:
+            process = context.Process(
+                target=_replica_worker_main,
+                args=(self.model_path, self.class_names, self.settings, entry, self.ring.name, self.frame_shape,
+                      self.slot_count, self.tasks, self.results),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+        for _ in self.processes:
+            _, replica, error = self.results.get(timeout=600)
+            if error is not None:
+                self.close()
+                raise RuntimeError(f"Model replica {replica} could not load {self.model_path}: {error}")
+        logger.info(f"{len(self.processes)} model replicas started for {self.frame_shape} frames")
+    
+    def submit(self, frame, region, meta):
+        """Copy a frame into a free slot and queue it for the next idle replica"""
+        slot = self.free_slots.popleft()
+        np.copyto(self.ring.frames[slot], frame)
+        self.in_flight[self.next_sequence] = (slot, meta)
+        self.tasks.put((self.next_sequence, slot, region))
+        self.next_sequence += 1
+    
+    def next_result(self):
+        """Oldest submitted (meta, frame, candidates); the frame stays valid until the following call"""
+        if self.held_slot is not None:
+            self.free_slots.append(self.held_slot)
+            self.held_slot = None
+        sequence = self.next_result_sequence
+        while sequence not in self.completed:
+            try:
+                done_sequence, _, candidates = self.results.get(timeout=1.0)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    self.broken = True
+                    raise RuntimeError("A model replica exited unexpectedly")
+                continue
+            self.completed[done_sequence] = candidates
+            if done_sequence != sequence:
+                self.reorder_waits += 1
+        self.next_result_sequence += 1
+        slot, meta = self.in_flight.pop(sequence)
+        self.held_slot = slot
+        self.completion_times.append(time.perf_counter())
+        return meta, self.ring.view(slot), self.completed.pop(sequence)
+    
+    def stream(self, source, next_region, first_item=None):
+        """Yield (frame_index, frame, candidates) for a frame source in order, keeping every replica busy"""
+        pending_item = first_item
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and self.free_slots:
+                    item = pending_item if pending_item is not None else source.read()
+                    pending_item = None
+                    if item is None:
+                        exhausted = True
+                        break
+                    position, frame = item
+                    self.submit(frame, next_region(frame), position)
+                if not self.in_flight:
+                    return
+                position, frame, candidates = self.next_result()
+                yield position, frame, candidates
+        finally:
+            self.drain()
+    
+    def drain(self):
+        """Wait out frames still in flight so the slots can be reused by the next run"""
+        while self.in_flight and not self.broken:
+            self.next_result()
+        if self.held_slot is not None:
+            self.free_slots.append(self.held_slot)
+            self.held_slot = None
+    
+    def stats(self):
+        times = self.completion_times
+        return {
+            'replicas': len(self.processes),
+            'in_flight': len(self.in_flight),
+            'throughput_fps': (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0,
+            'reorder_waits': self.reorder_waits
+        }
+    
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        if self.ring is not None:
+            self.held_slot = None
+            self.ring.unlink()
+            self.ring.close()
+            self.ring = None
+
+class FFmpegPipeSource:
+    """Decodes through an ffmpeg subprocess that scales and converts to BGR before frames reach Python"""
+    _version = None  # (major, minor) of the installed ffmpeg, probed once
+    
+    def __init__(self, video_source, frame_size, start_frame=0, frame_index=None, threads=0):
+        self.video_source = video_source
+        self.frame_size = frame_size
+        self.position = start_frame
+        self.frame_index = frame_index
+        self.threads = threads
+        self.process = None
+        # Raw frames are read straight into this buffer, no per-frame allocation
+        self.buffer = np.empty((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+        self.buffer_view = memoryview(self.buffer.reshape(-1))
+    
+    @staticmethod
+    def available():
+        return shutil.which("ffmpeg") is not None
+    
+    @classmethod
+    def version(cls):
+        """(major, minor) of the installed ffmpeg; development builds without a release number count as newest"""
+        if cls._version is None:
+            cls._version = (99, 0)
+            try:
+                banner = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, timeout=10).stdout.split()
+                release = banner[2].lstrip('n').split('-')[0].split('.') if len(banner) > 2 else []
+                if len(release) >= 2 and release[0].isdigit() and release[1].isdigit():
+                    cls._version = (int(release[0]), int(release[1]))
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.error(f"Could not read the ffmpeg version: {str(e)}")
+        return cls._version
+    
+    def seek_time(self):
+        """Presentation time of self.position, extrapolated past the end of the index"""
+        timestamps = self.frame_index.timestamps
+        if self.position < len(timestamps):
+            return float(timestamps[self.position])
+        last_time = float(timestamps[-1]) if len(timestamps) else 0.0
+        return last_time + (self.position - len(timestamps) + 1) / (self.frame_index.fps or 25)
+    
+    def command(self):
+        width, height = self.frame_size
+        command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-threads", str(self.threads)]
+        if self.position > 0:
+            # Input seeking jumps to the preceding keyframe and decodes up to the exact frame
+            command += ["-ss", f"{self.seek_time():.6f}"]
+        # -fps_mode replaced -vsync in ffmpeg 5.1
+        passthrough = ["-fps_mode", "passthrough"] if self.version() >= (5, 1) else ["-vsync", "passthrough"]
+        command += [
+            "-i", str(self.video_source), "-an", "-sn", "-dn",
+            "-vf", f"scale={width}:{height}:flags=bilinear", *passthrough,
+            "-pix_fmt", "bgr24", "-f", "rawvideo", "pipe:1"
+        ]
+        return command
+    
+    def open(self):
+        if not self.available():
+            logger.error("ffmpeg reader selected but ffmpeg is not installed")
+            return False
+        try:
+            self.process = subprocess.Popen(self.command(), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, bufsize=0)
+        except OSError as e:
+            logger.error(f"Could not start ffmpeg: {str(e)}")
+            return False
+        return True
+    
+    def read(self):
+        """Next (frame_index, frame); the frame stays valid until the following read"""
+        filled = 0
+        while filled < len(self.buffer_view):
+            count = self.process.stdout.readinto(self.buffer_view[filled:])
+            if not count:
+                return None
+            filled += count
+        self.position += 1
+        return self.position - 1, self.buffer
+    
+    def release(self):
+        if self.process is None:
+            return
+        self.process.stdout.close()
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+class ImageSequenceSource:
+    """Frames of an image folder, decoded ahead of the consumer by a thread pool"""
+    DEFAULT_FPS = 25.0
+    # JPEG decoders scale in the DCT domain: far cheaper than decoding full size and resizing
+    REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+    
+    def __init__(self, folder, target_width, start_frame=0, source_size=None, workers=None, prefetch=None,
+                 reduced_decode=True):
+        self.folder = Path(folder)
+        self.target_width = target_width
+        self.start_frame = start_frame
+        self.source_size = source_size
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.prefetch = prefetch or self.workers * 4
+        self.reduced_decode = reduced_decode
+        self.frames = []
+        self.frame_size = None
+        self.imread_flag = cv2.IMREAD_COLOR
+        self.executor = None
+        self.pending = deque()
+        self.next_position = start_frame
+    
+    @staticmethod
+    def is_sequence(video_source):
+        return isinstance(video_source, (str, Path)) and os.path.isdir(video_source)
+    
+    @staticmethod
+    def list_images(folder):
+        return sorted(path for path in Path(folder).iterdir() if path.suffix.lower() in IMAGE_EXTENSIONS)
+    
+    @classmethod
+    def probe(cls, folder, fps=None):
+        """Metadata of a frame folder in the same form as VideoUploadManager.probe"""
+        frames = cls.list_images(folder)
+        if not frames:
+            raise ValueError(f"No images in {folder}")
+        first_frame = cv2.imread(str(frames[0]))
+        if first_frame is None:
+            raise ValueError(f"Unreadable image {frames[0]}")
+        fps = fps or cls.DEFAULT_FPS
+        height, width = first_frame.shape[:2]
+        return {
+            'path': str(folder),
+            'total_frames': len(frames),
+            'fps': fps,
+            'width': width,
+            'height': height,
+            'duration': len(frames) / fps,
+            'size_bytes': sum(path.stat().st_size for path in frames),
+            'content_hash': EvaluationHarness.sequence_hash(frames)
+        }
+    
+    def open(self):
+        self.frames = self.list_images(self.folder)
+        if not self.frames:
+            return False
+        if self.source_size is None:
+            first_frame = cv2.imread(str(self.frames[0]))
+            if first_frame is None:
+                return False
+            self.source_size = (first_frame.shape[1], first_frame.shape[0])
+        self.frame_size = target_frame_size(self.source_size[0], self.source_size[1], self.target_width)
+        if self.reduced_decode:
+            for factor, flag in self.REDUCED_FLAGS:
+                if self.source_size[0] // factor >= self.frame_size[0]:
+                    self.imread_flag = flag
+                    break
+        # imread and resize release the GIL, so decode threads run in parallel with inference
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sequence-decode")
+        for _ in range(self.prefetch):
+            self._submit_next()
+        return True
+    
+    def _submit_next(self):
+        if self.next_position < len(self.frames):
+            self.pending.append((self.next_position, self.executor.submit(self._decode, self.frames[self.next_position])))
+            self.next_position += 1
+    
+    def _decode(self, path):
+        image = cv2.imread(str(path), self.imread_flag)
+        if image is None or (image.shape[1], image.shape[0]) == self.frame_size:
+            return image
+        return cv2.resize(image, self.frame_size)
+    
+    def read(self):
+        """Next (frame_index, frame) from the prefetch buffer, skipping unreadable files"""
+        while self.pending:
+            position, future = self.pending.popleft()
+            self._submit_next()
+            frame = future.result()
+            if frame is None:
+                logger.warning(f"Skipping unreadable frame {self.frames[position]}")
+                continue
+            return position, frame
+        return None
+    
+    def release(self):
+        if self.executor is None:
+            return
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.pending.clear()
+
+READER_BACKENDS = {
+    'opencv': "OpenCV (in-process)",
+    'shared_memory': "Decoder process (shared memory)",
+    'ffmpeg': "ffmpeg pipe (decoder-side scaling)"
+}
+
+def open_frame_source(backend, video_source, target_width, start_frame=0, frame_index=None, metadata=None):
+    """Create and open the frame source for the selected reader backend"""
+    if isinstance(video_source, int):
+        # Live cameras always run on the freshest frame instead of a queued backlog
+        source = LatestFrameReader(video_source, target_width)
+    elif ImageSequenceSource.is_sequence(video_source):
+        # Frame folders are decoded by their own prefetching thread pool with any backend
+        source_size = (metadata['width'], metadata['height']) if metadata else None
+        source = ImageSequenceSource(video_source, target_width, start_frame, source_size)
+    elif backend == 'shared_memory':
+        if metadata is None:
+            # Camera: the ring needs the frame size before the decoder process opens the device
+            metadata = VideoUploadManager.probe(video_source)
+        frame_size = target_frame_size(metadata['width'], metadata['height'], target_width)
+        source = SharedMemoryFrameSource(video_source, frame_size, start_frame, frame_index)
+    elif backend == 'ffmpeg':
+        metadata = metadata or VideoUploadManager.probe(video_source)
+        frame_size = target_frame_size(metadata['width'], metadata['height'], target_width)
+        if start_frame > 0 and frame_index is None:
+            frame_index = FrameIndex.load_or_build(video_source, metadata)
+        source = FFmpegPipeSource(video_source, frame_size, start_frame, frame_index)
+    else:
+        source = OpenCVFrameSource(video_source, target_width, start_frame, frame_index)
+    return source if source.open() else None
+
+def benchmark_reader_backends(video_path, target_width=640, max_frames=300, backends=None):
+    """Decode the start of a video with each reader backend and compare frame rates and output pixels"""
+    metadata = VideoUploadManager.probe(video_path)
+    if backends is None:
+        backends = [backend for backend in READER_BACKENDS if backend != 'ffmpeg' or FFmpegPipeSource.available()]
+    results = {}
+    reference = []
+    for backend in backends:
+        source = open_frame_source(backend, video_path, target_width, metadata=metadata)
+        if source is None:
+            results[backend] = {'error': "could not open"}
+            continue
+        frames, differences = 0, []
+        try:
+            start_time = time.perf_counter()
+            while frames < max_frames:
+                item = source.read()
+                if item is None:
+                    break
+                # Every 30th frame is compared with the in-process OpenCV output
+                if frames % 30 == 0:
+                    if backend == 'opencv':
+                        reference.append(item[1].copy())
+                    elif frames // 30 < len(reference):
+                        differences.append(float(np.mean(cv2.absdiff(item[1], reference[frames // 30]))))
+                frames += 1
+            elapsed = time.perf_counter() - start_time
+        finally:
+            source.release()
+        results[backend] = {
+            'frames': frames,
+            'fps': frames / elapsed if elapsed > 0 else 0,
+            'ms_per_frame': elapsed / max(frames, 1) * 1000,
+            'mean_abs_diff': float(np.mean(differences)) if differences else 0.0
+        }
+    return results
+
+class StereoFrameSource:
+    """Synchronized left/right frames from two opened frame sources"""
+    def __init__(self, left_source, right_source):
+        self.left_source = left_source
+        self.right_source = right_source
+        self.right_buffer = None
+    
+    def read(self):
+        """Next (frame_index, (left, right)) with the right view at the left view's size"""
+        left_item, right_item = self.left_source.read(), self.right_source.read()
+        if left_item is None or right_item is None:
+            return None
+        position, left = left_item
+        right = right_item[1]
+        if right.shape != left.shape:
+            if self.right_buffer is None or self.right_buffer.shape != left.shape:
+                self.right_buffer = np.empty_like(left)
+            right = cv2.resize(right, (left.shape[1], left.shape[0]), dst=self.right_buffer)
+        return position, (left, right)
+    
+    def release(self):
+        self.left_source.release()
+        self.right_source.release()
+
+def open_stereo_source(backend, left_source, right_source, target_width, start_frame=0, left_metadata=None):
+    """Open both views at the same position, or None when either cannot be opened"""
+    right_index = left_index = None
+    if start_frame > 0 and not ImageSequenceSource.is_sequence(left_source):
+        right_index = FrameIndex.load_or_build(right_source)
+        left_index = FrameIndex.load_or_build(left_source, left_metadata)
+    left = open_frame_source(backend, left_source, target_width, start_frame, left_index, left_metadata)
+    right = open_frame_source(backend, right_source, target_width, start_frame, right_index, None)
+    if left is None or right is None:
+        for source in (left, right):
+            if source is not None:
+                source.release()
+        return None
+    return StereoFrameSource(left, right)
+
+RECORDINGS_DIR = Path.home() / ".surgisafe" / "recordings"
+
+class AnnotatedVideoRecorder:
+    """Writes annotated frames to rotating video segments on a dedicated encoder thread"""
+    POLICIES = {
+        'drop': "Drop frames when the encoder lags",
+        'block': "Wait for the encoder (lossless)"
+    }
+    
+    def __init__(self, output_dir, fps, policy='drop', queue_size=32, segment_seconds=600, segment_bytes=None,
+                 fourcc='mp4v', block_timeout=1.0):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.fps = fps if fps and fps > 0 else 30
+        self.policy = policy
+        self.queue_size = queue_size
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.fourcc = fourcc
+        self.block_timeout = block_timeout
+        self.frame_size = None
+        
+        # Frames travel through a fixed pool of buffers: the main thread only copies into a free one
+        self.free_buffers = queue.Queue()
+        self.pending = queue.Queue()
+        self.segments = []
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.encoder_lag = deque(maxlen=100)
+        self.thread = None
+    
+    def write(self, frame, timestamp):
+        """Hand a BGR frame to the encoder; never waits longer than block_timeout"""
+        if self.frame_size is None:
+            self._start(frame.shape)
+        try:
+            if self.policy == 'block':
+                buffer = self.free_buffers.get(timeout=self.block_timeout)
+            else:
+                buffer = self.free_buffers.get_nowait()
+        except queue.Empty:
+            self.frames_dropped += 1
+            return False
+        
+        # A width change mid-recording is scaled to the segment's frame size
+        if frame.shape == buffer.shape:
+            np.copyto(buffer, frame)
+        else:
+            cv2.resize(frame, self.frame_size, dst=buffer)
+        self.pending.put((buffer, timestamp, time.perf_counter()))
+        return True
+    
+    def _start(self, shape):
+        self.frame_size = (shape[1], shape[0])
+        for _ in range(self.queue_size):
+            self.free_buffers.put(np.empty(shape, dtype=np.uint8))
+        self.thread = threading.Thread(target=self._encoder_loop, daemon=True)
+        self.thread.start()
+    
+    def _open_segment(self, timestamp):
+        path = self.output_dir / f"segment_{len(self.segments):03d}_{int(timestamp)}s.mp4"
+        writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self.frame_size)
+        if not writer.isOpened():
+            raise RuntimeError(f"Cannot open video writer for {path}")
+        self.segments.append(str(path))
+        return writer, path
+    
+    def _encoder_loop(self):
+        writer, path, segment_start, segment_frames = None, None, 0.0, 0
+        try:
+            while True:
+                item = self.pending.get()
+                if item is None:
+                    return
+                buffer, timestamp, queued_at = item
+                try:
+                    rotate = writer is not None and (
+                        timestamp - segment_start >= self.segment_seconds
+                        or (self.segment_bytes and segment_frames % 30 == 0 and os.path.getsize(path) >= self.segment_bytes)
+                    )
+                    if rotate:
+                        writer.release()
+                        writer = None
+                    if writer is None:
+                        writer, path = self._open_segment(timestamp)
+                        segment_start, segment_frames = timestamp, 0
+                    writer.write(buffer)
+                    segment_frames += 1
+                    self.frames_written += 1
+                    self.encoder_lag.append(time.perf_counter() - queued_at)
+                except Exception as e:
+                    logger.error(f"Recording error: {str(e)}")
+                    self.frames_dropped += 1
+                finally:
+                    self.free_buffers.put(buffer)
+        finally:
+            if writer is not None:
+                writer.release()
+    
+    def stats(self):
+        lag = list(self.encoder_lag)
+        return {
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'queued': self.pending.qsize(),
+            'encoder_lag_ms': np.mean(lag) * 1000 if lag else 0.0,
+            'max_encoder_lag_ms': max(lag) * 1000 if lag else 0.0,
+            'segments': len(self.segments)
+        }
+    
+    def close(self):
+        """Finish encoding the queued frames and release the current segment"""
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+
+class PreAlertClipBuffer:
+    """Rolling JPEG-compressed history of annotated frames, written out as evidence clips when alerts fire"""
+    CLIP_LEVELS = ('critical', 'extended')
+    
+    def __init__(self, seconds=10, max_bytes=32 * 1024 ** 2, jpeg_quality=70, queue_size=4, fourcc='mp4v', max_pending_clips=4):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.jpeg_quality = jpeg_quality
+        self.queue_size = queue_size
+        self.fourcc = fourcc
+        self.max_pending_clips = max_pending_clips
+        self.frame_shape = None
+        
+        # Only the encoder thread touches the ring and the byte accounting; the frame loop just copies into a free buffer
+        self.ring = deque()  # (timestamp, JPEG bytes)
+        self.ring_bytes = 0
+        self.first_sequence = 0  # Sequence number of ring[0]
+        self.clip_spans = {}  # clip id -> (first, last) sequence numbers of a clip not yet written
+        self.held = deque()  # (sequence, size) of frames evicted from the ring that a clip in flight still holds
+        self.held_bytes = 0
+        self.next_clip_id = 0
+        self.free_buffers = queue.Queue()
+        self.pending = queue.Queue()
+        self.counters = defaultdict(int)
+        self.encoder = threading.Thread(target=self._encode_loop, name="alert-clip-encoder", daemon=True)
+        self.encoder.start()
+        self.clip_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="alert-clip-writer")
+    
+    def add(self, frame, timestamp):
+        """Queue an annotated frame for compression; dropped rather than waited on when the encoder lags"""
+        if frame.shape != self.frame_shape:
+            self.frame_shape = frame.shape
+            self.free_buffers = queue.Queue()
+            for _ in range(self.queue_size):
+                self.free_buffers.put(np.empty(frame.shape, dtype=frame.dtype))
+        try:
+            buffer = self.free_buffers.get_nowait()
+        except queue.Empty:
+            self.counters['frames_dropped'] += 1
+            return
+        np.copyto(buffer, frame)
+        self.pending.put(('frame', buffer, timestamp))
+    
+    def request_clip(self, name, output_dir):
+        """Paths the clip and thumbnail of the frames buffered so far will be written to"""
+        output_dir = Path(output_dir)
+        paths = {'clip': str(output_dir / f"{name}.mp4"), 'thumbnail': str(output_dir / f"{name}.jpg")}
+        # Queued behind the frames already added, so the clip ends with the frame that raised the alert
+        self.pending.put(('clip', paths, None))
+        return paths
+    
+    def _encode_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            kind, payload, timestamp = item
+            if kind == 'clip':
+                self._submit_clip(payload)
+                continue
+            if kind == 'written':
+                self._release_clip(payload)
+                continue
+            ok, encoded = cv2.imencode('.jpg', payload, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if payload.shape == self.frame_shape:
+                self.free_buffers.put(payload)
+            if not ok:
+                continue
+            data = encoded.tobytes()
+            self.ring.append((timestamp, data))
+            self.ring_bytes += len(data)
+            # Strict cap over the ring and the frames clips in flight still hold: the byte budget wins over the time window
+            while self.ring and (self.ring_bytes + self.held_bytes > self.max_bytes
+                                 or (timestamp - self.ring[0][0]).total_seconds() > self.seconds):
+                self._evict()
+    
+    def _holds(self, sequence):
+        return any(first <= sequence <= last for first, last in self.clip_spans.values())
+    
+    def _evict(self):
+        size = len(self.ring.popleft()[1])
+        self.ring_bytes -= size
+        if self._holds(self.first_sequence):
+            self.held.append((self.first_sequence, size))
+            self.held_bytes += size
+        self.first_sequence += 1
+    
+    def _submit_clip(self, paths):
+        if not self.ring:
+            return
+        # Each clip keeps its frames alive until written, so a backlog would starve the ring
+        if len(self.clip_spans) >= self.max_pending_clips:
+            self.counters['clips_dropped'] += 1
+            logger.warning(f"Alert clip {paths['clip']} dropped: {len(self.clip_spans)} clips still being written")
+            return
+        clip_id = self.next_clip_id
+        self.next_clip_id += 1
+        self.clip_spans[clip_id] = (self.first_sequence, self.first_sequence + len(self.ring) - 1)
+        self.clip_writer.submit(self._write_clip, list(self.ring), paths, clip_id)
+    
+    def _release_clip(self, clip_id):
+        del self.clip_spans[clip_id]
+        while self.held and not self._holds(self.held[0][0]):
+            self.held_bytes -= self.held.popleft()[1]
+    
+    def _write_clip(self, frames, paths, clip_id):
+        try:
+            Path(paths['clip']).parent.mkdir(parents=True, exist_ok=True)
+            with open(paths['thumbnail'], 'wb') as f:
+                f.write(frames[-1][1])
+            span = (frames[-1][0] - frames[0][0]).total_seconds()
+            fps = (len(frames) - 1) / span if span > 0 else 25
+            first = cv2.imdecode(np.frombuffer(frames[0][1], dtype=np.uint8), cv2.IMREAD_COLOR)
+            writer = cv2.VideoWriter(paths['clip'], cv2.VideoWriter_fourcc(*self.fourcc), fps, (first.shape[1], first.shape[0]))
+            try:
+                for _, data in frames:
+                    writer.write(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR))
+            finally:
+                writer.release()
+            self.counters['clips_written'] += 1
+        except Exception as e:
+            logger.error(f"Error writing alert clip {paths['clip']}: {str(e)}")
+        finally:
+            # The encoder thread does the byte accounting of the frames only this clip held
+            self.pending.put(('written', clip_id, None))
+    
+    def stats(self):
+        ring = list(self.ring)
+        return {
+            'frames': len(ring),
+            'seconds': (ring[-1][0] - ring[0][0]).total_seconds() if len(ring) > 1 else 0.0,
+            'bytes': self.ring_bytes + self.held_bytes,
+            'frames_dropped': self.counters['frames_dropped'],
+            'clips_written': self.counters['clips_written'],
+            'clips_dropped': self.counters['clips_dropped']
+        }
+    
+    def close(self):
+        self.pending.put(None)
+        self.encoder.join(timeout=5)
+        self.clip_writer.shutdown(wait=True)
+
+def file_content_hash(path, chunk_size=8 * 1024 * 1024):
+    """Hash a file's content in fixed-size chunks"""
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+class CachedDetections:
+    """Read-only, memory-mapped view of the raw candidates cached for one video"""
+    FRAME_DTYPE = np.dtype([('frame_index', '<i8'), ('timestamp', '<f8'), ('offset', '<i8'), ('count', '<i4')])
+    CANDIDATE_DTYPE = np.dtype([('class_id', '<i2'), ('score', '<f4'), ('box', '<f4', (4,))])
+    
+    def __init__(self, entry_dir):
+        self.entry_dir = Path(entry_dir)
+        with open(self.entry_dir / "meta.json") as f:
+            self.metadata = json.load(f)
+        self.frames = self._map(self.entry_dir / "frames.bin", self.FRAME_DTYPE)
+        self.candidates = self._map(self.entry_dir / "candidates.bin", self.CANDIDATE_DTYPE)
+    
+    @staticmethod
+    def _map(path, dtype):
+        # np.memmap refuses empty files, e.g. a video without any detection
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        # Plain ndarray view of the mapping: slicing a np.memmap per frame is comparatively slow
+        return np.asarray(np.memmap(path, dtype=dtype, mode='r'))
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def iter_frames(self):
+        """Yield (frame_index, timestamp, candidates) with candidates as views into the mapped file"""
+        for frame in self.frames:
+            records = self.candidates[frame['offset']:frame['offset'] + frame['count']]
+            candidates = {'boxes': records['box'], 'scores': records['score'], 'classes': records['class_id']}
+            yield int(frame['frame_index']), float(frame['timestamp']), candidates
+
+class DetectionCacheWriter:
+    """Appends per-frame raw candidates to a cache entry, published atomically on commit"""
+    def __init__(self, cache, key, metadata):
+        self.cache = cache
+        self.key = key
+        self.metadata = metadata
+        self.partial_dir = cache.root / f"{key}.partial"
+        shutil.rmtree(self.partial_dir, ignore_errors=True)
+        self.partial_dir.mkdir(parents=True)
+        self.frames_file = open(self.partial_dir / "frames.bin", 'wb')
+        self.candidates_file = open(self.partial_dir / "candidates.bin", 'wb')
+        self.candidate_offset = 0
+        self.frame_count = 0
+    
+    def add_frame(self, frame_index, timestamp, candidates):
+        count = len(candidates['scores'])
+        records = np.empty(count, dtype=CachedDetections.CANDIDATE_DTYPE)
+        records['class_id'] = candidates['classes']
+        records['score'] = candidates['scores']
+        records['box'] = candidates['boxes']
+        self.candidates_file.write(records.tobytes())
+        frame = np.array([(frame_index, timestamp, self.candidate_offset, count)], dtype=CachedDetections.FRAME_DTYPE)
+        self.frames_file.write(frame.tobytes())
+        self.candidate_offset += count
+        self.frame_count += 1
+    
+    def commit(self):
+        self.frames_file.close()
+        self.candidates_file.close()
+        self.metadata.update({'frames': self.frame_count, 'candidates': self.candidate_offset, 'created': datetime.now().isoformat()})
+        with open(self.partial_dir / "meta.json", 'w') as f:
+            json.dump(self.metadata, f, indent=2)
+        entry_dir = self.cache.root / self.key
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(self.partial_dir, entry_dir)
+        logger.info(f"Detection cache stored: {entry_dir} ({self.frame_count} frames)")
+        self.cache.prune()
+    
+    def abort(self):
+        self.frames_file.close()
+        self.candidates_file.close()
+        shutil.rmtree(self.partial_dir, ignore_errors=True)
+
+class DetectionCache:
+    """Persistent per-frame raw candidates keyed by video content, model file and inference parameters"""
+    FORMAT_VERSION = 2
+    
+    def __init__(self, root=None, max_bytes=5 * 1024 ** 3):
+        self.root = Path(root) if root else Path.home() / ".surgisafe" / "detection_cache"
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+    
+    @classmethod
+    def make_key(cls, video_hash, model_hash, target_width, inference_settings):
+        key_data = {
+            'format': cls.FORMAT_VERSION,
+            'video': video_hash,
+            'model': model_hash,
+            'target_width': int(target_width),
+            'inference': inference_settings
+        }
+        return hashlib.blake2b(json.dumps(key_data, sort_keys=True).encode(), digest_size=16).hexdigest()
+    
+    def lookup(self, key):
+        entry_dir = self.root / key
+        if not (entry_dir / "meta.json").exists():
+            return None
+        try:
+            return CachedDetections(entry_dir)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable detection cache entry {key}: {str(e)}")
+            return None
+    
+    def create_writer(self, key, metadata):
+        return DetectionCacheWriter(self, key, metadata)
+    
+    def prune(self):
+        """Drop the least recently written entries beyond the size budget"""
+        entries = []
+        for entry_dir in self.root.iterdir():
+            if entry_dir.is_dir() and (entry_dir / "meta.json").exists():
+                size = sum(f.stat().st_size for f in entry_dir.iterdir())
+                entries.append(((entry_dir / "meta.json").stat().st_mtime, size, entry_dir))
+        entries.sort(reverse=True)
+        total_size = 0
+        for _, size, entry_dir in entries:
+            total_size += size
+            if total_size > self.max_bytes:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+def track_log_record(detection, session_start_time):
+    """Track log record of one processed frame, with its media time"""
+    offset = (datetime.fromisoformat(detection['timestamp']) - session_start_time).total_seconds()
+    frame_index = detection.get('frame_index')
+    return {
+        # Camera frames have no index: number them by processing order from 0
+        'frame_index': detection['frame_number'] - 1 if frame_index is None else frame_index,
+        'timestamp': offset,
+        'tracks': detection['tracks']
+    }
+
+def track_log_lines(records, session_start_time):
+    """Per-frame tracks as JSON Lines: a header line, then one line per track_log_record"""
+    yield json.dumps({'format': 'surgisafe-tracks', 'version': 1, 'session_start_time': session_start_time.isoformat()}) + "\n"
+    for record in records:
+        yield json.dumps(record, default=_json_default) + "\n"
+
+def find_replay_sources(folder):
+    """Track logs and detection cache entries found in a folder"""
+    folder = Path(folder)
+    if (folder / "frames.bin").exists():
+        return [folder]
+    sources = sorted(folder.glob("*.jsonl"))
+    sources += sorted(entry for entry in folder.iterdir() if (entry / "frames.bin").exists())
+    return sources
+
+def read_track_log(path):
+    """Header and (frame_index, timestamp, tracks) frames of a log built from track_log_lines"""
+    with open(path, encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        frames = [(record['frame_index'], record['timestamp'], record['tracks']) for record in map(json.loads, f)]
+    return header, frames
+
+class ReplayEngine:
+    """Headless, deterministic replay of recorded detections through SurgiSafeCore in simulated time"""
+    # Fixed start so that repeated replays produce identical timestamps
+    DEFAULT_START_TIME = datetime(2000, 1, 1)
+    
+    def __init__(self, conf_threshold=0.05, iou_threshold=0.2, alert_thresholds=None,
+                 lost_after_seconds=5, risk_thresholds=None, class_names=None):
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.alert_thresholds = alert_thresholds
+        self.lost_after_seconds = lost_after_seconds
+        self.risk_thresholds = risk_thresholds
+        self.class_names = class_names
+    
+    def settings(self):
+        return {
+            'conf_threshold': self.conf_threshold,
+            'iou_threshold': self.iou_threshold,
+            'alert_thresholds': self.alert_thresholds,
+            'lost_after_seconds': self.lost_after_seconds,
+            'risk_thresholds': self.risk_thresholds
+        }
+    
+    def build_core(self, start_time, class_names=None, spill_dir=None):
+        """A core with its own state manager and no model; compacted records go to spill_dir"""
+        state_manager = SurgiSafeStateManager()
+        state_manager.session_start_time = start_time
+        if spill_dir is not None:
+            state_manager.spill_store = SessionSpillStore(spill_dir)
+        core = SurgiSafeCore(state_manager)
+        core.clock = SimulatedClock(start_time)
+        core.lost_after_seconds = self.lost_after_seconds
+        if self.risk_thresholds:
+            core.risk_thresholds.update(self.risk_thresholds)
+        if self.alert_thresholds:
+            core.alert_manager.alert_thresholds.update(self.alert_thresholds)
+        class_names = self.class_names or class_names
+        if class_names:
+            core.model_manager.class_names = {int(class_id): name for class_id, name in class_names.items()}
+        return core
+    
+    @staticmethod
+    def feed(core, frames, conf_threshold, iou_threshold, tracks=False):
+        """Push (frame_index, timestamp, candidates-or-tracks) frames through the core on its simulated clock"""
+        count = 0
+        core.reset_tracking()
+        # Replayed alerts are history, not events: keep them away from the nursing station and syslog sinks
+        live, core.live = core.live, False
+        try:
+            for frame_index, timestamp, detections in frames:
+                core.clock.set_offset(timestamp)
+                core.current_frame_index = frame_index
+                if tracks:
+                    core.process_frame(None, conf_threshold, iou_threshold, tracks=detections)
+                else:
+                    core.process_frame(None, conf_threshold, iou_threshold, candidates=detections)
+                count += 1
+        finally:
+            core.live = live
+        return count
+    
+    def replay(self, source, start_time=None):
+        """Replay a detection cache entry directory or a track log file; returns the session outputs"""
+        source = Path(source)
+        # Same retention as a live run, so the outputs match it, with spills in a throwaway directory
+        with tempfile.TemporaryDirectory(prefix="surgisafe_replay_") as spill_dir:
+            if source.is_dir():
+                cached = CachedDetections(source)
+                core = self.build_core(start_time or self.DEFAULT_START_TIME, cached.metadata.get('class_names'), spill_dir)
+                frames, is_tracks = cached.iter_frames(), False
+            else:
+                header, frames = read_track_log(source)
+                if start_time is None:
+                    start_time = datetime.fromisoformat(header['session_start_time'])
+                core = self.build_core(start_time, spill_dir=spill_dir)
+                is_tracks = True
+            
+            started = time.perf_counter()
+            frame_count = self.feed(core, frames, self.conf_threshold, self.iou_threshold, tracks=is_tracks)
+            elapsed = time.perf_counter() - started
+            return self._summarize(source, core, frame_count, elapsed)
+    
+    def _summarize(self, source, core, frame_count, elapsed):
+        state_manager = core.state_manager
+        media_seconds = core.clock.offset_seconds
+        return {
+            'source': str(source),
+            'settings': self.settings(),
+            'frames': frame_count,
+            'media_seconds': media_seconds,
+            'elapsed_seconds': elapsed,
+            'speedup': media_seconds / elapsed if elapsed > 0 else 0,
+            'instruments': state_manager.all_instrument_records(),
+            'alerts': [alert_to_export(alert) for alert in state_manager.all_alerts()],
+            'alert_level_counts': dict(state_manager.alert_level_counts)
+        }
+
+def _replay_worker(job):
+    """Process pool entry point: job is (source, ReplayEngine keyword arguments)"""
+    source, settings = job
+    try:
+        return ReplayEngine(**settings).replay(source)
+    except Exception as e:
+        logger.error(f"Replay of {source} failed: {str(e)}")
+        return {'source': str(source), 'settings': settings, 'error': str(e)}
+
+def replay_batch(jobs, max_workers=None):
+    """Replay many (source, settings) jobs in parallel processes, results in job order"""
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    max_workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+    if max_workers == 1:
+        return [_replay_worker(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_replay_worker, jobs))
+
+def mask_to_box(mask):
+    """Bounding box of the non-zero pixels of a label mask, or None when the instrument is absent"""
+    ys, xs = np.nonzero(mask)
+    if len(xs) == 0:
+        return None
+    return [float(xs.min()), float(ys.min()), float(xs.max() + 1), float(ys.max() + 1)]
+
+def read_yolo_labels(label_path, image_width, image_height):
+    """Boxes and class ids of a YOLO label file (class cx cy w h, normalized)"""
+    boxes, classes = [], []
+    if os.path.exists(label_path):
+        with open(label_path) as f:
+            for line in f:
+                values = line.split()
+                if len(values) < 5:
+                    continue
+                class_id, cx, cy, w, h = int(values[0]), *map(float, values[1:5])
+                boxes.append([(cx - w / 2) * image_width, (cy - h / 2) * image_height, (cx + w / 2) * image_width, (cy + h / 2) * image_height])
+                classes.append(class_id)
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4), np.array(classes, dtype=np.int16)
+
+def average_precision(scores, true_positive, ground_truth_count):
+    """All-point interpolated AP for one class: scores (N,), true_positive (N, T) over T IoU thresholds"""
+    if ground_truth_count == 0:
+        return np.full(true_positive.shape[1], np.nan)
+    if len(scores) == 0:
+        return np.zeros(true_positive.shape[1])
+    order = np.argsort(-scores, kind='stable')
+    tp = np.cumsum(true_positive[order], axis=0)
+    fp = np.cumsum(~true_positive[order], axis=0)
+    recall = tp / ground_truth_count
+    precision = tp / np.maximum(tp + fp, 1e-9)
+    # Precision envelope, then area under the recall steps
+    precision = np.maximum.accumulate(precision[::-1], axis=0)[::-1]
+    recall = np.vstack([np.zeros((1, recall.shape[1])), recall])
+    return np.sum((recall[1:] - recall[:-1]) * precision, axis=0)
+
+def match_detections(boxes, scores, classes, gt_boxes, gt_classes, iou_thresholds):
+    """Greedy per-frame matching by descending score; returns (N, T) true-positive flags in input order"""
+    true_positive = np.zeros((len(boxes), len(iou_thresholds)), dtype=bool)
+    if len(boxes) == 0 or len(gt_boxes) == 0:
+        return true_positive
+    overlap = box_iou_matrix(boxes, gt_boxes)
+    overlap[classes[:, None] != gt_classes[None, :]] = 0
+    order = np.argsort(-scores, kind='stable')
+    for t, threshold in enumerate(iou_thresholds):
+        taken = np.zeros(len(gt_boxes), dtype=bool)
+        for i in order:
+            candidates = np.where(taken, -1.0, overlap[i])
+            best = int(np.argmax(candidates))
+            if candidates[best] >= threshold:
+                taken[best] = True
+                true_positive[i, t] = True
+    return true_positive
+
+_evaluation_model = None
+_evaluation_error = None
+
+def _evaluation_worker_init(model_path, class_names, plan_entries):
+    """Process pool initializer: one model per worker process, pinned to its own block of cores"""
+    global _evaluation_model, _evaluation_error
+    ThreadPlanner.apply_entry(plan_entries.get())
+    _evaluation_model = YOLOModelManager()
+    _evaluation_model.class_names = class_names
+    try:
+        _evaluation_model.load_model_or_raise(model_path)
+    except Exception as e:
+        # Raised from the first task instead, so the parent gets the message rather than a broken pool
+        logger.error(f"Evaluation worker could not load {model_path}: {str(e)}")
+        _evaluation_error = f"Cannot load model {model_path}: {str(e)}"
+
+def _evaluation_worker_run(task):
+    """Raw candidates in original image coordinates for a chunk of (frame_index, image_path)"""
+    if _evaluation_error is not None:
+        raise RuntimeError(_evaluation_error)
+    frames, target_width = task
+    results = []
+    for frame_index, image_path in frames:
+        image = cv2.imread(str(image_path))
+        if image is None:
+            results.append((frame_index, empty_candidates(), 0.0))
+            continue
+        start_time = time.perf_counter()
+        height, width = image.shape[:2]
+        resized = cv2.resize(image, target_frame_size(width, height, target_width), interpolation=cv2.INTER_AREA)
+        candidates = _evaluation_model.detect_candidates(resized)
+        latency = time.perf_counter() - start_time
+        # target_frame_size truncates the height, so each axis scales back by its own ratio
+        scale = np.array([width / resized.shape[1], height / resized.shape[0]] * 2, dtype=np.float32)
+        candidates['boxes'] = candidates['boxes'] * scale
+        results.append((frame_index, candidates, latency))
+    return results
+
+class EvaluationHarness:
+    """Offline accuracy and speed evaluation of a model on labeled EndoVis-style frame folders"""
+    IOU_THRESHOLDS = np.round(np.arange(0.5, 0.96, 0.05), 2)
+    
+    def __init__(self, model_path, class_names, cache=None, max_workers=None, sampling_hz=2.0):
+        self.model_path = model_path
+        self.model_hash = file_content_hash(model_path)
+        self.class_names = dict(class_names)
+        self.cache = cache or DetectionCache()
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.sampling_hz = sampling_hz
+        self.ground_truth = {}
+    
+    @staticmethod
+    def find_sequences(root):
+        """Sequence folders (with left_frames/) under root, or root itself"""
+        root = Path(root)
+        if (root / "left_frames").is_dir():
+            return [root]
+        return sorted(path for path in root.iterdir() if (path / "left_frames").is_dir())
+    
+    @staticmethod
+    def list_frames(sequence_dir):
+        return ImageSequenceSource.list_images(Path(sequence_dir) / "left_frames")
+    
+    @staticmethod
+    def sequence_hash(frames):
+        """Cheap identity of a frame folder: names, sizes and modification times"""
+        digest = hashlib.blake2b(digest_size=16)
+        for path in frames:
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        return digest.hexdigest()
+    
+    def load_ground_truth(self, sequence_dir, frames):
+        """Per-frame (boxes, classes) from ground_truth/<Class>_labels masks, or from YOLO labels/ files"""
+        sequence_dir = Path(sequence_dir)
+        if sequence_dir in self.ground_truth:
+            return self.ground_truth[sequence_dir]
+        class_ids = {name: class_id for class_id, name in self.class_names.items()}
+        label_dir = sequence_dir / "labels"
+        mask_dirs = {
+            class_ids[path.name]: path for path in (sequence_dir / "ground_truth").glob("*_labels")
+            if path.name in class_ids
+        } if (sequence_dir / "ground_truth").is_dir() else {}
+        
+        def frame_ground_truth(frame_path):
+            if mask_dirs:
+                boxes, classes = [], []
+                for class_id, mask_dir in mask_dirs.items():
+                    mask = cv2.imread(str(mask_dir / frame_path.name), cv2.IMREAD_GRAYSCALE)
+                    box = mask_to_box(mask) if mask is not None else None
+                    if box is not None:
+                        boxes.append(box)
+                        classes.append(class_id)
+                return np.array(boxes, dtype=np.float32).reshape(-1, 4), np.array(classes, dtype=np.int16)
+            height, width = cv2.imread(str(frame_path)).shape[:2]
+            return read_yolo_labels(label_dir / f"{frame_path.stem}.txt", width, height)
+        
+        # Mask decoding releases the GIL, threads are enough
+        with ThreadPoolExecutor(max_workers=self.max_workers * 2) as executor:
+            ground_truth = list(executor.map(frame_ground_truth, frames))
+        self.ground_truth[sequence_dir] = ground_truth
+        return ground_truth
+    
+    def predict(self, sequence_dir, frames, target_width, progress=None):
+        """Cached raw candidates of a sequence at one width, computed in a process pool on a cache miss"""
+        model_manager = YOLOModelManager()
+        key = DetectionCache.make_key(
+            self.sequence_hash(frames), self.model_hash, target_width, model_manager.candidate_settings()
+        )
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            return cached
+        
+        writer = self.cache.create_writer(key, {
+            'video': str(sequence_dir),
+            'fps': self.sampling_hz,
+            'total_frames': len(frames),
+            'target_width': target_width,
+            'inference': model_manager.candidate_settings(),
+            'class_names': {str(class_id): name for class_id, name in self.class_names.items()}
+        })
+        try:
+            chunk_size = max(1, min(32, len(frames) // (self.max_workers * 4) or 1))
+            tasks = [
+                ([(i, frames[i]) for i in range(start, min(start + chunk_size, len(frames)))], target_width)
+                for start in range(0, len(frames), chunk_size)
+            ]
+            # Each worker takes its own plan entry; OpenCV only resizes here, inference gets the rest
+            plan_entries = multiprocessing.get_context().Queue()
+            for entry in ThreadPlanner().plan(self.max_workers):
+                plan_entries.put({**entry, 'torch_threads': len(entry['cores']), 'opencv_threads': 1})
+            candidates_by_frame, latencies = {}, []
+            start_time = time.perf_counter()
+            with ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_evaluation_worker_init,
+                initargs=(self.model_path, self.class_names, plan_entries)
+            ) as executor:
+                for done, results in enumerate(executor.map(_evaluation_worker_run, tasks), 1):
+                    for frame_index, candidates, latency in results:
+                        candidates_by_frame[frame_index] = candidates
+                        latencies.append(latency)
+                    if progress:
+                        progress(done / len(tasks))
+            elapsed = time.perf_counter() - start_time
+            
+            for frame_index in range(len(frames)):
+                writer.add_frame(frame_index, frame_index / self.sampling_hz, candidates_by_frame[frame_index])
+            writer.metadata['timing'] = {
+                'workers': self.max_workers,
+                'throughput_fps': len(frames) / elapsed if elapsed > 0 else 0.0,
+                'latency_p50_ms': float(np.percentile(latencies, 50) * 1000) if latencies else 0.0,
+                'latency_p95_ms': float(np.percentile(latencies, 95) * 1000) if latencies else 0.0
+            }
+            writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+        return self.cache.lookup(key)
+    
+    def score(self, cached, ground_truth, conf_threshold, iou_threshold):
+        """mAP, per-class recall and ID switches of the cached candidates at one operating point"""
+        iou_thresholds = self.IOU_THRESHOLDS
+        tracker = InstrumentTracker()
+        per_class_scores, per_class_tp = defaultdict(list), defaultdict(list)
+        gt_counts, gt_found = defaultdict(int), defaultdict(int)
+        last_track_of_gt, id_switches = {}, 0
+        
+        for (frame_index, _, candidates), (gt_boxes, gt_classes) in zip(cached.iter_frames(), ground_truth):
+            detections = filter_candidates(candidates, conf_threshold, iou_threshold)
+            boxes, scores, classes = detections['boxes'], detections['scores'], detections['classes']
+            true_positive = match_detections(boxes, scores, classes, gt_boxes, gt_classes, iou_thresholds)
+            for class_id in np.unique(np.concatenate([classes, gt_classes])).tolist():
+                in_class = classes == class_id
+                per_class_scores[class_id].append(scores[in_class])
+                per_class_tp[class_id].append(true_positive[in_class])
+                gt_counts[class_id] += int(np.sum(gt_classes == class_id))
+            
+            # Recall at IoU 0.5 of the operating point
+            if len(gt_boxes) and len(boxes):
+                overlap = box_iou_matrix(gt_boxes, boxes)
+                overlap[gt_classes[:, None] != classes[None, :]] = 0
+                for class_id in gt_classes[overlap.max(axis=1) >= 0.5].tolist():
+                    gt_found[class_id] += 1
+            
+            # One annotated instance per class and frame: the class is the ground-truth identity
+            track_ids = tracker.update(boxes, scores, classes)
+            tracked = track_ids >= 0
+            if len(gt_boxes) and np.any(tracked):
+                overlap = box_iou_matrix(gt_boxes, boxes[tracked])
+                overlap[gt_classes[:, None] != classes[tracked][None, :]] = 0
+                best = overlap.argmax(axis=1)
+                for gt_index, class_id in enumerate(gt_classes.tolist()):
+                    if overlap[gt_index, best[gt_index]] < 0.5:
+                        continue
+                    track_id = int(track_ids[tracked][best[gt_index]])
+                    if last_track_of_gt.get(class_id, track_id) != track_id:
+                        id_switches += 1
+                    last_track_of_gt[class_id] = track_id
+        
+        class_ap, class_recall = {}, {}
+        for class_id in gt_counts:
+            scores = np.concatenate(per_class_scores[class_id])
+            true_positive = np.concatenate(per_class_tp[class_id]).reshape(-1, len(iou_thresholds))
+            ap = average_precision(scores, true_positive, gt_counts[class_id])
+            if gt_counts[class_id]:
+                class_ap[class_id] = ap
+                class_recall[self.class_names.get(class_id, str(class_id))] = gt_found[class_id] / gt_counts[class_id]
+        ap_matrix = np.array(list(class_ap.values())) if class_ap else np.zeros((0, len(iou_thresholds)))
+        return {
+            'mAP50': float(np.mean(ap_matrix[:, 0])) if len(ap_matrix) else 0.0,
+            'mAP50_95': float(np.mean(ap_matrix)) if len(ap_matrix) else 0.0,
+            'recall': sum(gt_found.values()) / max(sum(gt_counts.values()), 1),
+            'class_recall': class_recall,
+            'id_switches': id_switches
+        }
+    
+    def sweep(self, root, target_widths, conf_thresholds, iou_thresholds, progress=None):
+        """Accuracy and speed for every width/threshold combination; inference runs once per width"""
+        rows = []
+        for sequence_dir in self.find_sequences(root):
+            frames = self.list_frames(sequence_dir)
+            ground_truth = self.load_ground_truth(sequence_dir, frames)
+            for target_width in target_widths:
+                cached = self.predict(sequence_dir, frames, target_width, progress)
+                timing = cached.metadata.get('timing', {})
+                for conf_threshold in conf_thresholds:
+                    for iou_threshold in iou_thresholds:
+                        metrics = self.score(cached, ground_truth, conf_threshold, iou_threshold)
+                        rows.append({
+                            'sequence': sequence_dir.name,
+                            'target_width': target_width,
+                            'conf_threshold': conf_threshold,
+                            'iou_threshold': iou_threshold,
+                            **metrics,
+                            **timing
+                        })
+        return rows
+    
+    @staticmethod
+    def summarize(rows):
+        """Mean over sequences per operating point, flagging the speed/accuracy Pareto front"""
+        if not rows:
+            return pd.DataFrame()
+        df = pd.DataFrame(rows).drop(columns=['class_recall', 'sequence'])
+        keys = ['target_width', 'conf_threshold', 'iou_threshold']
+        summary = df.groupby(keys, as_index=False).mean(numeric_only=True)
+        summary['id_switches'] = df.groupby(keys)['id_switches'].sum().values
+        if 'throughput_fps' in summary:
+            summary['pareto'] = [
+                not ((summary['throughput_fps'] >= row.throughput_fps) & (summary['mAP50'] >= row.mAP50)
+                     & ((summary['throughput_fps'] > row.throughput_fps) | (summary['mAP50'] > row.mAP50))).any()
+                for row in summary.itertuples()
+            ]
+        return summary.sort_values('mAP50', ascending=False)
+
+# Initialize session state
+def initialize_session_state():
+    try:
+        if 'state_manager' not in st.session_state:
+            st.session_state.state_manager = SurgiSafeStateManager()
+        if 'surgisafe_core' not in st.session_state:
+            st.session_state.surgisafe_core = SurgiSafeCore()
+        if 'is_running' not in st.session_state:
+            st.session_state.is_running = False
+        if 'video_source' not in st.session_state:
+            st.session_state.video_source = None
+        if 'cap' not in st.session_state:
+            st.session_state.cap = None
+        if 'conf_threshold' not in st.session_state:
+            st.session_state.conf_threshold = 0.05
+        if 'iou_threshold' not in st.session_state:
+            st.session_state.iou_threshold = 0.2
+        if 'target_width' not in st.session_state:
+            st.session_state.target_width = 640
+        if 'auto_export' not in st.session_state:
+            st.session_state.auto_export = False
+        if 'alert_sound' not in st.session_state:
+            st.session_state.alert_sound = True
+        if 'show_confidence' not in st.session_state:
+            st.session_state.show_confidence = True
+        if 'session_id' not in st.session_state:
+            st.session_state.session_id = uuid.uuid4().hex
+        if 'upload_manager' not in st.session_state:
+            st.session_state.upload_manager = VideoUploadManager()
+        if 'uploaded_video_key' not in st.session_state:
+            st.session_state.uploaded_video_key = None
+        if 'video_metadata' not in st.session_state:
+            st.session_state.video_metadata = None
+        if 'use_detection_cache' not in st.session_state:
+            st.session_state.use_detection_cache = True
+        if 'detection_cache' not in st.session_state:
+            st.session_state.detection_cache = DetectionCache()
+        if 'rethreshold_applied' not in st.session_state:
+            st.session_state.rethreshold_applied = None
+        if 'frame_index' not in st.session_state:
+            st.session_state.frame_index = None
+        if 'video_position' not in st.session_state:
+            st.session_state.video_position = 0
+        if 'alert_thumbnails' not in st.session_state:
+            st.session_state.alert_thumbnails = {}
+        if 'reader_backend' not in st.session_state:
+            st.session_state.reader_backend = 'opencv'
+        if 'benchmark_results' not in st.session_state:
+            st.session_state.benchmark_results = {}
+        if 'resume_video' not in st.session_state:
+            st.session_state.resume_video = None
+        if 'record_output' not in st.session_state:
+            st.session_state.record_output = False
+        if 'recording_settings' not in st.session_state:
+            st.session_state.recording_settings = {'policy': 'drop', 'segment_seconds': 600, 'segment_bytes': None}
+        if 'video_recorder' not in st.session_state:
+            st.session_state.video_recorder = None
+        if 'stereo_mode' not in st.session_state:
+            st.session_state.stereo_mode = 'off'
+        if 'right_video_source' not in st.session_state:
+            st.session_state.right_video_source = None
+        if 'right_video_key' not in st.session_state:
+            st.session_state.right_video_key = None
+        if 'stereo_calibration' not in st.session_state:
+            st.session_state.stereo_calibration = None
+        if 'superseded_upload_key' not in st.session_state:
+            st.session_state.superseded_upload_key = None
+        if 'alert_receiver' not in st.session_state:
+            st.session_state.alert_receiver = None
+        if 'clip_settings' not in st.session_state:
+            st.session_state.clip_settings = {'enabled': False, 'seconds': 10, 'max_mb': 32, 'jpeg_quality': 70}
+            
+    except Exception as e:
+        logger.error(f"Error initializing session state: {str(e)}")
+        st.error(f"Error initializing session state: {str(e)}")
+
+def get_frame_index():
+    """Frame index of the current recorded video, loaded from disk or built once"""
+    source = st.session_state.video_source
+    if source is None or source == 0 or ImageSequenceSource.is_sequence(source):
+        return None
+    index = st.session_state.frame_index
+    if index is None or index.video_path != str(source):
+        metadata = st.session_state.video_metadata
+        if not metadata or metadata['path'] != source:
+            metadata = None
+        index = FrameIndex.load_or_build(source, metadata)
+        st.session_state.frame_index = index
+    return index
+
+def create_performance_dashboard():
+    """Create enhanced performance dashboard"""
+    st.subheader("📊 Performance Dashboard")
+    
+    # Create tabs for different views
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📈 Real-time Stats", "🔍 Instrument Analysis", "⚠️ Alert History", "📋 Export Data", "🗺️ Spatial"])
+    
+    with tab1:
+        # Real-time metrics
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            active_instruments = st.session_state.state_manager.detected_instruments.count('active')
+            st.markdown(f"""
+            <div class="stat-card">
+                <h3>🔧 Active Instruments</h3>
+                <h2 style="color: #667eea;">{active_instruments}</h2>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col2:
+            fps = np.mean(list(st.session_state.state_manager.fps_counter)) if st.session_state.state_manager.fps_counter else 0
+            st.markdown(f"""
+            <div class="stat-card">
+                <h3>⚡ FPS</h3>
+                <h2 style="color: #667eea;">{fps:.1f}</h2>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col3:
+            total_alerts = st.session_state.state_manager.total_alerts()
+            st.markdown(f"""
+            <div class="stat-card">
+                <h3>🚨 Total Alerts</h3>
+                <h2 style="color: #667eea;">{total_alerts}</h2>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col4:
+            session_duration = datetime.now() - st.session_state.state_manager.session_start_time
+            session_minutes = int(session_duration.total_seconds() / 60)
+            st.markdown(f"""
+            <div class="stat-card">
+                <h3>⏱️ Session Duration</h3>
+                <h2 style="color: #667eea;">{session_minutes}min</h2>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        # Tracker overhead relative to inference
+        model_performance = st.session_state.surgisafe_core.model_manager.model_performance
+        if model_performance['inference_times'] and model_performance['tracker_times']:
+            tracker_ms = np.mean(model_performance['tracker_times']) * 1000
+            inference_ms = np.mean(model_performance['inference_times']) * 1000
+            st.caption(f"Tracker: {tracker_ms:.2f} ms/frame ({tracker_ms / max(inference_ms, 1e-6) * 100:.1f}% of inference at {inference_ms:.1f} ms)")
+        cascade = st.session_state.surgisafe_core.model_manager.cascade_summary()
+        if cascade:
+            reasons = ", ".join(f"{reason.replace('_', ' ')}: {count}" for reason, count in cascade['reasons'].items())
+            cost_saved = f"{cascade['cost_saved'] * 100:.0f}%" if cascade['cost_saved'] is not None else "n/a"
+            st.caption(
+                f"Cascade: main model alone on {cascade['light_hit_rate'] * 100:.0f}% of {cascade['frames']} frames, "
+                f"heavy model compute saved {cost_saved} ({reasons})"
+            )
+        roi = st.session_state.surgisafe_core.roi
+        if roi.mode != 'off' and roi.pixel_ratios:
+            st.caption(f"Inference region: {np.mean(roi.pixel_ratios) * 100:.0f}% of frame pixels ({SurgicalFieldROI.MODES[roi.mode]})")
+        
+        # Performance chart
+        if st.session_state.state_manager.performance_metrics['timestamps']:
+            fig = go.Figure()
+            fig.add_trace(go.Scatter(
+                x=st.session_state.state_manager.performance_metrics['timestamps'],
+                y=st.session_state.state_manager.performance_metrics['detections'],
+                mode='lines+markers',
+                name='Detections per Frame',
+                line=dict(color='#667eea')
+            ))
+            fig.update_layout(
+                title="Detection Performance Over Time",
+                xaxis_title="Time",
+                yaxis_title="Number of Detections",
+                height=400
+            )
+            st.plotly_chart(fig, use_container_width=True)
+    
+    with tab2:
+        # Instrument analysis
+        if st.session_state.state_manager.detected_instruments:
+            instruments_data = []
+            for instrument in st.session_state.state_manager.detected_instruments.values():
+                instruments_data.append({
+                    'Name': instrument.name.replace('_labels', ''),
+                    'Track ID': instrument.track_id,
+                    'Duration (min)': f"{instrument.get_duration_minutes():.1f}",
+                    'Status': instrument.status,
+                    'Risk Level': instrument.risk_level,
+                    'Confidence': f"{instrument.get_average_confidence():.2f}",
+                    'Detections': instrument.detection_count,
+                    'Movement': f"{instrument.get_movement_distance():.0f}px"
+                })
+            
+            df = pd.DataFrame(instruments_data)
+            st.dataframe(df, use_container_width=True)
+            
+            # Risk level distribution, from the store's risk index
+            risk_colors = {
+                'normal': '#48bb78',
+                'warning': '#ecc94b',
+                'danger': '#ed8936',
+                'critical': '#f56565'
+            }
+            instruments = st.session_state.state_manager.detected_instruments
+            risk_counts = {level: instruments.count_risk(level) for level in risk_colors if instruments.count_risk(level)}
+            fig_pie = px.pie(
+                values=list(risk_counts.values()), 
+                names=list(risk_counts),
+                title="Risk Level Distribution",
+                color_discrete_map=risk_colors
+            )
+            st.plotly_chart(fig_pie, use_container_width=True)
+        else:
+            st.info("No instruments detected yet.")
+    
+    with tab3:
+        # Alert history
+        if st.session_state.state_manager.alert_history:
+            st.subheader("Recent Alerts")
+            
+            # Show recent alerts with confirmation for critical lost instruments
+            recent_alerts = list(st.session_state.state_manager.alerts_queue)[-10:]
+            for alert in reversed(recent_alerts):
+                alert_class = f"alert-{alert['level']}"
+                timestamp_str = alert['timestamp'].strftime("%H:%M:%S")
+                if alert['level'] == 'critical' and alert.get('instrument') in st.session_state.state_manager.pending_confirmations:
+                    instrument = st.session_state.state_manager.pending_confirmations[alert['instrument']]
+                    evidence = st.session_state.state_manager.loss_evidence.get(alert['instrument'])
+                    if evidence and os.path.exists(evidence['thumbnail']):
+                        st.image(evidence['thumbnail'], caption="Last frames before the instrument disappeared", width=320)
+                    if st.button(f"✅ Confirm Loss for {instrument.name} (ID:{instrument.track_id})", key=f"confirm_{alert['instrument_id']}"):
+                        instrument.status = 'lost'
+                        del st.session_state.state_manager.pending_confirmations[alert['instrument']]
+                        st.session_state.surgisafe_core.alert_manager.clear_alerts_for_instrument(alert['instrument'])
+                        st.success(f"Confirmed loss for {instrument.name} (ID:{instrument.track_id})")
+                st.markdown(f"""
+                <div class="{alert_class}">
+                    <strong>{timestamp_str}</strong> - {alert['message']}
+                </div>
+                """, unsafe_allow_html=True)
+                
+                # Pre-alert clip recorded from the annotated stream
+                if alert.get('clip') and os.path.exists(alert['clip']):
+                    if os.path.exists(alert['thumbnail']):
+                        st.image(alert['thumbnail'], width=320)
+                    with open(alert['clip'], 'rb') as clip_file:
+                        st.download_button("🎞️ Pre-alert clip", clip_file.read(), file_name=Path(alert['clip']).name,
+                                           mime="video/mp4", key=f"clip_{alert['instrument_id']}_{alert['level']}")
+                
+                # Thumbnail of the frame that raised the alert, decoded on demand through the frame index
+                frame_index = get_frame_index() if 'frame_index' in alert else None
+                if frame_index is not None:
+                    thumbnail_key = (frame_index.video_path, alert['frame_index'])
+                    if st.button("🖼️ Show frame", key=f"thumb_{alert['instrument_id']}_{alert['level']}"):
+                        frame = frame_index.read_frame(alert['frame_index'])
+                        if frame is not None:
+                            st.session_state.alert_thumbnails[thumbnail_key] = cv2.cvtColor(
+                                cv2.resize(frame, (320, int(frame.shape[0] * 320 / frame.shape[1]))), cv2.COLOR_BGR2RGB
+                            )
+                    if thumbnail_key in st.session_state.alert_thumbnails:
+                        st.image(st.session_state.alert_thumbnails[thumbnail_key],
+                                 caption=f"Frame {alert['frame_index']} ({frame_index.timestamps[alert['frame_index']] / 60:.1f} min)")
+            
+            # Alert statistics, including alerts already spilled to disk
+            if st.session_state.state_manager.total_alerts() > 0:
+                alert_counts = pd.Series(st.session_state.state_manager.alert_level_counts).sort_values(ascending=False)
+                
+                fig_bar = px.bar(
+                    x=alert_counts.index,
+                    y=alert_counts.values,
+                    title="Alert Type Distribution",
+                    color=alert_counts.index,
+                    color_discrete_map={
+                        'warning': '#ecc94b',
+                        'danger': '#ed8936',
+                        'critical': '#f56565',
+                        'extended': '#805ad5'
+                    }
+                )
+                st.plotly_chart(fig_bar, use_container_width=True)
+        else:
+            st.info("No alerts generated yet.")
+    
+    with tab4:
+        # Export data
+        st.subheader("📤 Export Data")
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if st.button("📊 Export Instrument Data"):
+                export_data = st.session_state.state_manager.all_instrument_records()
+                if export_data:
+                    df_export = pd.DataFrame(export_data)
+                    csv = df_export.to_csv(index=False)
+                    
+                    st.download_button(
+                        label="⬇️ Download Instrument Data (CSV)",
+                        data=csv,
+                        file_name=f"instrument_data_{int(datetime.now().timestamp())}.csv",
+                        mime="text/csv"
+                    )
+                else:
+                    st.warning("No instrument data to export.")
+        
+        with col2:
+            if st.button("📋 Export Alert History"):
+                alert_export = [alert_to_export(alert) for alert in st.session_state.state_manager.all_alerts()]
+                if alert_export:
+                    df_alerts = pd.DataFrame(alert_export)
+                    csv_alerts = df_alerts.to_csv(index=False)
+                    
+                    st.download_button(
+                        label="⬇️ Download Alert History (CSV)",
+                        data=csv_alerts,
+                        file_name=f"alert_history_{int(datetime.now().timestamp())}.csv",
+                        mime="text/csv"
+                    )
+                else:
+                    st.warning("No alert history to export.")
+        
+        # Detection history export
+        if st.button("📈 Export Detection History"):
+            if st.session_state.state_manager.detection_history:
+                detection_export = []
+                for detection in st.session_state.state_manager.detection_history:
+                    detection_export.append({
+                        'timestamp': detection['timestamp'],
+                        'frame_number': detection['frame_number'],
+                        'detections_count': detection['detections'],
+                        'processing_time': detection['processing_time']
+                    })
+                
+                df_detections = pd.DataFrame(detection_export)
+                csv_detections = df_detections.to_csv(index=False)
+                
+                st.download_button(
+                    label="⬇️ Download Detection History (CSV)",
+                    data=csv_detections,
+                    file_name=f"detection_history_{int(datetime.now().timestamp())}.csv",
+                    mime="text/csv"
+                )
+            else:
+                st.warning("No detection history to export.")
+        
+        # Per-frame tracks for headless replay with other alert settings
+        if st.button("🧾 Export Track Log"):
+            if st.session_state.state_manager.processed_frames:
+                st.download_button(
+                    label="⬇️ Download Track Log (JSONL)",
+                    data="".join(track_log_lines(
+                        st.session_state.state_manager.all_track_records(),
+                        st.session_state.state_manager.session_start_time
+                    )),
+                    file_name=f"track_log_{int(datetime.now().timestamp())}.jsonl",
+                    mime="application/json"
+                )
+            else:
+                st.warning("No detection history to export.")
+        
+        # Frames that raised the alerts, decoded in parallel through the frame index
+        frame_index = get_frame_index()
+        if st.button("🖼️ Export Alert Frames", disabled=frame_index is None):
+            alerts = [alert for alert in st.session_state.state_manager.all_alerts() if alert.get('frame_index') is not None]
+            if alerts:
+                frames = frame_index.read_frames([alert['frame_index'] for alert in alerts])
+                archive = io.BytesIO()
+                with zipfile.ZipFile(archive, 'w') as zf:
+                    for alert in alerts:
+                        frame = frames.get(alert['frame_index'])
+                        if frame is None:
+                            continue
+                        ok, encoded = cv2.imencode('.jpg', frame)
+                        if ok:
+                            zf.writestr(f"{alert['frame_index']:06d}_{alert['level']}_{alert['instrument_id']}.jpg", encoded.tobytes())
+                st.download_button(
+                    label="⬇️ Download Alert Frames (ZIP)",
+                    data=archive.getvalue(),
+                    file_name=f"alert_frames_{int(datetime.now().timestamp())}.zip",
+                    mime="application/zip"
+                )
+            else:
+                st.warning("No alerts with a frame position to export.")
+        
+        if st.button("🗺️ Export Heatmaps"):
+            state_manager = st.session_state.state_manager
+            st.download_button(
+                label="⬇️ Download Occupancy & Dwell Grids (NPZ)",
+                data=state_manager.occupancy.to_npz_bytes(state_manager.spill_store),
+                file_name=f"occupancy_grids_{int(datetime.now().timestamp())}.npz",
+                mime="application/octet-stream"
+            )
+    
+    with tab5:
+        # Where instruments were, and where they stayed, over the whole session
+        state_manager = st.session_state.state_manager
+        occupancy = state_manager.occupancy
+        if occupancy.session_occupancy.any():
+            grid_kind = st.radio("Grid", ["Dwell time (s)", "Occupancy (frames)"], horizontal=True)
+            grids = {'Whole session': (occupancy.session_occupancy, occupancy.session_dwell)}
+            for instrument_id, instrument_occupancy, dwell in occupancy.instrument_grids(state_manager.spill_store):
+                grids[instrument_id] = (instrument_occupancy, dwell)
+            selected = st.selectbox("Heatmap of", list(grids))
+            grid = grids[selected][0 if grid_kind.startswith("Occupancy") else 1]
+            fig_heatmap = px.imshow(grid, color_continuous_scale="Inferno", aspect="auto", title=f"{selected}: {grid_kind}")
+            fig_heatmap.update_xaxes(showticklabels=False)
+            fig_heatmap.update_yaxes(showticklabels=False)
+            st.plotly_chart(fig_heatmap, use_container_width=True)
+            st.caption(f"{occupancy.shape[1]}x{occupancy.shape[0]} grid over the processed frame")
+        else:
+            st.info("No instrument positions recorded yet.")
+
+def display_active_instruments():
+    """Display active instruments in an enhanced format"""
+    st.subheader("🔧 Active Instruments")
+    
+    active_instruments = st.session_state.state_manager.detected_instruments.with_status('active')
+    
+    if not active_instruments:
+        st.info("No active instruments detected.")
+        return
+    
+    for instrument in active_instruments:
+        duration = instrument.get_duration_minutes()
+        confidence = instrument.get_average_confidence()
+        
+        # Status indicator
+        status_class = f"status-{instrument.risk_level}"
+        
+        col1, col2 = st.columns([3, 1])
+        
+        with col1:
+            st.markdown(f"""
+            <div class="instrument-card">
+                <h4>
+                    <span class="status-indicator {status_class}"></span>
+                    {instrument.name.replace('_labels', '')} (Track ID: {instrument.track_id})
+                </h4>
+                <p><strong>Duration:</strong> {duration:.1f} minutes</p>
+                <p><strong>Confidence:</strong> {confidence:.2f}</p>
+                <p><strong>Risk Level:</strong> {instrument.risk_level.upper()}</p>
+                <p><strong>Detections:</strong> {instrument.detection_count}</p>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col2:
+            # Mini chart for confidence over time
+            if len(instrument.confidence_history) > 1:
+                fig_mini = go.Figure()
+                fig_mini.add_trace(go.Scatter(
+                    y=list(instrument.confidence_history),
+                    mode='lines',
+                    name='Confidence',
+                    line=dict(color='#667eea', width=2)
+                ))
+                fig_mini.update_layout(
+                    height=100,
+                    margin=dict(l=0, r=0, t=0, b=0),
+                    showlegend=False,
+                    xaxis=dict(showgrid=False, showticklabels=False),
+                    yaxis=dict(showgrid=False, range=[0, 1])
+                )
+                st.plotly_chart(fig_mini, use_container_width=True)
+
+def generate_comprehensive_report():
+    """Generate a comprehensive report with all tracking data"""
+    occupancy = st.session_state.state_manager.occupancy
+    report_data = {
+        'session_info': {
+            'start_time': st.session_state.state_manager.session_start_time.isoformat(),
+            'end_time': datetime.now().isoformat(),
+            'duration_minutes': (datetime.now() - st.session_state.state_manager.session_start_time).total_seconds() / 60,
+            'total_frames': st.session_state.state_manager.processed_frames,
+            'model_info': st.session_state.state_manager.model_info
+        },
+        'instruments': st.session_state.state_manager.all_instrument_records(),
+        'alerts': [alert_to_export(alert) for alert in st.session_state.state_manager.all_alerts()],
+        'statistics': dict(st.session_state.state_manager.tracking_stats),
+        'spatial': {
+            'grid_shape': list(occupancy.shape),
+            'dwell_hotspots': occupancy.hotspots(occupancy.session_dwell),
+            'instrument_dwell_hotspots': {
+                instrument_id: occupancy.hotspots(dwell, 3)
+                for instrument_id, _, dwell in occupancy.instrument_grids(st.session_state.state_manager.spill_store)
+            }
+        }
+    }
+    
+    return json.dumps(report_data, indent=2)
+
+def build_detection_cache_key():
+    """Cache key for the current video, model, processing width and inference settings"""
+    core = st.session_state.surgisafe_core
+    model_manager = core.model_manager
+    metadata = st.session_state.video_metadata
+    if metadata and metadata['path'] == st.session_state.video_source and 'content_hash' in metadata:
+        video_hash = metadata['content_hash']
+    else:
+        video_hash = file_content_hash(st.session_state.video_source)
+    return DetectionCache.make_key(
+        video_hash,
+        model_manager.model_info.get('file_hash'),
+        st.session_state.get('target_width', 640),
+        core.candidate_settings(st.session_state.conf_threshold, st.session_state.iou_threshold)
+    )
+
+def replay_cached_detections(cached, video_placeholder):
+    """Feed cached candidates through SurgiSafeCore in media time at the current thresholds, without running the model"""
+    core = st.session_state.surgisafe_core
+    core.clock = SimulatedClock(st.session_state.state_manager.session_start_time)
+    # Spatial analytics need the analysed frame size, which must not depend on what ran before
+    core.frame_size = cached.metadata.get('frame_size')
+    metadata = st.session_state.video_metadata
+    if core.frame_size is None and metadata and metadata['path'] == st.session_state.video_source:
+        core.frame_size = target_frame_size(metadata['width'], metadata['height'], cached.metadata['target_width'])
+    if core.frame_size is not None:
+        core.frame_size = tuple(core.frame_size)
+    
+    video_placeholder.info(f"⚡ Replaying {len(cached)} cached frames - inference skipped")
+    start_time = time.time()
+    ReplayEngine.feed(core, cached.iter_frames(), st.session_state.conf_threshold, st.session_state.iou_threshold)
+    
+    logger.info(f"Replayed {len(cached)} cached frames in {time.time() - start_time:.2f}s")
+    video_placeholder.success(f"⚡ Replayed {len(cached)} cached frames in {time.time() - start_time:.1f}s")
+
+def rethreshold_recorded_session(status_placeholder):
+    """Rebuild the session from cached candidates at the current slider thresholds"""
+    if not st.session_state.state_manager.model_info:
+        return False
+    cached = st.session_state.detection_cache.lookup(build_detection_cache_key())
+    if cached is None:
+        return False
+    
+    previous_state = st.session_state.state_manager
+    st.session_state.surgisafe_core.detach_checkpointer(previous_state, st.session_state.video_position)
+    st.session_state.state_manager = SurgiSafeStateManager()
+    st.session_state.state_manager.session_start_time = previous_state.session_start_time
+    st.session_state.state_manager.model_info = previous_state.model_info
+    st.session_state.surgisafe_core.alert_manager.sent_alerts.clear()
+    
+    replay_cached_detections(cached, status_placeholder)
+    return True
+
+def get_video_recorder(fps):
+    """Recorder of the annotated stream for this session, while recording is enabled"""
+    if not st.session_state.record_output:
+        close_video_recorder()
+        return None
+    if st.session_state.video_recorder is None:
+        st.session_state.video_recorder = AnnotatedVideoRecorder(
+            RECORDINGS_DIR / st.session_state.state_manager.session_id, fps,
+            **st.session_state.recording_settings
+        )
+    return st.session_state.video_recorder
+
+def close_video_recorder():
+    """Flush and close the current recording, if any"""
+    recorder = st.session_state.get('video_recorder')
+    if recorder is not None:
+        recorder.close()
+        logger.info(f"Recording closed: {recorder.stats()}")
+        st.session_state.video_recorder = None
+
+def resume_checkpointed_session(session_id):
+    """Restore a checkpointed session, and its video and position when the recording is still available"""
+    state = SessionCheckpointer.load(session_id)
+    core = st.session_state.surgisafe_core
+    core.detach_checkpointer(st.session_state.state_manager, st.session_state.video_position)
+    
+    video = state['video']
+    metadata = st.session_state.video_metadata
+    position = state['position']
+    if video.get('camera'):
+        st.session_state.video_source = 0
+        position = 0
+    elif video.get('path') and os.path.exists(video['path']):
+        st.session_state.video_source = video['path']
+        st.session_state.video_metadata = VideoUploadManager.probe(video['path'])
+        if video.get('content_hash'):
+            st.session_state.video_metadata['content_hash'] = video['content_hash']
+        st.session_state.uploaded_video_key = tuple(video['upload_key']) if video.get('upload_key') else None
+    elif not (metadata and video.get('content_hash') and metadata.get('content_hash') == video['content_hash']):
+        # The recording is gone and the loaded video is a different one: resume once it is uploaded again
+        st.session_state.resume_video = (video.get('content_hash'), position)
+        position = 0
+    
+    start_time = datetime.fromisoformat(state['session_start_time'])
+    core.clock = datetime.now if video.get('camera') else SimulatedClock(start_time)
+    st.session_state.state_manager = SurgiSafeStateManager.from_checkpoint(state, core.clock, core.risk_thresholds)
+    st.session_state.state_manager.model_info = core.model_manager.model_info
+    core.restore_checkpoint(state)
+    st.session_state.video_position = position
+    st.session_state.frame_index = None
+    return position
+
+def process_video(video_placeholder):
+    """Enhanced video processing with better error handling and performance monitoring"""
+    cache_writer = None
+    display_buffer = None
+    replica_frames = None
+    try:
+        is_camera = st.session_state.video_source == 0
+        core = st.session_state.surgisafe_core
+        
+        # Get video properties, reusing the metadata probed at upload time
+        metadata = st.session_state.video_metadata
+        if is_camera:
+            total_frames, fps = -1, 30
+        elif metadata and metadata['path'] == st.session_state.video_source:
+            total_frames, fps = metadata['total_frames'], metadata['fps']
+        else:
+            metadata = VideoUploadManager.probe(st.session_state.video_source)
+            total_frames, fps = metadata['total_frames'], metadata['fps']
+        if is_camera:
+            st.session_state.state_manager.latency_samples.clear()
+        
+        logger.info(f"Video properties - Total frames: {total_frames}, FPS: {fps}")
+        recorder = get_video_recorder(fps)
+        
+        # Stereo pairs are tracked as one instrument set; the detection cache is per single video
+        stereo_mode = st.session_state.stereo_mode if not is_camera and st.session_state.right_video_source else 'off'
+        if stereo_mode != 'off':
+            calibration = st.session_state.stereo_calibration
+            core.stereo.fundamental = StereoMatcher.fundamental_from_calibration(
+                calibration, st.session_state.get('target_width', 640) / metadata['width']
+            ) if calibration else None
+        
+        # Recorded videos resume where the previous run stopped, or where the user seeked to
+        frame_index = None if is_camera else get_frame_index()
+        start_frame = 0 if is_camera else st.session_state.video_position
+        
+        # Recorded videos run in media time so cached replays reproduce the same timers
+        if is_camera:
+            core.clock = datetime.now
+        else:
+            # Keep the clock the existing instruments were created with when resuming a run
+            if not (isinstance(core.clock, SimulatedClock) and core.clock.start == st.session_state.state_manager.session_start_time):
+                core.clock = SimulatedClock(st.session_state.state_manager.session_start_time)
+            video_clock = core.clock
+        
+        # Journal the session so it survives a crash or restart
+        checkpointer = core.attach_checkpointer(st.session_state.state_manager)
+        if is_camera:
+            checkpointer.video = {'camera': True}
+        else:
+            checkpointer.video = {
+                'path': st.session_state.video_source,
+                'content_hash': metadata.get('content_hash'),
+                'upload_key': st.session_state.uploaded_video_key
+            }
+        
+        if not is_camera and stereo_mode == 'off' and st.session_state.use_detection_cache and start_frame == 0:
+            cache_key = build_detection_cache_key()
+            cached = st.session_state.detection_cache.lookup(cache_key)
+            if cached is not None:
+                replay_cached_detections(cached, video_placeholder)
+                st.session_state.is_running = False
+                st.session_state.video_position = 0
+                return
+        
+        # Only passes starting at the first frame are complete enough to be cached
+        if not is_camera and stereo_mode == 'off' and st.session_state.use_detection_cache and start_frame == 0:
+            cache_writer = st.session_state.detection_cache.create_writer(cache_key, {
+                'video': st.session_state.video_source,
+                'fps': fps,
+                'total_frames': total_frames,
+                'target_width': st.session_state.get('target_width', 640),
+                'frame_size': target_frame_size(metadata['width'], metadata['height'], st.session_state.get('target_width', 640)),
+                'inference': core.candidate_settings(st.session_state.conf_threshold, st.session_state.iou_threshold),
+                'class_names': {str(class_id): name for class_id, name in core.model_manager.class_names.items()}
+            })
+        
+        if st.session_state.cap is None:
+            if stereo_mode != 'off':
+                st.session_state.cap = open_stereo_source(
+                    st.session_state.reader_backend, st.session_state.video_source, st.session_state.right_video_source,
+                    st.session_state.get('target_width', 640), start_frame, metadata
+                )
+            else:
+                st.session_state.cap = open_frame_source(
+                    st.session_state.reader_backend, st.session_state.video_source,
+                    st.session_state.get('target_width', 640), start_frame, frame_index,
+                    None if is_camera else metadata
+                )
+            if st.session_state.cap is None:
+                logger.error(f"Failed to open video source: {st.session_state.video_source}")
+                st.error(f"Failed to open video source: {st.session_state.video_source}")
+                st.session_state.is_running = False
+                return
+            
+            logger.info(f"Video loaded: {st.session_state.video_source} ({st.session_state.reader_backend} reader)")
+            
+            # One inference stream in this process: size its thread pools and pin any decoder subprocess
+            planner = core.model_manager.thread_planner
+            planner.pin_decoders(st.session_state.cap, planner.apply(streams=1))
+            
+            if start_frame > 0:
+                logger.info(f"Resuming at frame {start_frame}")
+            else:
+                core.reset_tracking()
+        
+        # Processing loop
+        frame_skip = 1  # Process every frame by default
+        frame_count = start_frame
+        
+        # With model replicas, frames are read ahead and their candidates arrive in frame order
+        if stereo_mode == 'off' and core.model_manager.replicas_active():
+            replica_frames = core.model_manager.replica_candidates(st.session_state.cap, core.roi.next_region)
+        
+        while st.session_state.is_running:
+            candidates = None
+            if replica_frames is not None:
+                item = next(replica_frames, None)
+                if item is not None:
+                    item, candidates = item[:2], item[2]
+            else:
+                item = st.session_state.cap.read()
+            if item is None:
+                logger.info(f"End of video or read error at frame {frame_count}")
+                st.session_state.is_running = False
+                st.session_state.video_position = 0
+                if cache_writer and frame_count > 0:
+                    cache_writer.commit()
+                    cache_writer = None
+                close_video_recorder()
+                break
+            
+            # Frames arrive already resized to target_width, in buffers reused by the reader
+            position, frame = item
+            frame_count = position + 1
+            if not is_camera:
+                st.session_state.video_position = frame_count
+            
+            # Skip frames if needed for performance; the live reader already drops stale frames,
+            # and a pass being cached must see every frame or replays would reuse a sparse track set
+            if not is_camera and replica_frames is None and cache_writer is None and frame_count % frame_skip != 0:
+                continue
+            
+            if frame_index is not None and frame_count - 1 < len(frame_index):
+                frame_timestamp = float(frame_index.timestamps[frame_count - 1])
+            else:
+                frame_timestamp = (frame_count - 1) / fps if fps > 0 else 0.0
+            if not is_camera:
+                video_clock.set_offset(frame_timestamp)
+            core.current_frame_index = frame_count - 1
+            
+            # Process frame
+            if stereo_mode != 'off':
+                annotated_frame = core.process_stereo_frame(
+                    frame[0], frame[1], st.session_state.conf_threshold, st.session_state.iou_threshold,
+                    detect_right=stereo_mode == 'batch'
+                )
+            else:
+                annotated_frame = core.process_frame(
+                    frame, st.session_state.conf_threshold, st.session_state.iou_threshold, candidates=candidates
+                )
+            if replica_frames is not None and st.session_state.state_manager.fps_counter:
+                # Tracking alone is not the frame rate: report the throughput of the replica pipeline
+                st.session_state.state_manager.fps_counter[-1] = core.model_manager.replica_pool.stats()['throughput_fps']
+            if cache_writer:
+                cache_writer.add_frame(frame_count - 1, frame_timestamp, core.last_candidates)
+            if recorder is not None:
+                recorder.write(annotated_frame, frame_timestamp)
+            
+            # Convert to RGB for display into a reused buffer
+            if display_buffer is None or display_buffer.shape != annotated_frame.shape:
+                display_buffer = np.empty_like(annotated_frame)
+            annotated_frame_rgb = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB, dst=display_buffer)
+            st.session_state.state_manager.last_frame = annotated_frame_rgb
+            
+            # Update display
+            video_placeholder.image(annotated_frame_rgb, channels="RGB", use_container_width=True)
+            
+            if is_camera:
+                st.session_state.state_manager.latency_samples.append(st.session_state.cap.latency_ms())
+                st.session_state.state_manager.frames_superseded = st.session_state.cap.frames_superseded
+                # The capture thread paces live frames, so no extra delay is needed
+                continue
+            if replica_frames is not None:
+                # The replicas pace the pipeline; a fixed delay would cap it
+                continue
+            
+            # Adaptive frame rate control
+            current_fps = np.mean(list(st.session_state.state_manager.fps_counter)) if st.session_state.state_manager.fps_counter else 0
+            if current_fps < 10:  # If FPS is too low, start skipping frames
+                frame_skip = min(frame_skip + 1, 3)
+            elif current_fps > 20:  # If FPS is good, reduce frame skipping
+                frame_skip = max(frame_skip - 1, 1)
+            
+            # Small delay to prevent overwhelming the system
+            time.sleep(0.03)  # ~30 FPS max
+    
+    except Exception as e:
+        logger.error(f"Video processing error: {str(e)}")
+        st.error(f"Video processing error: {str(e)}")
+        st.session_state.is_running = False
+    
+    finally:
+        # Only complete passes are cached
+        if cache_writer:
+            cache_writer.abort()
+        if replica_frames is not None:
+            replica_frames.close()
+        if st.session_state.cap:
+            st.session_state.cap.release()
+            st.session_state.cap = None
+
+def main():
+    initialize_session_state()
+    
+    # Enhanced Header
+    st.markdown("""
+    <div class="main-header">
+        <h1>🏥 SurgiSafe Pro</h1>
+        <p>Advanced Intelligent Surgical Instrument Tracking & Safety System</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Main layout
+    main_col1, main_col2 = st.columns([3, 1])
+    
+    with main_col1:
+        # Video Display Section
+        st.subheader("📺 Live Analysis")
+        video_container = st.container()
+        with video_container:
+            st.markdown('<div class="video-container">', unsafe_allow_html=True)
+            video_placeholder = st.empty()
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Progress bar for video processing
+        progress_placeholder = st.empty()
+        
+        # Video processing
+        if st.session_state.is_running and st.session_state.video_source is not None:
+            process_video(video_placeholder)
+            
+            # Update progress for video files
+            metadata = st.session_state.video_metadata
+            if st.session_state.video_source != 0 and metadata:
+                total_frames = metadata['total_frames']
+                if total_frames > 0:
+                    position = st.session_state.video_position
+                    progress = min(position / total_frames, 1.0)
+                    progress_placeholder.progress(
+                        progress, 
+                        f"Progress: {position}/{total_frames} frames ({progress*100:.1f}%)"
+                    )
+        else:
+            video_placeholder.info("🎬 Ready to analyze. Load a model, select video source, and start analysis.")
+    
+    with main_col2:
+        # Real-time Statistics Panel
+        st.subheader("📊 Live Statistics")
+        
+        # System Status
+        status_color = {
+            'idle': '🟡',
+            'running': '🟢',
+            'stopped': '🔴',
+            'error': '🔴'
+        }
+        status = st.session_state.state_manager.system_status
+        st.markdown(f"**Status:** {status_color.get(status, '⚪')} {status.upper()}")
+        
+        # Key Metrics
+        active_instruments = st.session_state.state_manager.detected_instruments.count('active')
+        fps = np.mean(list(st.session_state.state_manager.fps_counter)) if st.session_state.state_manager.fps_counter else 0
+        total_alerts = st.session_state.state_manager.total_alerts()
+        
+        st.metric("Active Instruments", active_instruments)
+        st.metric("FPS", f"{fps:.1f}")
+        st.metric("Total Alerts", total_alerts)
+        
+        latency_samples = st.session_state.state_manager.latency_samples
+        if latency_samples:
+            st.caption(
+                f"⏱️ Glass-to-annotation: {np.mean(latency_samples):.0f} ms "
+                f"(p95 {np.percentile(latency_samples, 95):.0f}) | "
+                f"superseded {st.session_state.state_manager.frames_superseded} stale frame(s)"
+            )
+        
+        replica_pool = st.session_state.surgisafe_core.model_manager.replica_pool
+        if replica_pool is not None:
+            replica_stats = replica_pool.stats()
+            st.caption(
+                f"🧬 {replica_stats['replicas']} model replicas: {replica_stats['throughput_fps']:.1f} FPS | "
+                f"{replica_stats['reorder_waits']} out-of-order result(s) reassembled"
+            )
+        
+        recorder = st.session_state.video_recorder
+        if recorder is not None:
+            recording = recorder.stats()
+            st.caption(
+                f"🎥 Recording: {recording['frames_written']} frames in {recording['segments']} segment(s) | "
+                f"dropped {recording['frames_dropped']} | encoder lag {recording['encoder_lag_ms']:.0f} ms "
+                f"(max {recording['max_encoder_lag_ms']:.0f})"
+            )
+        
+        # Recent Alerts
+        st.subheader("🚨 Recent Alerts")
+        recent_alerts = list(st.session_state.state_manager.alerts_queue)[-5:]
+        if recent_alerts:
+            for alert in reversed(recent_alerts):
+                alert_emoji = {'warning': '⚠️', 'danger': '🔶', 'critical': '🚨', 'extended': '💀'}
+                st.write(f"{alert_emoji.get(alert['level'], '📢')} {alert['message']}")
+        else:
+            st.info("No alerts yet")
+        
+        # Active Instruments Summary
+        display_active_instruments()
+    
+    # Enhanced Sidebar Configuration
+    with st.sidebar:
+        st.header("⚙️ System Configuration")
+        
+        # Model Configuration Section
+        st.subheader("🤖 AI Model")
+        model_path = st.text_input(
+            "Model Path", 
+            value="C:/Users/Hp/runs/train/exp_endovis_i5/weights/best.pt",
+            help="Path to your trained YOLO model file (.pt)"
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("🔄 Load Model", type="primary"):
+                with st.spinner("Loading AI model..."):
+                    result = st.session_state.surgisafe_core.model_manager.load_model(model_path)
+                    if result:
+                        st.session_state.state_manager.model_info = st.session_state.surgisafe_core.model_manager.model_info
+                        st.success(f"✅ Model loaded successfully!")
+                        st.info(f"Classes: {st.session_state.state_manager.model_info['num_classes']}")
+                        st.info(f"Device: {st.session_state.state_manager.model_info['device']}")
+                    else:
+                        st.error("❌ Failed to load model")
+        
+        with col2:
+            if st.session_state.state_manager.model_info:
+                st.success("✅ Ready")
+            else:
+                st.error("❌ No Model")
+        
+        # Second-tier model for uncertain frames
+        with st.expander("🪜 Model Cascade"):
+            model_manager = st.session_state.surgisafe_core.model_manager
+            heavy_model_path = st.text_input(
+                "Heavy Model Path", value=model_manager.heavy_model_info.get('path', ''),
+                help="Larger, more accurate model run only when the main model is unsure"
+            )
+            if st.button("🔄 Load Heavy Model", disabled=not heavy_model_path):
+                with st.spinner("Loading heavy model..."):
+                    if model_manager.load_heavy_model(heavy_model_path):
+                        st.success("✅ Heavy model loaded")
+            model_manager.cascade_enabled = st.checkbox(
+                "Enable cascade", value=model_manager.cascade_enabled, disabled=model_manager.heavy_model is None
+            )
+            model_manager.cascade_band = st.slider(
+                "Uncertain confidence band", 0.0, 1.0, model_manager.cascade_band, 0.05,
+                help="Frames with main-model detections in this band, new instruments or tracks without a detection go to the heavy model"
+            )
+        
+        # Thread pools and core pinning for inference, OpenCV and decoding
+        with st.expander("🧵 CPU Threads"):
+            planner = st.session_state.surgisafe_core.model_manager.thread_planner
+            nodes = planner.numa_nodes()
+            st.caption(f"{len(planner.available_cores())} cores on {len(nodes)} NUMA node(s)")
+            planner.numa_aware = st.checkbox("NUMA aware", value=planner.numa_aware, help="Keep each stream's cores on one NUMA node")
+            planner.pin = st.checkbox("Pin to cores", value=planner.pin)
+            planner.decode_share = st.slider("Decode share of cores", 0.0, 0.75, planner.decode_share, 0.05)
+            model_manager = st.session_state.surgisafe_core.model_manager
+            model_manager.replicas = st.number_input(
+                "Model replicas", min_value=1, max_value=len(planner.available_cores()), value=model_manager.replicas,
+                disabled=st.session_state.is_running,
+                help="Model processes working on consecutive frames of one video; tracking stays in frame order. Not combined with the cascade"
+            )
+            if model_manager.replicas == 1:
+                model_manager.close_replica_pool()
+            streams = st.number_input(
+                "Concurrent streams", min_value=1, max_value=len(planner.available_cores()), value=1,
+                help="Independent videos analysed at once; unrelated to the model replicas of one video"
+            )
+            st.dataframe(pd.DataFrame(planner.plan(streams)), hide_index=True)
+            model_path = st.session_state.surgisafe_core.model_manager.model_info.get('path')
+            if st.button("🎛️ Auto-tune", disabled=model_path is None or get_frame_index() is None or st.session_state.is_running):
+                frame = get_frame_index().read_frame(0)
+                progress_bar = st.progress(0.0)
+                try:
+                    st.session_state.benchmark_results['threads'] = planner.autotune(
+                        model_path, st.session_state.surgisafe_core.model_manager.class_names, frame, streams,
+                        st.session_state.get('target_width', 640), progress=progress_bar.progress
+                    )
+                except Exception as e:
+                    logger.error(f"Thread auto-tune failed: {str(e)}")
+                    st.error(f"❌ Auto-tune failed: {str(e)}")
+            if 'threads' in st.session_state.benchmark_results:
+                st.dataframe(pd.DataFrame(st.session_state.benchmark_results['threads']).round(1), hide_index=True)
+            if streams in planner.tuned:
+                st.caption(f"Tuned split for {streams} stream(s): {planner.tuned[streams][0]} torch / {planner.tuned[streams][1]} OpenCV threads")
+        
+        st.divider()
+        
+        # Video Source Configuration
+        st.subheader("📹 Video Input")
+        
+        # File upload option
+        uploaded_file = st.file_uploader(
+            "Upload Video File", 
+            type=['mp4', 'avi', 'mov', 'mkv'],
+            help="Supported formats: MP4, AVI, MOV, MKV"
+        )
+        
+        if uploaded_file:
+            try:
+                # Streamlit reruns the script on every interaction: only copy a new upload once
+                upload_key = (uploaded_file.name, uploaded_file.size)
+                if upload_key not in (st.session_state.uploaded_video_key, st.session_state.superseded_upload_key):
+                    video_path, metadata = st.session_state.upload_manager.save(
+                        uploaded_file, st.session_state.session_id
+                    )
+                    st.session_state.video_source = video_path
+                    st.session_state.video_metadata = metadata
+                    st.session_state.uploaded_video_key = upload_key
+                    st.session_state.video_position = 0
+                    resume_video = st.session_state.resume_video
+                    if resume_video and resume_video[0] == metadata['content_hash']:
+                        st.session_state.video_position = resume_video[1]
+                        st.session_state.resume_video = None
+                    get_frame_index()
+                
+                metadata = st.session_state.video_metadata
+                st.success("✅ Video loaded successfully")
+                st.info(f"Duration: {metadata['duration']:.1f}s | Frames: {metadata['total_frames']} | FPS: {metadata['fps']:.1f}")
+                
+                # Random access into the recording through the frame index
+                frame_index = get_frame_index()
+                if frame_index is not None and len(frame_index) > 0:
+                    seek_minutes = st.number_input(
+                        "Start at (min)", min_value=0.0, max_value=float(frame_index.timestamps[-1] / 60),
+                        value=float(frame_index.timestamps[min(st.session_state.video_position, len(frame_index) - 1)] / 60),
+                        step=1.0, disabled=st.session_state.is_running
+                    )
+                    if st.button("⏩ Seek", disabled=st.session_state.is_running):
+                        st.session_state.video_position = frame_index.frame_at_time(seek_minutes * 60)
+                        st.success(f"Analysis will start at frame {st.session_state.video_position}")
+                
+            except Exception as e:
+                st.session_state.uploaded_video_key = None
+                st.error(f"❌ Error processing video: {str(e)}")
+        
+        # EndoVis-style frame folders are read in place; left_frames/right_frames also load the right view
+        with st.expander("📂 Frame Folder"):
+            folder = st.text_input("Folder path", help="A folder of JPEG/PNG frames, or a sequence with left_frames/ and right_frames/")
+            sequence_fps = st.number_input("Frame rate (fps)", 1.0, 120.0, ImageSequenceSource.DEFAULT_FPS, 1.0)
+            if st.button("📂 Load Folder", disabled=st.session_state.is_running or not folder):
+                try:
+                    folder = Path(folder).expanduser()
+                    left_folder = folder / "left_frames" if (folder / "left_frames").is_dir() else folder
+                    metadata = ImageSequenceSource.probe(left_folder, sequence_fps)
+                    st.session_state.video_source = str(left_folder)
+                    st.session_state.video_metadata = metadata
+                    st.session_state.uploaded_video_key = ('folder', str(left_folder))
+                    # The upload still in the file uploader must not replace the folder on the next rerun
+                    st.session_state.superseded_upload_key = (uploaded_file.name, uploaded_file.size) if uploaded_file else None
+                    st.session_state.video_position = 0
+                    st.session_state.frame_index = None
+                    resume_video = st.session_state.resume_video
+                    if resume_video and resume_video[0] == metadata['content_hash']:
+                        st.session_state.video_position = resume_video[1]
+                        st.session_state.resume_video = None
+                    if (folder / "right_frames").is_dir():
+                        st.session_state.right_video_source = str(folder / "right_frames")
+                        st.session_state.right_video_key = ('folder', str(folder / "right_frames"))
+                    st.success(f"✅ {metadata['total_frames']} frames loaded ({metadata['width']}x{metadata['height']})")
+                except Exception as e:
+                    logger.error(f"Error loading frame folder {folder}: {str(e)}")
+                    st.error(f"❌ Error loading frame folder: {str(e)}")
+        
+        # Stereo endoscope: the uploaded video is the left view
+        st.session_state.stereo_mode = st.selectbox(
+            "Stereo", list(StereoMatcher.MODES),
+            index=list(StereoMatcher.MODES).index(st.session_state.stereo_mode),
+            format_func=StereoMatcher.MODES.get, disabled=st.session_state.is_running,
+            help="Track the left and right views as one set of instruments"
+        )
+        if st.session_state.stereo_mode != 'off':
+            right_file = st.file_uploader("Right View Video", type=['mp4', 'avi', 'mov', 'mkv'])
+            if right_file:
+                try:
+                    right_key = (right_file.name, right_file.size)
+                    if st.session_state.right_video_key != right_key:
+                        st.session_state.right_video_source, _ = st.session_state.upload_manager.save(
+                            right_file, st.session_state.session_id, prefix="right"
+                        )
+                        st.session_state.right_video_key = right_key
+                    st.success("✅ Right view loaded")
+                except Exception as e:
+                    st.session_state.right_video_key = None
+                    st.error(f"❌ Error processing right view: {str(e)}")
+            calibration_file = st.file_uploader("Stereo Calibration (JSON)", type=['json'],
+                                                help="'F', or 'K1', 'K2', 'R', 'T'; without it the views are treated as rectified")
+            st.session_state.stereo_calibration = json.loads(calibration_file.getvalue()) if calibration_file else None
+            st.session_state.surgisafe_core.stereo.row_tolerance = st.slider(
+                "Row tolerance (% of height)", 1, 15, int(st.session_state.surgisafe_core.stereo.row_tolerance * 100)
+            ) / 100
+        
+        # Crash recovery from the session checkpoints
+        with st.expander("♻️ Resume Previous Session"):
+            sessions = [
+                meta for meta in SessionCheckpointer.list_sessions()
+                if meta['session_id'] != st.session_state.state_manager.session_id
+            ]
+            if sessions:
+                labels = {
+                    meta['session_id']: (
+                        f"{datetime.fromtimestamp(meta['updated_at']).strftime('%Y-%m-%d %H:%M')} - "
+                        f"{'Camera' if meta['video'].get('camera') else Path(meta['video'].get('path', '?')).name} "
+                        f"({meta['processed_frames']} frames)"
+                    )
+                    for meta in sessions
+                }
+                session_id = st.selectbox("Checkpointed sessions", list(labels), format_func=labels.get)
+                if st.button("♻️ Resume", disabled=st.session_state.is_running):
+                    try:
+                        start_time = time.time()
+                        position = resume_checkpointed_session(session_id)
+                        st.success(f"✅ Session restored in {(time.time() - start_time) * 1000:.0f} ms, resuming at frame {position}")
+                    except Exception as e:
+                        logger.error(f"Error resuming session {session_id}: {str(e)}")
+                        st.error(f"❌ Could not resume session: {str(e)}")
+            else:
+                st.info("No checkpointed sessions")
+        
+        st.divider()
+        
+        # Detection Parameters
+        st.subheader("🎯 Detection Settings")
+        
+        st.session_state.conf_threshold = st.slider(
+            "Confidence Threshold", 
+            0.01, 1.0, 0.05, 0.01,
+            help="Minimum confidence for detections"
+        )
+        
+        st.session_state.iou_threshold = st.slider(
+            "IoU Threshold", 
+            0.1, 1.0, 0.2, 0.05,
+            help="Intersection over Union threshold for NMS"
+        )
+        
+        # Sweep thresholds over an analyzed video using its cached candidates
+        if st.session_state.video_source not in (None, 0) and not st.session_state.is_running:
+            live_rethreshold = st.checkbox(
+                "🔁 Live re-threshold recorded session", value=False,
+                help="Re-apply the thresholds to the cached detections of this video without re-running the model"
+            )
+            thresholds = (st.session_state.conf_threshold, st.session_state.iou_threshold)
+            if live_rethreshold and st.session_state.rethreshold_applied != thresholds:
+                if rethreshold_recorded_session(st.empty()):
+                    st.session_state.rethreshold_applied = thresholds
+                    st.rerun()
+                else:
+                    st.info("Analyze this video once to enable re-thresholding.")
+        
+        st.divider()
+        
+        # Video Processing Settings
+        st.subheader("📏 Processing Settings")
+        
+        st.session_state.target_width = st.slider(
+            "Video Width", 
+            320, 1280, 640, 32,
+            help="Target width for processing (affects performance)"
+        )
+        
+        st.session_state.reader_backend = st.selectbox(
+            "Frame Reader",
+            list(READER_BACKENDS),
+            index=list(READER_BACKENDS).index(st.session_state.reader_backend),
+            format_func=READER_BACKENDS.get,
+            disabled=st.session_state.is_running,
+            help="Decode in a separate process that shares frames through shared memory, leaving the cores of this process to inference, "
+                 "or let ffmpeg scale while decoding. Live cameras always use a capture thread that keeps only the newest frame"
+        )
+        if st.session_state.reader_backend == 'ffmpeg' and not FFmpegPipeSource.available():
+            st.warning("ffmpeg is not installed: the ffmpeg reader will fail to open videos")
+        
+        roi = st.session_state.surgisafe_core.roi
+        roi.mode = st.selectbox(
+            "Inference Region",
+            list(SurgicalFieldROI.MODES),
+            index=list(SurgicalFieldROI.MODES).index(roi.mode),
+            format_func=SurgicalFieldROI.MODES.get,
+            help="Crop inference to the endoscope field of view, or to the area around recent instruments with periodic full sweeps"
+        )
+        
+        # Archive of the annotated stream
+        with st.expander("🎥 Recording"):
+            st.session_state.record_output = st.checkbox(
+                "Record annotated video", value=st.session_state.record_output,
+                help=f"Write the annotated stream to {RECORDINGS_DIR} on a background encoder thread"
+            )
+            settings = st.session_state.recording_settings
+            settings['policy'] = st.selectbox(
+                "When the encoder lags", list(AnnotatedVideoRecorder.POLICIES),
+                index=list(AnnotatedVideoRecorder.POLICIES).index(settings['policy']),
+                format_func=AnnotatedVideoRecorder.POLICIES.get
+            )
+            settings['segment_seconds'] = 60 * st.number_input("Segment length (min)", min_value=1, max_value=120, value=settings['segment_seconds'] // 60)
+            segment_mb = st.number_input("Segment size limit (MB, 0 = none)", min_value=0, max_value=10000, value=(settings['segment_bytes'] or 0) // 1024 ** 2)
+            settings['segment_bytes'] = segment_mb * 1024 ** 2 or None
+            if st.session_state.video_recorder is not None:
+                st.caption(f"Writing to {st.session_state.video_recorder.output_dir}")
+        
+        # Rolling compressed buffer of the annotated stream for alert evidence
+        with st.expander("🎞️ Alert Clips"):
+            core = st.session_state.surgisafe_core
+            settings = st.session_state.clip_settings
+            settings['enabled'] = st.checkbox(
+                "Attach pre-alert clips", value=settings['enabled'],
+                help="Critical and extended alerts, and instruments awaiting loss confirmation, get a clip of the preceding seconds"
+            )
+            settings['seconds'] = st.slider("Seconds before the alert", 2, 60, settings['seconds'])
+            settings['max_mb'] = st.number_input("Memory cap (MB)", min_value=4, max_value=1024, value=settings['max_mb'])
+            settings['jpeg_quality'] = st.slider("JPEG quality", 30, 95, settings['jpeg_quality'])
+            if settings['enabled'] and core.clip_buffer is None:
+                core.clip_buffer = PreAlertClipBuffer()
+            elif not settings['enabled'] and core.clip_buffer is not None:
+                core.clip_buffer.close()
+                core.clip_buffer = None
+            if core.clip_buffer is not None:
+                core.clip_buffer.seconds = settings['seconds']
+                core.clip_buffer.max_bytes = settings['max_mb'] * 1024 ** 2
+                core.clip_buffer.jpeg_quality = settings['jpeg_quality']
+                clip_stats = core.clip_buffer.stats()
+                st.caption(
+                    f"Buffered {clip_stats['frames']} frames ({clip_stats['seconds']:.1f} s, {clip_stats['bytes'] / 1024 ** 2:.1f} MB) | "
+                    f"dropped {clip_stats['frames_dropped']} | {clip_stats['clips_written']} clip(s) written, {clip_stats['clips_dropped']} dropped"
+                )
+        
+        # Alert delivery to external systems, off the frame loop
+        with st.expander("📣 Alert Delivery"):
+            core = st.session_state.surgisafe_core
+            receiver = st.session_state.alert_receiver
+            webhook_url = st.text_input("Webhook URL", value=receiver.url if receiver else "")
+            syslog_address = st.text_input("Syslog collector (host:port)", value="")
+            alert_file = st.text_input("Alert log file", value="", help=f"e.g. {SESSION_DATA_DIR.parent / 'alerts.jsonl'}")
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("✅ Apply Sinks"):
+                    try:
+                        sinks = []
+                        if webhook_url:
+                            sinks.append(WebhookAlertSink(webhook_url))
+                        if syslog_address:
+                            host, _, port = syslog_address.rpartition(':')
+                            sinks.append(SyslogAlertSink(host or 'localhost', int(port)))
+                        if alert_file:
+                            sinks.append(FileAlertSink(Path(alert_file).expanduser()))
+                        if core.alert_dispatcher is not None:
+                            core.alert_dispatcher.close()
+                        core.alert_dispatcher = AlertDispatcher(sinks) if sinks else None
+                    except Exception as e:
+                        logger.error(f"Error configuring alert sinks: {str(e)}")
+                        st.error(f"❌ Invalid alert sink: {str(e)}")
+            with col2:
+                if st.button("🧪 Local Receiver", disabled=receiver is not None,
+                             help="Start a local HTTP endpoint that records webhook deliveries"):
+                    st.session_state.alert_receiver = LocalAlertReceiver()
+                    st.rerun()
+            if core.alert_dispatcher is not None:
+                if st.button("📨 Send Test Alert"):
+                    core.alert_dispatcher.submit([{
+                        'timestamp': datetime.now(), 'level': 'warning', 'message': "Test alert",
+                        'instrument_id': f"test_{uuid.uuid4().hex[:6]}", 'duration': 0
+                    }], st.session_state.state_manager.session_id)
+                st.dataframe(pd.DataFrame(core.alert_dispatcher.stats()).round(1), hide_index=True)
+                st.caption(f"Deduplicated: {core.alert_dispatcher.deduplicated}")
+            if receiver is not None:
+                st.caption(f"Local receiver at {receiver.url} got {len(receiver.alerts())} alert(s)")
+        
+        # Viewers subscribe to this session's live state instead of running their own model
+        with st.expander("📡 Live Broadcast"):
+            core = st.session_state.surgisafe_core
+            if not LiveStateBroadcaster.available():
+                st.info("Install the websockets package to broadcast live state")
+            elif core.broadcaster is None:
+                broadcast_port = st.number_input("Port", min_value=0, max_value=65535, value=8765,
+                                                 help="Viewers connect to ws://<host>:<port>; 0 picks a free port")
+                # Session state is unauthenticated: other machines only see it when explicitly allowed
+                external = st.checkbox("Allow viewers on other machines", value=False,
+                                       help="Listen on every network interface instead of this machine only; there is no authentication")
+                if st.button("📡 Start Broadcast"):
+                    try:
+                        broadcaster = LiveStateBroadcaster(host='0.0.0.0' if external else '127.0.0.1', port=int(broadcast_port))
+                        broadcaster.start()
+                        core.broadcaster = broadcaster
+                        st.rerun()
+                    except Exception as e:
+                        logger.error(f"Error starting live broadcast: {str(e)}")
+                        st.error(f"❌ Could not start broadcast: {str(e)}")
+            else:
+                broadcast_stats = core.broadcaster.stats()
+                host = socket.gethostname() if core.broadcaster.host == '0.0.0.0' else core.broadcaster.host
+                st.success(f"Broadcasting on ws://{host}:{core.broadcaster.port}")
+                st.caption(
+                    f"{broadcast_stats['clients']} viewer(s) | {broadcast_stats.get('messages', 0)} messages | "
+                    f"{broadcast_stats.get('coalesced', 0)} coalesced updates"
+                )
+                if st.button("⏹️ Stop Broadcast"):
+                    core.broadcaster.close()
+                    core.broadcaster = None
+                    st.rerun()
+        
+        # Advanced settings
+        with st.expander("🔧 Advanced Settings"):
+            st.session_state.alert_sound = st.checkbox("Enable Alert Sounds", value=True)
+            st.session_state.show_confidence = st.checkbox("Show Confidence Values", value=True)
+            st.session_state.use_detection_cache = st.checkbox(
+                "Reuse cached detections", value=True,
+                help="Replay stored tracks instead of re-running the model on a video that was already analyzed"
+            )
+            st.session_state.surgisafe_core.model_manager.fused_preprocessing = st.checkbox(
+                "Fused preprocessing", value=True,
+                help="Letterbox, color conversion and normalization in one pass into reused buffers"
+            )
+            
+            # Preprocessing benchmark on the first frame of the current video
+            if st.button("🧪 Benchmark Preprocessing", disabled=get_frame_index() is None):
+                frame = get_frame_index().read_frame(0)
+                if frame is not None:
+                    st.session_state.benchmark_results['preprocessing'] = benchmark_preprocessing(
+                        frame, st.session_state.target_width,
+                        st.session_state.surgisafe_core.model_manager.preprocessor.input_size
+                    )
+            if 'preprocessing' in st.session_state.benchmark_results:
+                results = st.session_state.benchmark_results['preprocessing']
+                st.dataframe(pd.DataFrame({name: results[name] for name in ('legacy', 'fused')}).T.round(2))
+                st.caption(f"Fused preprocessing speedup: {results['speedup']:.2f}x")
+            
+            # Reader benchmark on the start of the current video
+            if st.button("🧪 Benchmark Frame Readers", disabled=get_frame_index() is None or st.session_state.is_running):
+                st.session_state.benchmark_results['readers'] = benchmark_reader_backends(
+                    st.session_state.video_source, st.session_state.target_width
+                )
+            if 'readers' in st.session_state.benchmark_results:
+                st.dataframe(pd.DataFrame(st.session_state.benchmark_results['readers']).T.round(2))
+            st.session_state.auto_export = st.checkbox("Auto-export data on session end", value=False)
+            
+            # Alert thresholds customization
+            st.write("**Alert Thresholds (minutes):**")
+            warning_threshold = st.number_input("Warning", min_value=1, max_value=60, value=10)
+            danger_threshold = st.number_input("Danger", min_value=1, max_value=60, value=20)
+            critical_threshold = st.number_input("Critical", min_value=1, max_value=60, value=30)
+            
+            # Update thresholds in alert manager
+            if hasattr(st.session_state.surgisafe_core, 'alert_manager'):
+                st.session_state.surgisafe_core.alert_manager.alert_thresholds.update({
+                    'warning': warning_threshold,
+                    'danger': danger_threshold,
+                    'critical': critical_threshold
+                })
+        
+        # Headless replay of recorded logs to tune the alert logic
+        with st.expander("🔁 Replay Lab"):
+            replay_folder = st.text_input(
+                "Logs folder", value=str(st.session_state.detection_cache.root),
+                help="Folder of track logs (.jsonl) and/or detection cache entries"
+            )
+            lost_after_seconds = st.number_input("Lost after (s)", min_value=1.0, max_value=120.0, value=5.0, step=1.0)
+            if st.button("▶️ Replay Logs"):
+                try:
+                    core = st.session_state.surgisafe_core
+                    settings = {
+                        'conf_threshold': st.session_state.conf_threshold,
+                        'iou_threshold': st.session_state.iou_threshold,
+                        'alert_thresholds': dict(core.alert_manager.alert_thresholds),
+                        'lost_after_seconds': lost_after_seconds,
+                        'risk_thresholds': dict(core.risk_thresholds)
+                    }
+                    sources = find_replay_sources(replay_folder)
+                    with st.spinner(f"Replaying {len(sources)} logs..."):
+                        results = replay_batch([(str(source), settings) for source in sources])
+                    st.session_state.benchmark_results['replay'] = [
+                        {
+                            'source': Path(result['source']).name,
+                            'frames': result.get('frames', 0),
+                            'speedup': round(result.get('speedup', 0), 1),
+                            'instruments': len(result.get('instruments', [])),
+                            **result.get('alert_level_counts', {}),
+                            'error': result.get('error', '')
+                        }
+                        for result in results
+                    ]
+                except Exception as e:
+                    logger.error(f"Replay error: {str(e)}")
+                    st.error(f"❌ Replay failed: {str(e)}")
+            if st.session_state.benchmark_results.get('replay'):
+                st.dataframe(pd.DataFrame(st.session_state.benchmark_results['replay']).fillna(0))
+        
+        # Accuracy/speed operating point from labeled frames
+        with st.expander("📐 Evaluation"):
+            dataset_root = st.text_input("Dataset folder", help="EndoVis-style sequence folder(s) with left_frames/ and ground_truth/ or labels/")
+            eval_widths = st.multiselect("Widths", [320, 416, 512, 640, 800, 960, 1280], default=[320, 640])
+            eval_confs = st.text_input("Confidence thresholds", value="0.05, 0.25, 0.5")
+            eval_ious = st.text_input("IoU thresholds", value="0.2, 0.45")
+            eval_workers = st.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=max(1, (os.cpu_count() or 2) // 2))
+            model_info = st.session_state.state_manager.model_info
+            if st.button("📐 Run Evaluation", disabled=not (dataset_root and model_info)):
+                try:
+                    harness = EvaluationHarness(
+                        model_info['path'], st.session_state.surgisafe_core.model_manager.class_names,
+                        st.session_state.detection_cache, int(eval_workers)
+                    )
+                    progress = st.progress(0.0, "Running inference...")
+                    rows = harness.sweep(
+                        dataset_root, eval_widths,
+                        [float(v) for v in eval_confs.split(',') if v.strip()],
+                        [float(v) for v in eval_ious.split(',') if v.strip()],
+                        progress=lambda fraction: progress.progress(fraction, "Running inference...")
+                    )
+                    st.session_state.benchmark_results['evaluation'] = EvaluationHarness.summarize(rows)
+                except Exception as e:
+                    logger.error(f"Evaluation error: {str(e)}")
+                    st.error(f"❌ Evaluation failed: {str(e)}")
+            evaluation = st.session_state.benchmark_results.get('evaluation')
+            if evaluation is not None and not evaluation.empty:
+                st.dataframe(evaluation.round(3))
+                if 'pareto' in evaluation:
+                    front = evaluation[evaluation['pareto']].sort_values('throughput_fps')
+                    fig = px.line(front, x='throughput_fps', y='mAP50', markers=True, hover_data=['target_width', 'conf_threshold', 'iou_threshold'])
+                    fig.update_layout(title="Speed/accuracy front", height=300)
+                    st.plotly_chart(fig, use_container_width=True)
+    
+    # Enhanced Control Panel
+    st.subheader("🎮 Control Panel")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        if st.button("▶️ Start Analysis", disabled=st.session_state.is_running, type="primary"):
+            if not st.session_state.state_manager.model_info:
+                st.error("❌ Please load a model first")
+            elif st.session_state.video_source is None:
+                st.error("❌ Please select a video source")
+            else:
+                st.session_state.is_running = True
+                st.session_state.state_manager.system_status = 'running'
+                st.success("✅ Analysis started successfully!")
+                st.rerun()
+    
+    with col2:
+        if st.button("⏹️ Stop Analysis", disabled=not st.session_state.is_running):
+            st.session_state.is_running = False
+            st.session_state.state_manager.system_status = 'stopped'
+            if st.session_state.cap:
+                st.session_state.cap.release()
+                st.session_state.cap = None
+            st.session_state.surgisafe_core.detach_checkpointer(
+                st.session_state.state_manager, st.session_state.video_position
+            )
+            st.session_state.surgisafe_core.model_manager.close_replica_pool()
+            close_video_recorder()
+            st.success("✅ Analysis stopped")
+            st.rerun()
+    
+    with col3:
+        if st.button("🔄 Reset Session"):
+            core = st.session_state.surgisafe_core
+            # Keep a final checkpoint so the session can still be resumed
+            core.detach_checkpointer(st.session_state.state_manager, st.session_state.video_position)
+            
+            # Stop everything the session started before its handles are dropped
+            if st.session_state.cap:
+                st.session_state.cap.release()
+            core.model_manager.close_replica_pool()
+            close_video_recorder()
+            if core.alert_dispatcher is not None:
+                core.alert_dispatcher.close()
+                core.alert_dispatcher = None
+            if st.session_state.get('alert_receiver') is not None:
+                st.session_state.alert_receiver.close()
+            if core.broadcaster is not None:
+                core.broadcaster.close()
+                core.broadcaster = None
+            if core.clip_buffer is not None:
+                core.clip_buffer.close()
+                core.clip_buffer = None
+            
+            # Release temporary uploads before the session id is dropped
+            if 'upload_manager' in st.session_state:
+                st.session_state.upload_manager.release_session(st.session_state.session_id)
+            
+            # Reset all session data; the core and its loaded models are kept, without the old session's tracks and alerts
+            for key in list(st.session_state.keys()):
+                if key not in ('surgisafe_core', 'state_manager'):
+                    del st.session_state[key]
+            core.reset_tracking()
+            core.alert_manager.sent_alerts.clear()
+            core.current_frame_index = None
+            st.session_state.state_manager = SurgiSafeStateManager()
+            st.success("✅ Session reset")
+            st.rerun()
+    
+    with col4:
+        if st.button("📊 Generate Report"):
+            if st.session_state.state_manager.detected_instruments or st.session_state.state_manager.alert_history:
+                report_data = generate_comprehensive_report()
+                st.download_button(
+                    label="⬇️ Download Full Report (JSON)",
+                    data=report_data,
+                    file_name=f"surgisafe_full_report_{int(datetime.now().timestamp())}.json",
+                    mime="application/json"
+                )
+            else:
+                st.warning("No data available for report generation")
+    
+    # Enhanced Dashboard
+    if st.session_state.state_manager.processed_frames > 0:
+        st.divider()
+        create_performance_dashboard()
+
+def simple_chatbot():
+    st.sidebar.subheader("💬 Support Chatbot")
+    user_input = st.sidebar.text_input("Posez-moi une question sur SurgiSafe Pro :")
+    
+    if user_input:
+        responses = {
+            "comment fonctionne-t-il ?": "SurgiSafe Pro détecte et suit les instruments chirurgicaux en temps réel avec YOLOv8, génère des alertes basées sur la durée, et offre des statistiques via une interface intuitive.",
+            "quels instruments sont détectés ?": "Il détecte des instruments comme Right_Prograsp_Forceps, Maryland_Bipolar_Forceps, et d'autres listés dans le modèle.",
+            "comment exporter les données ?": "Vous pouvez exporter les données des instruments, alertes, et historique via les boutons dans l'onglet 'Export Data'.",
+            "aide": "Tapez une question spécifique ou consultez la barre latérale pour les réglages !"
+        }
+        response = responses.get(user_input.lower(), "Désolé, je n'ai pas compris. Essayez 'aide' pour plus d'options.")
+        st.sidebar.write(f"🤖 Réponse : {response}")
+
+if __name__ == "__main__":
+    main()
+    simple_chatbot()
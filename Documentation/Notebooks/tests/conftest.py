@@ -0,0 +1,17 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+APP_PATH = Path(__file__).resolve().parents[1] / "app.py"
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The Streamlit app module, imported without running its UI"""
+    for module in ("streamlit", "ultralytics", "torch", "cv2"):
+        pytest.importorskip(module)
+    spec = importlib.util.spec_from_file_location("surgisafe_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,128 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+START = datetime(2024, 1, 1, 8, 0, 0)
+
+
+@pytest.fixture
+def session(app, tmp_path, monkeypatch):
+    """A checkpointed core on a simulated clock, with small retention limits so records get spilled"""
+    monkeypatch.setattr(app, 'SESSION_DATA_DIR', tmp_path)
+    state_manager = app.SurgiSafeStateManager()
+    state_manager.session_start_time = START
+    state_manager.retention = app.RetentionPolicy(
+        inactive_instrument_seconds=60, max_inactive_instruments=2, max_alert_history=5, compaction_interval_frames=10
+    )
+    core = app.SurgiSafeCore(state_manager)
+    core.clock = app.SimulatedClock(START)
+    core.model_manager.class_names = {0: 'Scissors', 1: 'Forceps'}
+    core.alert_manager.alert_thresholds = {'warning': 0.5, 'danger': 1, 'critical': 2, 'extended': 4}
+    core.checkpointer = app.SessionCheckpointer(state_manager.session_id, snapshot_interval_frames=120)
+    yield core
+    if core.checkpointer is not None:
+        core.checkpointer.close()
+
+
+def run_frames(core, start, stop, seconds_per_frame=30.0):
+    for frame in range(start, stop):
+        core.clock.set_offset(frame * seconds_per_frame)
+        core.current_frame_index = frame
+        y = (frame // 25) * 60
+        boxes = np.array([[10 + i * 60, y, 50 + i * 60, y + 40] for i in range(4)], dtype=np.float32)
+        core.process_frame(None, 0.3, 0.4, candidates={
+            'boxes': boxes, 'scores': np.full(4, 0.9, dtype=np.float32), 'classes': np.array([0, 1, 0, 1], dtype=np.int16)
+        })
+
+
+def crash(core):
+    """Wait for the writer to drain what was queued, then drop the checkpointer without a final snapshot"""
+    core.checkpointer.queue.join()
+
+
+def alert_keys(alerts):
+    return [(alert['timestamp'] if isinstance(alert['timestamp'], str) else alert['timestamp'].isoformat(), alert['message'])
+            for alert in alerts]
+
+
+def assert_same_session(app, core, state):
+    live = core.state_manager
+    restored = app.SurgiSafeStateManager.from_checkpoint(state, core.clock)
+    assert restored.session_id == live.session_id
+    assert restored.processed_frames == live.processed_frames
+    assert state['position'] == core.current_frame_index + 1
+    assert {key: i.to_state() for key, i in restored.detected_instruments.items()} == \
+        {key: i.to_state() for key, i in live.detected_instruments.items()}
+    assert set(restored.pending_confirmations) == set(live.pending_confirmations)
+    assert dict(restored.alert_level_counts) == dict(live.alert_level_counts)
+    assert alert_keys(restored.all_alerts()) == alert_keys(live.all_alerts())
+    assert alert_keys(restored.alerts_queue) == alert_keys(live.alerts_queue)
+    assert restored.export_data == live.export_data
+    assert sorted(state['sent_alerts']) == sorted(core.alert_manager.sent_alerts)
+    assert state['tracker'] == core.model_manager.tracker.get_state()
+    return restored
+
+
+def test_resume_after_crash_matches_live_state(app, session):
+    run_frames(session, 0, 300)
+    crash(session)
+
+    state = app.SessionCheckpointer.load(session.state_manager.session_id)
+    # 300 frames with a snapshot every 120: the state is a snapshot plus a replayed journal
+    assert state['sequence'] == 300
+    assert (app.SESSION_DATA_DIR / session.state_manager.session_id / "journal.jsonl").stat().st_size > 0
+    assert session.state_manager.alerts_spilled > 0
+    assert_same_session(app, session, state)
+
+
+def test_export_rows_survive_resume(app, session):
+    for frame in range(50):
+        session.state_manager.export_data.append({'frame': frame})
+        run_frames(session, frame, frame + 1)
+    session.state_manager.retention.max_export_rows = 10
+    run_frames(session, 50, 150)
+    crash(session)
+
+    state = app.SessionCheckpointer.load(session.state_manager.session_id)
+    restored = assert_same_session(app, session, state)
+    assert restored.export_spilled == session.state_manager.export_spilled > 0
+
+
+def test_torn_final_journal_line_is_ignored(app, session):
+    run_frames(session, 0, 200)
+    crash(session)
+    session_dir = app.SESSION_DATA_DIR / session.state_manager.session_id
+    with open(session_dir / "journal.jsonl", 'a', encoding='utf-8') as journal:
+        journal.write('{"sequence": 201, "position": 9')
+
+    assert_same_session(app, session, app.SessionCheckpointer.load(session.state_manager.session_id))
+
+
+def test_journal_entries_older_than_the_snapshot_are_skipped(app, session):
+    run_frames(session, 0, 130)
+    crash(session)
+    session_dir = app.SESSION_DATA_DIR / session.state_manager.session_id
+    snapshot_sequence = json.loads((session_dir / "snapshot.json").read_text(encoding='utf-8'))['sequence']
+    journal_lines = (session_dir / "journal.jsonl").read_text(encoding='utf-8').splitlines()
+    assert json.loads(journal_lines[0])['sequence'] == snapshot_sequence + 1
+
+    # A delta the snapshot already covers, e.g. left behind by a crash between the two writes
+    stale = dict(json.loads(journal_lines[0]), sequence=snapshot_sequence, processed_frames=-1, alerts=[])
+    (session_dir / "journal.jsonl").write_text("\n".join([json.dumps(stale)] + journal_lines) + "\n", encoding='utf-8')
+
+    assert_same_session(app, session, app.SessionCheckpointer.load(session.state_manager.session_id))
+
+
+def test_flush_writes_a_complete_snapshot(app, session):
+    run_frames(session, 0, 90)
+    session.detach_checkpointer(session.state_manager, 90)
+    session_dir = app.SESSION_DATA_DIR / session.state_manager.session_id
+    assert (session_dir / "journal.jsonl").stat().st_size == 0
+
+    state = app.SessionCheckpointer.load(session.state_manager.session_id)
+    restored = app.SurgiSafeStateManager.from_checkpoint(state, session.clock)
+    assert state['position'] == 90
+    assert alert_keys(restored.all_alerts()) == alert_keys(session.state_manager.all_alerts())
+    assert app.SessionCheckpointer.list_sessions(app.SESSION_DATA_DIR)[0]['session_id'] == session.state_manager.session_id
@@ -0,0 +1,61 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+START = datetime(2024, 1, 1, 8, 0, 0)
+
+
+@pytest.fixture
+def clip_buffer(app):
+    """A clip buffer encoded on the test thread, whose clip writer waits until released"""
+    class BlockedClipBuffer(app.PreAlertClipBuffer):
+        release = threading.Event()
+        
+        def _write_clip(self, frames, paths, clip_id):
+            self.release.wait(timeout=10)
+            super()._write_clip(frames, paths, clip_id)
+    
+    buffer = BlockedClipBuffer(seconds=60, max_bytes=200_000, max_pending_clips=2)
+    buffer.pending.put(None)
+    buffer.encoder.join()
+    yield buffer
+    buffer.release.set()
+    buffer.close()
+
+
+def encode_pending(buffer):
+    buffer.pending.put(None)
+    buffer._encode_loop()
+
+
+def add_frames(buffer, start, count):
+    rng = np.random.default_rng(start)
+    for i in range(start, start + count):
+        # Noise compresses poorly, so a few dozen frames fill the byte budget
+        buffer.add(rng.integers(0, 255, (120, 160, 3), dtype=np.uint8), START + timedelta(seconds=i / 25))
+        encode_pending(buffer)
+        assert buffer.ring_bytes + buffer.held_bytes <= buffer.max_bytes
+
+
+def test_clips_in_flight_count_against_the_byte_cap(clip_buffer, tmp_path):
+    add_frames(clip_buffer, 0, 40)
+    assert clip_buffer.held_bytes == 0
+    for n in range(3):
+        clip_buffer.request_clip(f"alert_{n}", tmp_path)
+    # The ring moves on; frames only the queued clips hold keep counting against the budget
+    add_frames(clip_buffer, 40, 40)
+    assert clip_buffer.held_bytes > 0
+    
+    # The third clip was dropped rather than queued behind the two still being written
+    assert clip_buffer.stats()['clips_dropped'] == 1
+    
+    clip_buffer.release.set()
+    clip_buffer.clip_writer.shutdown(wait=True)
+    encode_pending(clip_buffer)
+    assert clip_buffer.held_bytes == 0 and not clip_buffer.held
+    add_frames(clip_buffer, 80, 40)
+    assert clip_buffer.ring_bytes > clip_buffer.max_bytes / 2
+    assert clip_buffer.stats()['clips_written'] == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['alert_0.jpg', 'alert_0.mp4', 'alert_1.jpg', 'alert_1.mp4']
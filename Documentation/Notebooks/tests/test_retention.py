@@ -0,0 +1,117 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+START = datetime(2024, 1, 1, 8, 0, 0)
+
+
+@pytest.fixture
+def session(app, tmp_path):
+    """A core on a simulated clock with small retention limits, spilling under tmp_path"""
+    state_manager = app.SurgiSafeStateManager()
+    state_manager.session_start_time = START
+    state_manager.spill_store = app.SessionSpillStore(tmp_path / "spill")
+    state_manager.retention = app.RetentionPolicy(
+        inactive_instrument_seconds=60, max_inactive_instruments=2, max_alert_history=5, compaction_interval_frames=10
+    )
+    core = app.SurgiSafeCore(state_manager)
+    core.clock = app.SimulatedClock(START)
+    core.model_manager.class_names = {0: 'Scissors', 1: 'Forceps'}
+    core.alert_manager.alert_thresholds = {'warning': 0.5, 'danger': 1, 'critical': 2, 'extended': 4}
+    return core
+
+
+def run_frames(core, count, seconds_per_frame=30.0):
+    """Instruments that jump to a new place every 25 frames, so tracks keep starting and getting lost"""
+    for frame in range(count):
+        core.clock.set_offset(frame * seconds_per_frame)
+        core.current_frame_index = frame
+        y = (frame // 25) * 60
+        boxes = np.array([[10 + i * 60, y, 50 + i * 60, y + 40] for i in range(4)], dtype=np.float32)
+        core.process_frame(None, 0.3, 0.4, candidates={
+            'boxes': boxes, 'scores': np.full(4, 0.9, dtype=np.float32), 'classes': np.array([0, 1, 0, 1], dtype=np.int16)
+        })
+
+
+def alert_keys(alerts):
+    return [(alert['timestamp'] if isinstance(alert['timestamp'], str) else alert['timestamp'].isoformat(), alert['message'])
+            for alert in alerts]
+
+
+def test_spill_store_round_trip(app, tmp_path):
+    store = app.SessionSpillStore(tmp_path / "spill")
+    store.append('alerts', [{'timestamp': START, 'level': 'warning', 'value': np.float32(1.5)}])
+    store.append('alerts', [{'timestamp': START, 'level': 'danger', 'value': np.int64(2)}])
+    store.append('alerts', [])
+
+    records = list(store.iter_records('alerts'))
+    assert records == [
+        {'timestamp': START.isoformat(), 'level': 'warning', 'value': 1.5},
+        {'timestamp': START.isoformat(), 'level': 'danger', 'value': 2},
+    ]
+    assert store.counts['alerts'] == 2
+    assert list(store.iter_records('instruments')) == []
+
+
+def test_compaction_bounds_memory_and_keeps_every_record(app, session):
+    state_manager = session.state_manager
+    run_frames(session, 300)
+
+    assert len(state_manager.alert_history) <= state_manager.retention.max_alert_history
+    assert state_manager.alerts_spilled > 0
+    assert len(state_manager.detected_instruments.with_status('lost')) <= state_manager.retention.max_inactive_instruments
+
+    # Spilled and in-memory records read back as one chronological session
+    all_alerts = state_manager.all_alerts()
+    assert len(all_alerts) == state_manager.total_alerts()
+    timestamps = [key for key, _ in alert_keys(all_alerts)]
+    assert timestamps == sorted(timestamps)
+
+    records = state_manager.all_instrument_records()
+    assert len(records) == len({record['id'] for record in records})
+    spilled_ids = {record['id'] for record in state_manager.spill_store.iter_records('instruments')}
+    assert spilled_ids
+    assert not spilled_ids & set(state_manager.detected_instruments)
+
+
+def test_compaction_forgets_spilled_instruments_alerts(app, session):
+    run_frames(session, 300)
+    spilled_ids = {record['id'] for record in session.state_manager.spill_store.iter_records('instruments')}
+    for key in session.alert_manager.sent_alerts:
+        instrument_id = key.partition('_')[2].rsplit('_', 1)[0]
+        assert instrument_id not in spilled_ids
+
+
+def test_track_log_covers_the_whole_session(app, session, tmp_path):
+    state_manager = session.state_manager
+    state_manager.detection_history = app.deque(maxlen=50)
+    run_frames(session, 300)
+    assert list(state_manager.spill_store.iter_records('tracks'))
+
+    path = tmp_path / "tracks.jsonl"
+    path.write_text("".join(app.track_log_lines(state_manager.all_track_records(), START)), encoding='utf-8')
+    header, frames = app.read_track_log(path)
+    assert header['session_start_time'] == START.isoformat()
+    assert [frame_index for frame_index, _, _ in frames] == list(range(300))
+    assert [timestamp for _, timestamp, _ in frames] == [frame * 30.0 for frame in range(300)]
+    assert all(len(tracks) == 4 for _, _, tracks in frames)
+
+
+def test_instrument_store_indexes_follow_transitions(app):
+    clock = app.SimulatedClock(START)
+    store = app.InstrumentStore({
+        key: app.InstrumentInfo(key, 'Scissors', [0, 0, 10, 10], 0.9, track_id, clock)
+        for track_id, key in enumerate(['a', 'b', 'c'], 1)
+    })
+    assert store.count('active') == 3 and store.count_risk('normal') == 3
+
+    clock.set_offset(25 * 60)
+    store['a'].update_risk_level()
+    store['b'].status = 'lost'
+    assert (store.count_risk('danger'), store.count_risk('normal')) == (1, 2)
+    assert (store.count('active'), store.count('lost')) == (2, 1)
+
+    del store['a']
+    assert store.count_risk('danger') == 0 and store.count('active') == 1
+    assert [instrument.id for instrument in store.with_status('lost')] == ['b']
@@ -0,0 +1,112 @@
+import numpy as np
+
+
+def detections(*rows):
+    """(boxes, scores, classes) arrays from (x1, y1, x2, y2, score, class) rows"""
+    rows = np.array(rows, dtype=np.float32).reshape(-1, 6)
+    return rows[:, :4], rows[:, 4], rows[:, 5].astype(np.int16)
+
+
+def candidates(*rows):
+    boxes, scores, classes = detections(*rows)
+    return {'boxes': boxes, 'scores': scores, 'classes': classes}
+
+
+def test_box_iou_matrix(app):
+    a = np.array([[0, 0, 10, 10]], dtype=np.float32)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]], dtype=np.float32)
+    np.testing.assert_allclose(app.box_iou_matrix(a, b), [[1.0, 50 / 150, 0.0]], rtol=1e-6)
+
+
+def test_nms_suppresses_overlaps_within_a_class_only(app):
+    boxes, scores, classes = detections(
+        (0, 0, 10, 10, 0.9, 0),
+        (1, 0, 11, 10, 0.8, 0),  # Same class, overlaps the first: suppressed
+        (1, 0, 11, 10, 0.7, 1),  # Same place, other class: kept
+        (50, 50, 60, 60, 0.6, 0),
+    )
+    keep = app.class_aware_nms(boxes, scores, classes, 0.5)
+    assert keep.tolist() == [0, 2, 3]
+
+
+def test_nms_keeps_highest_score_first(app):
+    boxes, scores, classes = detections((0, 0, 10, 10, 0.3, 0), (0, 0, 10, 10, 0.9, 0))
+    assert app.class_aware_nms(boxes, scores, classes, 0.5).tolist() == [1]
+
+
+def test_filter_candidates_applies_confidence_then_nms(app):
+    filtered = app.filter_candidates(
+        candidates((0, 0, 10, 10, 0.9, 0), (1, 0, 11, 10, 0.8, 0), (30, 30, 40, 40, 0.1, 0)), 0.2, 0.5
+    )
+    assert filtered['scores'].tolist() == [np.float32(0.9)]
+
+
+def test_empty_candidates_pass_through(app):
+    filtered = app.filter_candidates(app.empty_candidates(), 0.3, 0.4)
+    assert len(filtered['boxes']) == 0
+    assert app.class_aware_nms(filtered['boxes'], filtered['scores'], filtered['classes'], 0.4).size == 0
+
+    tracker = app.InstrumentTracker()
+    assert tracker.update(filtered['boxes'], filtered['scores'], filtered['classes']).size == 0
+    assert len(tracker.ids) == 0
+
+
+def test_ids_persist_across_moving_detections(app):
+    tracker = app.InstrumentTracker()
+    first = tracker.update(*detections((0, 0, 20, 20, 0.9, 0), (100, 100, 120, 120, 0.9, 1)))
+    assert first.tolist() == [1, 2]
+    for step in range(1, 10):
+        # Listed in the other order to make sure IDs follow the boxes, not the positions in the list
+        ids = tracker.update(*detections(
+            (100 + step, 100, 120 + step, 120, 0.9, 1),
+            (step * 2, 0, 20 + step * 2, 20, 0.9, 0),
+        ))
+        assert ids.tolist() == [2, 1]
+
+
+def test_association_is_class_gated(app):
+    tracker = app.InstrumentTracker()
+    tracker.update(*detections((0, 0, 20, 20, 0.9, 0)))
+    ids = tracker.update(*detections((0, 0, 20, 20, 0.9, 1)))
+    assert ids.tolist() == [2]
+
+
+def test_low_score_detections_extend_tracks_but_never_start_them(app):
+    tracker = app.InstrumentTracker(high_threshold=0.5)
+    tracker.update(*detections((0, 0, 20, 20, 0.9, 0)))
+    assert tracker.update(*detections((1, 0, 21, 20, 0.2, 0))).tolist() == [1]
+    assert tracker.update(*detections((200, 200, 220, 220, 0.2, 0))).tolist() == [-1]
+    assert tracker.ids.tolist() == [1]
+
+
+def test_lost_tracks_coast_then_expire(app):
+    tracker = app.InstrumentTracker(max_lost_frames=3)
+    tracker.update(*detections((0, 0, 20, 20, 0.9, 0)))
+    empty = app.empty_candidates()
+    for _ in range(3):
+        tracker.update(empty['boxes'], empty['scores'], empty['classes'])
+    # Still within max_lost_frames: the instrument comes back under its old ID
+    assert tracker.update(*detections((0, 0, 20, 20, 0.9, 0))).tolist() == [1]
+
+    for _ in range(4):
+        tracker.update(empty['boxes'], empty['scores'], empty['classes'])
+    assert len(tracker.ids) == 0
+    assert tracker.update(*detections((0, 0, 20, 20, 0.9, 0))).tolist() == [2]
+
+
+def test_tracker_state_round_trip(app):
+    tracker = app.InstrumentTracker()
+    tracker.update(*detections((0, 0, 20, 20, 0.9, 0), (50, 50, 70, 70, 0.9, 1)))
+    tracker.update(*detections((2, 0, 22, 20, 0.9, 0)))
+
+    restored = app.InstrumentTracker()
+    restored.set_state(tracker.get_state())
+    frame = detections((4, 0, 24, 20, 0.9, 0), (50, 50, 70, 70, 0.9, 1))
+    assert restored.update(*frame).tolist() == tracker.update(*frame).tolist()
+
+
+def test_candidates_to_tracks_drops_unknown_classes(app):
+    manager = app.YOLOModelManager()
+    manager.class_names = {0: 'Scissors'}
+    tracks = manager.candidates_to_tracks(candidates((0, 0, 20, 20, 0.9, 0), (50, 50, 70, 70, 0.9, 5)), 0.3, 0.4)
+    assert [(track['track_id'], track['class_name'], track['bbox']) for track in tracks] == [(1, 'Scissors', [0, 0, 20, 20])]